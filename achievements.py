@@ -1,5 +1,8 @@
 # Система достижений для сотрудников
 
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
 ACHIEVEMENTS = {
     # === ЗАКАЗЫ ===
     "first_order": {
@@ -259,6 +262,76 @@ ACHIEVEMENTS = {
 }
 
 
+# === ПРАВИЛА ПРОВЕРКИ ===
+# Каждый тип условия объявляет метрику, которую нужно посчитать: условие выполнено,
+# когда метрика >= condition["value"]. Метрики из БД перечислены в db.ACHIEVEMENT_METRICS_SQL
+# и считаются одним запросом, метрики заказа считаются по данным самого заказа (order_metrics).
+# Типы условий без правила (top_position - итог месяца) при подтверждении заказа не проверяются.
+
+ACHIEVEMENT_RULES = {
+    "orders_count": {"metric": "total_orders"},
+    "month_earnings": {"metric": "month_earnings"},
+    "total_earnings": {"metric": "total_earnings"},
+    "orders_per_day": {"metric": "today_orders"},
+    "day_earnings": {"metric": "today_earnings"},
+    "team_orders": {"metric": "team_orders"},
+    "alumochrome_orders": {"metric": "alumochrome_orders"},
+    "big_sizes": {"metric": "big_size_orders"},
+    "perfect_orders": {"metric": "perfect_orders"},
+    "work_streak": {"metric": "work_streak"},
+    "comeback": {"metric": "comeback_gap"},
+    "orders_per_hour": {"metric": "hour_orders"},
+    "single_order_price": {"metric": "order_price"},
+    "night_order": {"metric": "night_order"},
+    "early_order": {"metric": "early_order"},
+}
+
+# Метрики, которые считаются по данным заказа без обращения к БД
+ORDER_METRICS = {"order_price", "night_order", "early_order"}
+
+
+def get_pending_achievements(earned: set) -> Dict[str, dict]:
+    """Ачивки, которые пользователь ещё не получил и которые можно проверить"""
+    return {
+        achievement_id: achievement
+        for achievement_id, achievement in ACHIEVEMENTS.items()
+        if achievement_id not in earned
+        and achievement.get("condition", {}).get("type") in ACHIEVEMENT_RULES
+    }
+
+
+def get_required_metrics(pending: Dict[str, dict]) -> set:
+    """Набор метрик, необходимых для проверки указанных ачивок"""
+    return {ACHIEVEMENT_RULES[achievement["condition"]["type"]]["metric"] for achievement in pending.values()}
+
+
+def order_metrics(order_data: Optional[dict], tz: ZoneInfo) -> Dict[str, Any]:
+    """Считает метрики по самому заказу (цена, время создания)"""
+    if not order_data:
+        return {}
+
+    metrics = {"order_price": order_data.get("price", 0) or 0}
+    created = order_data.get("created_at")
+    if created:
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=ZoneInfo("UTC"))
+        hour = created.astimezone(tz).hour
+        metrics["night_order"] = 1 if hour >= 22 or hour < 6 else 0  # 22:00-06:00
+        metrics["early_order"] = 1 if hour < 7 else 0  # до 07:00
+    return metrics
+
+
+def evaluate_achievements(pending: Dict[str, dict], metrics: Dict[str, Any]) -> List[str]:
+    """Возвращает ачивки, условия которых выполнены при данных метриках"""
+    granted = []
+    for achievement_id, achievement in pending.items():
+        condition = achievement["condition"]
+        value = metrics.get(ACHIEVEMENT_RULES[condition["type"]]["metric"])
+        if value is not None and value >= condition["value"]:
+            granted.append(achievement_id)
+    return granted
+
+
 def get_achievement_info(achievement_id: str) -> dict:
     """Получить информацию об ачивке"""
     return ACHIEVEMENTS.get(achievement_id, {})
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Скрипт переноса закрытых месяцев в архив заказов
+Использование:
+    python archive_orders.py 2024-01          - перенести в архив указанный месяц
+    python archive_orders.py --keep 3         - перенести все месяцы старше трёх последних закрытых
+
+Секция месяца целиком переезжает из orders в orders_archive, по каждому пользователю
+сохраняются итоги месяца (user_month_summary). Список заказов в боте дочитывает архив
+по мере листания, агрегаты заработка и статистика не пересчитываются.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import date
+from db import db
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Перенос закрытых месяцев в архив заказов")
+    parser.add_argument("month", nargs="?", help="месяц в формате ГГГГ-ММ")
+    parser.add_argument("--keep", type=int, help="сколько последних закрытых месяцев оставить в orders")
+    args = parser.parse_args()
+    if (args.month is None) == (args.keep is None):
+        parser.error("укажите месяц или --keep")
+
+    await db.create_pool()
+    try:
+        await db.init_tables()
+        if args.month:
+            year, month = map(int, args.month.split("-"))
+            count = await db.archive_orders_month(date(year, month, 1))
+            logger.info(f"✅ Перенесено заказов: {count}")
+        else:
+            months = await db.archive_closed_months(args.keep)
+            logger.info(f"✅ Перенесено месяцев: {len(months)}")
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("❌ Операция прервана пользователем")
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка: {e}")
+        sys.exit(1)
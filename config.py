@@ -27,6 +27,10 @@ class Config:
         except ValueError:
             logging.error(f"Ошибка парсинга MODERATORS: {moderators_str}")
             return []
+
+    def is_configured_moderator(self, user_id: int) -> bool:
+        """Главный администратор или модератор из MODERATORS (без запроса к Telegram)"""
+        return user_id == self.ADMIN_CHAT_ID or user_id in self.MODERATORS
     
     # Ограничение доступа: список разрешенных user_id сотрудников (через запятую)
     _ALLOWED_USER_IDS_RAW = os.getenv('ALLOWED_USER_IDS', '').strip()
@@ -121,6 +125,34 @@ class Config:
     DB_NAME = os.getenv('DB_NAME', 'painter_bot')
     DB_USER = os.getenv('DB_USER', 'postgres')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
+    
+    # Реплика для чтения (аналитика, отчёты); пусто - все запросы идут в основную базу
+    DB_REPLICA_DSN = os.getenv('DB_REPLICA_DSN', '')
+    DB_REPLICA_MAX_LAG = int(os.getenv('DB_REPLICA_MAX_LAG', 5))  # секунд допустимого отставания реплики
+    
+    # Предохранитель пула соединений
+    DB_BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', 3))            # ошибок соединения подряд до отключения
+    DB_BREAKER_RESET_TIMEOUT = int(os.getenv('DB_BREAKER_RESET_TIMEOUT', 10))  # секунд до пробного запроса
+    DB_POOL_DRAIN_TIMEOUT = int(os.getenv('DB_POOL_DRAIN_TIMEOUT', 30))        # секунд на завершение запросов старого пула
+    
+    # Метрики запросов к БД
+    DB_SLOW_QUERY_MS = int(os.getenv('DB_SLOW_QUERY_MS', 500))                    # порог медленного запроса, мс
+    DB_METRICS_LOG_INTERVAL = int(os.getenv('DB_METRICS_LOG_INTERVAL', 3600))    # сводка в лог раз в N секунд (0 - выкл.)
+    
+    # Календарь мастерской: часовой пояс и час начала рабочих суток (ночная смена до этого часа
+    # относится к предыдущему дню). После изменения часа пересоберите агрегаты: python db_rollups.py backfill
+    BUSINESS_TIMEZONE = os.getenv('BUSINESS_TIMEZONE', 'Asia/Yekaterinburg')
+    SHOP_DAY_CUTOVER_HOUR = int(os.getenv('SHOP_DAY_CUTOVER_HOUR', 0))
+    
+    # Архив заказов: сколько закрытых месяцев держать в рабочей таблице (0 - архивировать только вручную)
+    ORDERS_ARCHIVE_KEEP_MONTHS = int(os.getenv('ORDERS_ARCHIVE_KEEP_MONTHS', 0))
+    
+    # Выгрузка заказов: строк на одну порцию серверного курсора
+    EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+    
+    # Кэш пользователей в памяти процесса (tg_id -> id, имя, профессия)
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 300))     # секунд
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1000))  # записей
 
 config = Config()
 
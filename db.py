@@ -1,22 +1,735 @@
 import asyncpg
 import asyncio
+import functools
+import json
 import logging
-from datetime import datetime, date, timedelta
-from zoneinfo import ZoneInfo
-from typing import Optional, List, Dict, Any
+import time
+from contextvars import ContextVar
+from collections import OrderedDict
+from datetime import datetime, date
+from typing import Optional, List, Dict, Any, Callable
 from config import config
 from decimal import Decimal
+import migrations
+from db_metrics import metrics, InstrumentedPool
+import periods
+from periods import add_months as _add_months
 
 logger = logging.getLogger(__name__)
 
+
+# Канал уведомлений об изменениях users/orders/earnings_adjustments (триггеры миграции 0010)
+CHANGE_FEED_CHANNEL = "db_changes"
+
+# Ключ advisory lock закрытия расчётного месяца (закрытие - исключительно, правки заказов - совместно)
+PAYROLL_LOCK_KEY = 7_241_002
+
+
+class OrderNumberExistsError(Exception):
+    """Номер заказа уже занят среди заказов той же профессии"""
+
+    def __init__(self, order_number: str, profession: str):
+        super().__init__(f"Заказ с номером '{order_number}' уже существует ({profession})")
+        self.order_number = order_number
+        self.profession = profession
+
+
+class ShopCalendarMismatchError(RuntimeError):
+    """Календарь мастерской в настройках не совпадает с календарём, по которому размечены данные базы"""
+
+
+class ArchivedOrderError(Exception):
+    """Заказ закрытого месяца перенесён в архив и не изменяется"""
+
+    def __init__(self, order_number: str, month: date):
+        super().__init__(f"Заказ №{order_number} за {month:%m.%Y} перенесён в архив, изменить его нельзя")
+        self.order_number = order_number
+        self.month = month
+
+
+# Ошибки, означающие проблему с соединением, а не с самим запросом
+DB_CONNECTION_ERRORS = (
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.TooManyConnectionsError,
+    asyncpg.exceptions.CannotConnectNowError,
+    OSError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitBreaker:
+    """Предохранитель пула: closed -> open после серии ошибок соединения -> half_open (один пробный запрос)"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.OPEN  # до первого успешного подключения запросы не пропускаем
+        self.failures = 0
+        self.opened_at = 0.0
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == self.CLOSED
+
+    def probe_due(self) -> bool:
+        """Истекла ли пауза после размыкания (пора делать пробный запрос)"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def half_open(self):
+        self.state = self.HALF_OPEN
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ База данных снова доступна")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self):
+        """Размыкает предохранитель: запросы к базе не выполняются до пробного запроса"""
+        if self.state != self.OPEN:
+            logger.warning(f"⚠️ База данных недоступна, предохранитель разомкнут на {self.reset_timeout} с")
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+
+# Пул, выбранный для текущего вызова метода Database: 'replica' или 'primary'
+_query_route: ContextVar[Optional[str]] = ContextVar("db_query_route", default=None)
+
+# Как часто перепроверять отставание реплики (секунды)
+REPLICA_LAG_CHECK_INTERVAL = 10
+
+
+def query(kind: str, primary: bool = False):
+    """Помечает метод Database как чтение ('read') или запись ('write') для выбора пула.
+
+    Чтения идут на реплику, если она настроена и не отстаёт; при ошибке соединения
+    с репликой запрос повторяется на основной базе. primary=True - чтение, которому
+    нужно самое свежее состояние (перед изменением данных). Вложенные вызовы
+    используют пул внешнего метода, а запись и primary=True внутри чтения с реплики
+    переходят на основную базу. Успехи и ошибки соединения основной базы
+    учитываются предохранителем пула. Каждый вызов замеряется (db_metrics).
+    """
+    def decorator(func):
+        async def routed(self, *args, **kwargs):
+            route = _query_route.get()
+            if route == "primary" or (route == "replica" and kind == "read" and not primary):
+                return await func(self, *args, **kwargs)
+
+            if kind == "read" and not primary and await self._replica_ready():
+                token = _query_route.set("replica")
+                try:
+                    return await func(self, *args, **kwargs)
+                except DB_CONNECTION_ERRORS as e:
+                    self._replica_failed(e)
+                finally:
+                    _query_route.reset(token)
+
+            token = _query_route.set("primary")
+            try:
+                result = await func(self, *args, **kwargs)
+            except DB_CONNECTION_ERRORS as e:
+                self.report_connection_error(e)
+                raise
+            finally:
+                _query_route.reset(token)
+            self.breaker.record_success()
+            if kind == "write":
+                self._last_write_at = time.monotonic()
+            return result
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            call = metrics.start(func.__name__)
+            try:
+                result = await routed(self, *args, **kwargs)
+            except Exception:
+                metrics.finish(call, error=True)
+                raise
+            metrics.finish(call, result)
+            return result
+
+        wrapper.query_kind = kind
+        return wrapper
+    return decorator
+
+
+def _day_earnings_sql(source: str) -> str:
+    """Пересчёт дневного заработка по ролям (владелец, 70%, 30%) из таблицы заказов source"""
+    return f"""
+    SELECT user_id, day, role, SUM(amount) AS amount, COUNT(*)::INTEGER AS orders_count
+    FROM (
+        SELECT user_id,
+               {periods.shop_day_sql('created_at')} AS day,
+               'owner' AS role,
+               price::NUMERIC AS amount
+        FROM {source}
+        WHERE status = 'confirmed'
+          AND user_id IS NOT NULL
+          AND (set_type NOT LIKE '70_30_%' OR painter_70_id IS NULL)
+
+        UNION ALL
+
+        SELECT painter_70_id,
+               {periods.shop_day_sql('created_at')},
+               'share_70',
+               price * 0.7
+        FROM {source}
+        WHERE status = 'confirmed'
+          AND set_type LIKE '70_30_%'
+          AND painter_70_id IS NOT NULL
+
+        UNION ALL
+
+        SELECT painter_30_id,
+               {periods.shop_day_sql('created_at')},
+               'share_30',
+               price * 0.3
+        FROM {source}
+        WHERE status = 'confirmed'
+          AND set_type LIKE '70_30_%'
+          AND painter_30_id IS NOT NULL
+    ) AS shares
+    GROUP BY user_id, day, role
+"""
+
+
+def _user_stats_sql(source: str) -> str:
+    """Пересчёт накопительной статистики пользователей из таблицы заказов source"""
+    return f"""
+    SELECT u.id AS user_id,
+           COALESCE(own.confirmed_orders, 0)::INTEGER AS confirmed_orders,
+           COALESCE(own.rejected_orders, 0)::INTEGER AS rejected_orders,
+           COALESCE(own.alumochrome_orders, 0)::INTEGER AS alumochrome_orders,
+           COALESCE(own.big_size_orders, 0)::INTEGER AS big_size_orders,
+           COALESCE(team.team_orders, 0)::INTEGER AS team_orders,
+           COALESCE(earn.lifetime_earnings, 0) AS lifetime_earnings,
+           COALESCE(members.orders_total, 0)::INTEGER AS orders_total
+    FROM users u
+    LEFT JOIN (
+        SELECT user_id,
+               COUNT(*) FILTER (WHERE status = 'confirmed') AS confirmed_orders,
+               COUNT(*) FILTER (WHERE status = 'rejected') AS rejected_orders,
+               COUNT(*) FILTER (WHERE status = 'confirmed' AND alumochrome = TRUE) AS alumochrome_orders,
+               COUNT(*) FILTER (WHERE status = 'confirmed' AND size IN ('R20', 'R21', 'R22', 'R23', 'R24')) AS big_size_orders
+        FROM {source}
+        GROUP BY user_id
+    ) AS own ON own.user_id = u.id
+    LEFT JOIN (
+        SELECT painter_id, COUNT(DISTINCT id) AS team_orders
+        FROM (
+            SELECT id, painter_70_id AS painter_id FROM {source}
+            WHERE status = 'confirmed' AND set_type LIKE '70_30_%' AND painter_70_id IS NOT NULL
+            UNION ALL
+            SELECT id, painter_30_id FROM {source}
+            WHERE status = 'confirmed' AND set_type LIKE '70_30_%' AND painter_30_id IS NOT NULL
+        ) AS team_shares
+        GROUP BY painter_id
+    ) AS team ON team.painter_id = u.id
+    LEFT JOIN (
+        SELECT user_id, SUM(amount) AS lifetime_earnings
+        FROM ({_day_earnings_sql(source)}) AS days
+        GROUP BY user_id
+    ) AS earn ON earn.user_id = u.id
+    LEFT JOIN (
+        SELECT member_id, COUNT(DISTINCT id) AS orders_total
+        FROM {source},
+             LATERAL (VALUES (user_id), (painter_70_id), (painter_30_id)) AS m(member_id)
+        WHERE member_id IS NOT NULL
+        GROUP BY member_id
+    ) AS members ON members.member_id = u.id
+"""
+
+
+# Полный пересчёт по живой таблице заказов (заполнение и проверка агрегатов)
+USER_DAY_EARNINGS_RECOMPUTE_SQL = _day_earnings_sql("orders")
+USER_STATS_RECOMPUTE_SQL = _user_stats_sql("orders")
+
+
+def _user_month_summary_sql(source: str) -> str:
+    """Итоги месяца по участникам заказов из секции source (параметр $1 - месяц)"""
+    return f"""
+    SELECT s.user_id, $1::DATE AS month, s.orders_total AS orders_count,
+           s.confirmed_orders, s.rejected_orders, s.alumochrome_orders, s.big_size_orders,
+           s.team_orders, s.lifetime_earnings AS earnings
+    FROM ({_user_stats_sql(source)}) AS s
+    WHERE s.orders_total > 0
+"""
+
+
+# Полный пересчёт user_stats с учётом архива: живые заказы + итоги архивных месяцев
+USER_STATS_WITH_ARCHIVE_SQL = f"""
+    SELECT live.user_id,
+           live.confirmed_orders + COALESCE(arch.confirmed_orders, 0)::INTEGER AS confirmed_orders,
+           live.rejected_orders + COALESCE(arch.rejected_orders, 0)::INTEGER AS rejected_orders,
+           live.alumochrome_orders + COALESCE(arch.alumochrome_orders, 0)::INTEGER AS alumochrome_orders,
+           live.big_size_orders + COALESCE(arch.big_size_orders, 0)::INTEGER AS big_size_orders,
+           live.team_orders + COALESCE(arch.team_orders, 0)::INTEGER AS team_orders,
+           live.lifetime_earnings + COALESCE(arch.earnings, 0) AS lifetime_earnings,
+           live.orders_total + COALESCE(arch.orders_count, 0)::INTEGER AS orders_total
+    FROM ({USER_STATS_RECOMPUTE_SQL}) AS live
+    LEFT JOIN (
+        SELECT user_id,
+               SUM(confirmed_orders) AS confirmed_orders,
+               SUM(rejected_orders) AS rejected_orders,
+               SUM(alumochrome_orders) AS alumochrome_orders,
+               SUM(big_size_orders) AS big_size_orders,
+               SUM(team_orders) AS team_orders,
+               SUM(earnings) AS earnings,
+               SUM(orders_count) AS orders_count
+        FROM user_month_summary
+        GROUP BY user_id
+    ) AS arch ON arch.user_id = live.user_id
+"""
+
+USER_STATS_COUNTERS = ('confirmed_orders', 'rejected_orders', 'alumochrome_orders', 'big_size_orders', 'team_orders',
+                       'orders_total')
+BIG_SIZES = ('R20', 'R21', 'R22', 'R23', 'R24')
+
+
+# SQL-выражения для метрик достижений (см. achievements.ACHIEVEMENT_RULES).
+# В запрос попадают только метрики, нужные для ещё не полученных ачивок.
+# Параметры: {user_id}, {today_start}/{today_end} (наивный UTC), {today}, {month_start}/{month_end},
+# {order_created_at} (время создания заказа, наивный UTC).
+ACHIEVEMENT_METRICS_SQL = {
+    "total_orders": "(SELECT confirmed_orders FROM user_stats WHERE user_id = {user_id})",
+    "perfect_orders": """(SELECT CASE WHEN rejected_orders = 0 THEN confirmed_orders ELSE 0 END
+                          FROM user_stats WHERE user_id = {user_id})""",
+    "alumochrome_orders": "(SELECT alumochrome_orders FROM user_stats WHERE user_id = {user_id})",
+    "big_size_orders": "(SELECT big_size_orders FROM user_stats WHERE user_id = {user_id})",
+    "team_orders": "(SELECT team_orders FROM user_stats WHERE user_id = {user_id})",
+    "total_earnings": "(SELECT lifetime_earnings FROM user_stats WHERE user_id = {user_id})",
+    "today_orders": """(SELECT COUNT(*) FROM orders
+                        WHERE user_id = {user_id} AND status = 'confirmed'
+                          AND created_at >= {today_start} AND created_at < {today_end})""",
+    "month_earnings": """(SELECT COALESCE(SUM(amount), 0) FROM user_day_earnings
+                          WHERE user_id = {user_id} AND day >= {month_start} AND day < {month_end})""",
+    "today_earnings": """(SELECT COALESCE(SUM(amount), 0) FROM user_day_earnings
+                          WHERE user_id = {user_id} AND day = {today})""",
+    # Число дней подряд с заказами, заканчивающихся днём мастерской текущего заказа
+    "work_streak": """(SELECT COUNT(*) FROM (
+                           SELECT day, ROW_NUMBER() OVER (ORDER BY day DESC) AS rn
+                           FROM (SELECT DISTINCT day FROM user_day_earnings
+                                 WHERE user_id = {user_id} AND orders_count > 0
+                                   AND day <= {order_day} AND day > {order_day} - 400) AS active_days
+                       ) AS streak
+                       WHERE day = {order_day} - (rn - 1)::INTEGER)""",
+    # Число дней без заказов перед днём мастерской текущего заказа
+    "comeback_gap": """(SELECT {order_day} - MAX(day) - 1 FROM user_day_earnings
+                        WHERE user_id = {user_id} AND orders_count > 0 AND day < {order_day})""",
+    # Подтверждённые заказы за час до создания текущего заказа
+    "hour_orders": """(SELECT COUNT(*) FROM orders
+                       WHERE user_id = {user_id} AND status = 'confirmed'
+                         AND created_at > {order_created_at} - INTERVAL '1 hour'
+                         AND created_at <= {order_created_at})""",
+}
+
+
+class _QueryParams(dict):
+    """Нумерует именованные параметры запроса ($1, $2, ...) в порядке первого использования"""
+
+    def __init__(self, values: Dict[str, Any], casts: Dict[str, str]):
+        super().__init__()
+        self.values = values
+        self.casts = casts
+        self.args: List[Any] = []
+
+    def __missing__(self, key: str) -> str:
+        self.args.append(self.values[key])
+        placeholder = f"${len(self.args)}::{self.casts[key]}"
+        self[key] = placeholder
+        return placeholder
+
+
+def _to_db_utc(value: datetime) -> datetime:
+    """Переводит момент времени в наивный UTC - в таком виде хранится orders.created_at"""
+    if value.tzinfo is not None:
+        value = value.astimezone(periods.UTC).replace(tzinfo=None)
+    return value
+
+
+def orders_partition_name(month_start: date) -> str:
+    """Имя месячной секции orders"""
+    return f"orders_{month_start:%Y_%m}"
+
+
+def orders_partition_month(name: str) -> date:
+    """Месяц месячной секции orders_YYYY_MM"""
+    return date(int(name[7:11]), int(name[12:14]), 1)
+
+
+def orders_partition_bounds(month_start: date) -> str:
+    """Границы месячной секции orders: начало месяца мастерской и следующего в наивном UTC"""
+    window = periods.month_window(month_start)
+    return f"FOR VALUES FROM ('{window.start_utc:%Y-%m-%d %H:%M:%S}') TO ('{window.end_utc:%Y-%m-%d %H:%M:%S}')"
+
+
+def orders_partition_sql(month_start: date) -> str:
+    """DDL месячной секции orders"""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {orders_partition_name(month_start)} PARTITION OF orders "
+        f"{orders_partition_bounds(month_start)}"
+    )
+
+
+def local_month_start(value: datetime) -> date:
+    """Первое число месяца мастерской для наивного UTC (как в orders.created_at)"""
+    return periods.month_start(value)
+
+
+def _user_orders_keyset_sql(source: str, with_cursor: bool, backward: bool) -> str:
+    """Страница заказов пользователя из source: UNION индексных сканов по каждой роли вместо OR
+    (параметры: $1 - user_id, $2 - размер страницы, $3/$4 - created_at и id ключа)"""
+    op, direction = ('>', 'ASC') if backward else ('<', 'DESC')
+    bound = f"AND (o.created_at, o.id) {op} ($3, $4)" if with_cursor else ""
+    branches = "\n            UNION\n".join(
+        f"""(SELECT o.* FROM {source} o WHERE o.{column} = $1 {bound}
+             ORDER BY o.created_at {direction}, o.id {direction} LIMIT $2)"""
+        for column in ('user_id', 'painter_70_id', 'painter_30_id')
+    )
+    archived = 'TRUE' if source == 'orders_archive' else 'FALSE'
+    return f"""
+        SELECT o.*, u.profession, {archived} AS archived
+        FROM (
+            {branches}
+        ) AS o
+        JOIN users u ON o.user_id = u.id
+        ORDER BY o.created_at {direction}, o.id {direction}
+        LIMIT $2
+    """
+
+
+# Заработок и число заказов пользователей за месяц (параметры: $1/$2 - границы месяца по дням)
+LEADERBOARD_SQL = """
+    SELECT u.id, u.name, u.profession,
+           COALESCE(SUM(e.amount), 0)::INTEGER AS total_earnings,
+           COALESCE(SUM(e.orders_count), 0)::INTEGER AS total_orders
+    FROM user_day_earnings e
+    JOIN users u ON u.id = e.user_id
+    WHERE e.day >= $1 AND e.day < $2
+      {user_filter}
+    GROUP BY u.id, u.name, u.profession
+    HAVING SUM(e.amount) > 0 OR SUM(e.orders_count) > 0
+"""
+
+
+# Заказы за прошедшие периоды: рабочая таблица и архив (условия веток проталкиваются в обе части)
+ALL_ORDERS_SQL = "(SELECT * FROM orders UNION ALL SELECT * FROM orders_archive)"
+
+
+def _earnings_split_sql(member: bool) -> str:
+    """Заработок за период по пользователям одним агрегатом: доли 70/30, подготовка по прайсу и корректировки
+    (параметры: $1/$2 - границы в наивном UTC, $3/$4 - цена подготовки одиночки/комплекта,
+    $5/$6 - расчётные месяцы корректировок [с, по), $7 - пользователь, если member)"""
+    def who(column: str) -> str:
+        return f"{column} = $7" if member else f"{column} IS NOT NULL"
+
+    return f"""
+    WITH prep_prices (base_type, unit_price) AS (
+        -- Стоимость подготовки одного диска/комплекта (config.PRICE_PREP_SINGLE/SET)
+        VALUES ('single', $3::NUMERIC), ('set', $4::NUMERIC)
+    ),
+    shares AS (
+        SELECT user_id, 'owner' AS role, price::NUMERIC AS price, 1::NUMERIC AS share, set_type, quantity
+        FROM {ALL_ORDERS_SQL} AS o
+        WHERE {who('user_id')}
+          AND status = 'confirmed'
+          AND (set_type NOT LIKE '70_30_%' OR painter_70_id IS NULL)
+          AND price > 0
+          AND created_at >= $1
+          AND created_at <  $2
+
+        UNION ALL
+
+        SELECT painter_70_id, 'share_70', price, 0.7, set_type, quantity
+        FROM {ALL_ORDERS_SQL} AS o
+        WHERE {who('painter_70_id')}
+          AND status = 'confirmed'
+          AND set_type LIKE '70_30_%'
+          AND price > 0
+          AND created_at >= $1
+          AND created_at <  $2
+
+        UNION ALL
+
+        SELECT painter_30_id, 'share_30', price, 0.3, set_type, quantity
+        FROM {ALL_ORDERS_SQL} AS o
+        WHERE {who('painter_30_id')}
+          AND status = 'confirmed'
+          AND set_type LIKE '70_30_%'
+          AND price > 0
+          AND created_at >= $1
+          AND created_at <  $2
+    ),
+    earned AS (
+        SELECT s.user_id,
+               COUNT(*) AS orders_count,
+               SUM(s.price * s.share) FILTER (WHERE s.role = 'owner') AS owner,
+               SUM(s.price * s.share) FILTER (WHERE s.role = 'share_70') AS share_70,
+               SUM(s.price * s.share) FILTER (WHERE s.role = 'share_30') AS share_30,
+               SUM(s.price * s.share) AS earned,
+               SUM(p.unit_price * GREATEST(COALESCE(s.quantity, 1), 1) * s.share) AS prep
+        FROM shares s
+        LEFT JOIN prep_prices p
+          ON p.base_type = CASE WHEN s.set_type LIKE '70_30_%' THEN substr(s.set_type, 7) ELSE s.set_type END
+        GROUP BY s.user_id
+    ),
+    adjustments AS (
+        SELECT user_id, SUM(prep_delta) AS prep_adjustment, SUM(painting_delta) AS painting_adjustment
+        FROM earnings_adjustments
+        WHERE {who('user_id')}
+          AND month_start >= $5
+          AND month_start <  $6
+        GROUP BY user_id
+    )
+    SELECT COALESCE(e.user_id, a.user_id) AS user_id,
+           COALESCE(e.orders_count, 0)::INTEGER AS orders_count,
+           COALESCE(e.owner, 0) AS owner,
+           COALESCE(e.share_70, 0) AS share_70,
+           COALESCE(e.share_30, 0) AS share_30,
+           COALESCE(e.earned, 0) AS earned,
+           COALESCE(e.prep, 0) AS prep_earned,
+           COALESCE(a.prep_adjustment, 0)::INTEGER AS prep_adjustment,
+           COALESCE(a.painting_adjustment, 0)::INTEGER AS painting_adjustment
+    FROM earned e
+    FULL JOIN adjustments a ON a.user_id = e.user_id
+"""
+
+
+USER_EARNINGS_SPLIT_SQL = _earnings_split_sql(member=True)
+PAYROLL_SPLIT_SQL = _earnings_split_sql(member=False)
+
+# Доля заработка по роли в заказе (как в _order_earning_shares)
+ROLE_SHARES = {'owner': Decimal(1), 'share_70': Decimal('0.7'), 'share_30': Decimal('0.3')}
+
+
+def _payroll_totals(row) -> Dict[str, int]:
+    """Итог к выплате и разбивка на подготовку и покраску из строки _earnings_split_sql"""
+    total = int(Decimal(row['earned']) + row['prep_adjustment'] + row['painting_adjustment'])
+    prep = int(Decimal(row['prep_earned']) + row['prep_adjustment'])
+    return {"total": total, "prep": prep, "painting": max(total - prep, 0)}
+
+
+# Итоги диапазона дней по агрегату (параметры: $1/$2 - границы по дням, $3 - профессия или NULL).
+# Заказ 70/30 даёт строки обоим малярам, поэтому заказы считаются без долей 30%:
+# у каждого подтверждённого заказа ровно одна строка владельца или доли 70%.
+RANGE_REPORT_SQL = """
+    SELECT COALESCE(SUM(e.amount), 0) AS total_earnings,
+           COALESCE(SUM(e.orders_count) FILTER (WHERE e.role <> 'share_30'), 0) AS total_orders,
+           COUNT(DISTINCT e.user_id) FILTER (WHERE e.orders_count > 0) AS active_users,
+           COUNT(DISTINCT e.day) FILTER (WHERE e.orders_count > 0) AS active_days
+    FROM user_day_earnings e
+    JOIN users u ON u.id = e.user_id
+    WHERE e.day >= $1 AND e.day < $2
+      AND ($3::VARCHAR IS NULL OR u.profession = $3)
+"""
+
+
+# Заказы периода для выгрузки с именами сотрудников (параметры: $1/$2 - границы в наивном UTC)
+ORDERS_EXPORT_SQL = """
+    SELECT o.id, o.order_number, o.created_at, u.name AS user_name, u.profession,
+           o.set_type, o.size, o.alumochrome, o.quantity, o.price, o.status,
+           p70.name AS painter_70_name, p30.name AS painter_30_name
+    FROM (
+        SELECT * FROM orders WHERE created_at >= $1 AND created_at < $2
+        UNION ALL
+        SELECT * FROM orders_archive WHERE created_at >= $1 AND created_at < $2
+    ) AS o
+    JOIN users u ON u.id = o.user_id
+    LEFT JOIN users p70 ON p70.id = o.painter_70_id
+    LEFT JOIN users p30 ON p30.id = o.painter_30_id
+    ORDER BY o.created_at, o.id
+"""
+
+
+def _leaderboard_top(rows, profession: Optional[str]) -> List[Dict[str, Any]]:
+    """Строки рейтинга профессии (или всех), по убыванию заработка"""
+    return sorted(
+        (row for row in rows if profession is None or row['profession'] == profession),
+        key=lambda row: row['total_earnings'], reverse=True
+    )
+
+
+def _order_earning_shares(order: Optional[Dict[str, Any]]) -> List[tuple]:
+    """Возвращает доли заработка по заказу: [(user_id, day, role, amount)] (только для подтверждённых)"""
+    if not order or order.get('status') != 'confirmed':
+        return []
+
+    day = periods.shop_day(order.get('created_at') or datetime.utcnow())
+
+    price = Decimal(order.get('price') or 0)
+    is_team = (order.get('set_type') or '').startswith('70_30_')
+
+    shares = []
+    if order.get('user_id') and (not is_team or not order.get('painter_70_id')):
+        shares.append((order['user_id'], day, 'owner', price))
+    if is_team and order.get('painter_70_id'):
+        shares.append((order['painter_70_id'], day, 'share_70', price * Decimal('0.7')))
+    if is_team and order.get('painter_30_id'):
+        shares.append((order['painter_30_id'], day, 'share_30', price * Decimal('0.3')))
+    return shares
+
+
+def _order_payroll_shares(order: Optional[Dict[str, Any]]) -> List[tuple]:
+    """Вклад заказа в расчёт зарплаты: [(user_id, расчётный месяц, заработок, подготовка)] (как в _earnings_split_sql)"""
+    if not order or Decimal(order.get('price') or 0) <= 0:
+        return []
+    set_type = order.get('set_type') or ''
+    base_type = set_type[len('70_30_'):] if set_type.startswith('70_30_') else set_type
+    unit_price = {'single': config.PRICE_PREP_SINGLE, 'set': config.PRICE_PREP_SET}.get(base_type, 0)
+    prep = Decimal(unit_price * max(order.get('quantity') or 1, 1))
+    return [
+        (user_id, day.replace(day=1), amount, prep * ROLE_SHARES[role])
+        for user_id, day, role, amount in _order_earning_shares(order)
+    ]
+
+
+def _order_stat_counters(order: Optional[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Возвращает вклад заказа в user_stats: {user_id: {счётчик: значение}}"""
+    counters: Dict[int, Dict[str, Any]] = {}
+    if not order:
+        return counters
+
+    def bump(user_id: int, field: str, value=1):
+        user_counters = counters.setdefault(user_id, {})
+        user_counters[field] = user_counters.get(field, 0) + value
+
+    # Все заказы пользователя в любом статусе (как в списке «Мои заказы»)
+    for member_id in {order.get('user_id'), order.get('painter_70_id'), order.get('painter_30_id')} - {None}:
+        bump(member_id, 'orders_total')
+
+    status = order.get('status')
+    owner_id = order.get('user_id')
+    if owner_id and status == 'rejected':
+        bump(owner_id, 'rejected_orders')
+    if status != 'confirmed':
+        return counters
+
+    if owner_id:
+        bump(owner_id, 'confirmed_orders')
+        if order.get('alumochrome'):
+            bump(owner_id, 'alumochrome_orders')
+        if order.get('size') in BIG_SIZES:
+            bump(owner_id, 'big_size_orders')
+
+    if (order.get('set_type') or '').startswith('70_30_'):
+        for painter_id in {order.get('painter_70_id'), order.get('painter_30_id')} - {None}:
+            bump(painter_id, 'team_orders')
+
+    for user_id, _day, _role, amount in _order_earning_shares(order):
+        bump(user_id, 'lifetime_earnings', amount)
+    return counters
+
+
 class Database:
     def __init__(self):
-        self.pool: Optional[asyncpg.Pool] = None
+        self.pool: Optional[InstrumentedPool] = None
+        self._earned_achievements: Dict[int, set] = {}
+        self._user_cache: "OrderedDict[int, tuple]" = OrderedDict()  # tg_id -> (момент записи, пользователь)
+        self.breaker = CircuitBreaker(config.DB_BREAKER_FAILURES, config.DB_BREAKER_RESET_TIMEOUT)
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._drain_tasks: set = set()
+        self.replica_pool: Optional[InstrumentedPool] = None
+        self._replica_lag = 0.0
+        self._replica_lag_checked_at = 0.0
+        self._replica_down_until = 0.0
+        self._last_write_at = 0.0
+        self._listener: Optional[asyncpg.Connection] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._change_subscribers: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self.subscribe_changes('users', self._on_user_change)
+        self.subscribe_changes('user_achievements', self._on_achievement_change)
+        # Снимок рейтинга текущего месяца: user_id -> строка топа; обновляется по ленте изменений
+        self._leaderboard_month: Optional[date] = None
+        self._leaderboard: Dict[int, Dict[str, Any]] = {}
+        self._leaderboard_tops: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        self._leaderboard_stale: set = set()
+        self._leaderboard_task: Optional[asyncio.Task] = None
+        self.subscribe_changes('orders', self._on_leaderboard_change)
+        self.subscribe_changes('users', self._on_leaderboard_change)
 
     async def create_pool(self):
-        """Создает пул соединений с базой данных"""
+        """Создает пул соединений с базой данных (и с репликой, если она настроена)"""
+        self.pool = await self._open_pool()
+        if config.DB_REPLICA_DSN and not self.replica_pool:
+            await self._open_replica_pool()
+
+    async def _open_replica_pool(self):
+        """Открывает пул реплики; при ошибке чтение остаётся на основной базе"""
+        try:
+            self.replica_pool = InstrumentedPool(await asyncpg.create_pool(
+                dsn=config.DB_REPLICA_DSN,
+                min_size=1,
+                max_size=5,
+                command_timeout=60,
+                server_settings={
+                    'application_name': 'painter_bot_replica',
+                    'jit': 'off',
+                },
+                setup=self._setup_connection,
+                init=self._init_connection,
+                timeout=10,
+            ))
+            logger.info("✅ Подключена реплика для чтения")
+        except Exception as e:
+            self.replica_pool = None
+            logger.warning(f"⚠️ Реплика недоступна, чтение идёт с основной базы: {e}")
+
+    def _pool(self) -> InstrumentedPool:
+        """Пул для текущего запроса (реплика для чтений, выбранных декоратором query)"""
+        if _query_route.get() == "replica" and self.replica_pool:
+            return self.replica_pool
+        return self.pool
+
+    async def _replica_ready(self) -> bool:
+        """Можно ли читать с реплики: она подключена, не отстаёт и после последней записи прошло достаточно времени"""
+        now = time.monotonic()
+        if not self.replica_pool or now < self._replica_down_until:
+            return False
+        # Свежие изменения (например, только что подтверждённый заказ) могли ещё не доехать до реплики
+        if now - self._last_write_at < config.DB_REPLICA_MAX_LAG:
+            return False
+        if now - self._replica_lag_checked_at > REPLICA_LAG_CHECK_INTERVAL:
+            self._replica_lag_checked_at = now
+            try:
+                async with self.replica_pool.acquire(timeout=5) as conn:
+                    self._replica_lag = float(await conn.fetchval("""
+                        SELECT CASE
+                            WHEN NOT pg_is_in_recovery() THEN 0
+                            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                        END
+                    """))
+            except Exception as e:
+                self._replica_failed(e)
+                return False
+            if self._replica_lag > config.DB_REPLICA_MAX_LAG:
+                logger.warning(f"⚠️ Реплика отстаёт на {self._replica_lag:.1f} с, чтение идёт с основной базы")
+        return self._replica_lag <= config.DB_REPLICA_MAX_LAG
+
+    def _replica_failed(self, error: Exception):
+        """Отключает реплику на время после ошибки соединения"""
+        logger.warning(f"⚠️ Ошибка реплики, чтение переключено на основную базу: {error}")
+        self._replica_down_until = time.monotonic() + config.DB_BREAKER_RESET_TIMEOUT * 3
+
+    async def _open_pool(self) -> InstrumentedPool:
+        """Открывает новый пул соединений с замером ожидания соединений"""
+        return InstrumentedPool(await self._connect_pool())
+
+    async def _connect_pool(self) -> asyncpg.Pool:
+        """Создаёт пул asyncpg (при необходимости создаёт базу данных)"""
         try:
-            self.pool = await asyncpg.create_pool(
+            return await asyncpg.create_pool(
                 host=config.DB_HOST,
                 port=config.DB_PORT,
                 database=config.DB_NAME,
@@ -42,7 +755,7 @@ class Database:
             logger.warning(f"База данных '{config.DB_NAME}' не существует. Попытка создания...")
             await self._create_database_if_not_exists()
             # Повторная попытка подключения
-            self.pool = await asyncpg.create_pool(
+            return await asyncpg.create_pool(
                 host=config.DB_HOST,
                 port=config.DB_PORT,
                 database=config.DB_NAME,
@@ -119,215 +832,540 @@ class Database:
         """Инициализация соединения"""
         # Проверяем соединение
         await conn.fetchval("SELECT 1")
+        # Журнал медленных запросов (с формой параметров, без значений)
+        conn.add_query_logger(metrics.log_query)
 
     async def close_pool(self):
         """Закрывает пул соединений"""
+        if self._listener:
+            listener, self._listener = self._listener, None
+            await listener.close()
         if self.pool:
             await self.pool.close()
+        if self.replica_pool:
+            await self.replica_pool.close()
+            self.replica_pool = None
 
-    async def health_check(self) -> bool:
-        """Проверяет состояние соединения с базой данных"""
+    async def _ping(self) -> bool:
+        """Выполняет SELECT 1 на текущем пуле"""
         if not self.pool:
             return False
-        
         try:
-            # Получаем соединение и сразу освобождаем
-            conn = await self.pool.acquire()
-            try:
+            async with self.pool.acquire(timeout=10) as conn:
                 await conn.fetchval("SELECT 1")
-                return True
-            finally:
-                await self.pool.release(conn)
+            return True
         except Exception as e:
             logger.error(f"Health check failed: {e}")
             return False
 
+    async def health_check(self) -> bool:
+        """Проверяет состояние соединения с базой данных (результат учитывается предохранителем)"""
+        if await self._ping():
+            self.breaker.record_success()
+            return True
+        self.breaker.record_failure()
+        return False
+
+    async def ensure_available(self) -> bool:
+        """Можно ли обращаться к базе; после паузы разомкнутый предохранитель делает один пробный запрос"""
+        if self.breaker.is_closed:
+            return True
+        if self.breaker.state == CircuitBreaker.OPEN and not self.breaker.probe_due():
+            return False
+        # Пробный запрос один на всех: остальные ждут его результата
+        if self._probe_task is None or self._probe_task.done():
+            self.breaker.half_open()
+            self._probe_task = asyncio.create_task(self._probe())
+        return await asyncio.shield(self._probe_task)
+
+    async def _probe(self) -> bool:
+        """Пробный запрос (half-open); если пул не отвечает - переподключение с подменой пула"""
+        if not await self._ping():
+            try:
+                await self.reconnect()
+            except Exception:
+                self.breaker.trip()
+                return False
+            if not await self._ping():
+                self.breaker.trip()
+                return False
+        self.breaker.record_success()
+        return True
+
+    def report_connection_error(self, error: Exception):
+        """Учитывает ошибку соединения, возникшую при выполнении запроса"""
+        logger.warning(f"Database connection error: {error}")
+        self.breaker.record_failure()
+
     async def reconnect(self):
-        """Переподключается к базе данных"""
+        """Переподключается к базе данных: одно переподключение на все одновременные ошибки"""
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._swap_pool())
+        await asyncio.shield(self._reconnect_task)
+
+    async def _swap_pool(self):
+        """Открывает новый пул, подменяет им текущий и закрывает старый после завершения его запросов"""
         logger.info("Attempting to reconnect to database...")
-        await self.close_pool()
         try:
-            await self.create_pool()
-            await self.init_tables()
-            logger.info("Database reconnected successfully")
+            new_pool = await self._open_pool()
         except Exception as e:
             logger.error(f"Failed to reconnect: {e}")
             raise
 
-    async def _execute_with_retry(self, operation, *args, **kwargs):
-        """Выполняет операцию с автоматическим переподключением при ошибке"""
-        max_retries = 3
-        for attempt in range(max_retries):
+        old_pool, self.pool = self.pool, new_pool
+        logger.info("Database reconnected successfully")
+
+        if old_pool is None:
+            # Первое подключение (бот запустился без базы) - схему нужно создать
+            await self.init_tables()
+        else:
+            # При переподключении только сверяем версию схемы - DDL на живой базе не запускаем
+            await self.check_schema_version()
+            task = asyncio.create_task(self._drain_pool(old_pool))
+            self._drain_tasks.add(task)
+            task.add_done_callback(self._drain_tasks.discard)
+
+    async def _drain_pool(self, pool: InstrumentedPool):
+        """Дожидается освобождения соединений старого пула и закрывает его"""
+        try:
+            await asyncio.wait_for(pool.close(), timeout=config.DB_POOL_DRAIN_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"⚠️ Старый пул не освободился за {config.DB_POOL_DRAIN_TIMEOUT} с, соединения закрыты принудительно: {e}")
+            pool.terminate()
+
+    # === ЛЕНТА ИЗМЕНЕНИЙ ===
+
+    def subscribe_changes(self, table: str, callback: Callable[[Dict[str, Any]], None]):
+        """Подписывает callback(event) на изменения таблицы users/orders/earnings_adjustments/user_achievements.
+        После переподключения ленты каждый подписчик получает событие {"op": "reset"} - сбросить кэш целиком"""
+        self._change_subscribers.setdefault(table, []).append(callback)
+
+    async def start_change_feed(self) -> bool:
+        """Открывает соединение LISTEN для ленты изменений (повторный вызов при живом соединении ничего не делает)"""
+        if self._listener and not self._listener.is_closed():
+            return True
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._open_listener())
+        return await asyncio.shield(self._listener_task)
+
+    async def _open_listener(self) -> bool:
+        """Открывает отдельное (не из пула) соединение и подписывается на канал изменений"""
+        try:
+            conn = await asyncpg.connect(
+                host=config.DB_HOST,
+                port=config.DB_PORT,
+                database=config.DB_NAME,
+                user=config.DB_USER,
+                password=config.DB_PASSWORD,
+                timeout=30,
+                server_settings={'application_name': 'painter_bot_listener'},
+            )
+            await conn.add_listener(CHANGE_FEED_CHANNEL, self._on_notification)
+        except (*DB_CONNECTION_ERRORS, asyncpg.PostgresError) as e:
+            logger.warning(f"⚠️ Не удалось подписаться на изменения в базе данных: {e}")
+            return False
+        conn.add_termination_listener(self._on_listener_closed)
+        self._listener = conn
+
+        # Пока подписки не было, события могли потеряться - кэши сбрасываются целиком
+        self._dispatch_change({"op": "reset"})
+        logger.info("👂 Подписка на изменения в базе данных активна")
+        return True
+
+    def _on_listener_closed(self, conn):
+        """Соединение ленты закрылось: переподписываемся (при неудаче - повтор из health check)"""
+        if conn is not self._listener:
+            return
+        logger.warning("⚠️ Соединение ленты изменений закрыто, переподписка...")
+        self._listener = None
+        self._listener_task = asyncio.get_running_loop().create_task(self._open_listener())
+
+    def _on_notification(self, conn, pid: int, channel: str, payload: str):
+        """Разбирает уведомление из канала изменений и передаёт подписчикам"""
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.warning(f"⚠️ Некорректное событие ленты изменений: {payload[:200]}")
+            return
+        self._dispatch_change(event)
+
+    def _dispatch_change(self, event: Dict[str, Any]):
+        """Вызывает подписчиков таблицы события (событие сброса - всех подписчиков)"""
+        if event.get('op') == 'reset':
+            callbacks = [callback for callbacks in self._change_subscribers.values() for callback in callbacks]
+        else:
+            callbacks = self._change_subscribers.get(event.get('t'), [])
+        for callback in callbacks:
             try:
-                return await operation(*args, **kwargs)
-            except (asyncpg.exceptions.ConnectionDoesNotExistError, 
-                    asyncpg.exceptions.TooManyConnectionsError,
-                    asyncpg.exceptions.ConnectionFailure) as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Database connection error (attempt {attempt + 1}/{max_retries}): {e}")
-                    await self.reconnect()
-                    await asyncio.sleep(1)  # Небольшая задержка перед повторной попыткой
-                else:
-                    raise e
+                callback(event)
             except Exception as e:
-                # Для других типов ошибок не делаем переподключение
-                raise e
+                logger.error(f"Ошибка обработчика ленты изменений {getattr(callback, '__name__', callback)}: {e}")
+
+    def _on_user_change(self, event: Dict[str, Any]):
+        """Другой процесс изменил пользователя - запись кэша больше не актуальна"""
+        self.invalidate_user_cache(None if event.get('op') == 'reset' else event.get('tg_id'))
+
+    def _on_achievement_change(self, event: Dict[str, Any]):
+        """Ачивки пользователя выданы или удалены (в том числе другим процессом) - перечитать их набор"""
+        if event.get('op') == 'reset':
+            self._earned_achievements.clear()
+        else:
+            self._earned_achievements.pop(event.get('user_id'), None)
 
     async def init_tables(self):
-        """Создает таблицы в базе данных"""
+        """Приводит схему базы данных к актуальной версии (применяет недостающие миграции)"""
         try:
-            # Получаем соединение и держим его до конца
-            conn = await self.pool.acquire()
-            try:
-                # Таблица пользователей
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        tg_id BIGINT UNIQUE NOT NULL,
-                        name VARCHAR(255) NOT NULL,
-                        profession VARCHAR(20) DEFAULT 'painter', -- 'painter' или 'sandblaster'
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Таблица заказов (универсальная для всех профессий)
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS orders (
-                        id SERIAL PRIMARY KEY,
-                        order_number VARCHAR(50) NOT NULL,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        set_type VARCHAR(20) NOT NULL, -- 'single', 'set', 'nakidka', 'suspensia'
-                        size VARCHAR(10), -- 'R15', 'R16', 'R17' (NULL для насадок и суспортов)
-                        alumochrome BOOLEAN DEFAULT FALSE,
-                        suspensia_type VARCHAR(20), -- 'paint' или 'logo' (только для суспортов)
-                        quantity INTEGER DEFAULT 1, -- количество суспортов
-                        spraying_deep INTEGER DEFAULT 0, -- количество глубоких напылений
-                        spraying_shallow INTEGER DEFAULT 0, -- количество неглубоких напылений
-                        price INTEGER NOT NULL,
-                        status VARCHAR(20) DEFAULT 'draft', -- 'draft', 'confirmed', 'rejected'
-                        photo_file_id VARCHAR(255),
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                
-                # Миграция для добавления новых полей
-                logger.info("🔄 Выполнение миграций базы данных...")
-                try:
-                    # Миграция для таблицы пользователей
-                    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS profession VARCHAR(20) DEFAULT 'painter'")
-                    await conn.execute("UPDATE users SET profession = 'painter' WHERE profession IS NULL")
-                    logger.info("✅ Миграция: добавлена колонка profession в таблицу users")
-                    
-                    # Миграция для таблицы заказов
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS suspensia_type VARCHAR(20)")
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS quantity INTEGER DEFAULT 1")
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS spraying_deep INTEGER DEFAULT 0")
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS spraying_shallow INTEGER DEFAULT 0")
-                    await conn.execute("ALTER TABLE orders ALTER COLUMN size DROP NOT NULL")
-                    logger.info("✅ Миграция: добавлены колонки для пескоструйщика и супортов")
-                    
-                    # Миграция для системы напоминаний
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS reminder_sent BOOLEAN DEFAULT FALSE")
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS reminder_message_id BIGINT")
-                    logger.info("✅ Миграция: добавлены колонки для системы напоминаний")
-                    
-                    # Миграция для типа заказа 70/30
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS painter_70_id INTEGER REFERENCES users(id)")
-                    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS painter_30_id INTEGER REFERENCES users(id)")
-                    logger.info("✅ Миграция: добавлены колонки для маляров в заказах 70/30")
-                    
-                    # Удаляем поле profession из таблицы orders, если оно существует
-                    try:
-                        await conn.execute("ALTER TABLE orders DROP COLUMN IF EXISTS profession")
-                    except Exception:
-                        pass  # Игнорируем ошибку, если колонка не существует
-                    
-                    # Удаляем старое ограничение уникальности на order_number, если оно существует
-                    try:
-                        await conn.execute("ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_order_number_key")
-                    except Exception:
-                        pass  # Игнорируем ошибку, если ограничение не существует
-                    
-                    # Уникальность номеров заказов контролируется на уровне приложения
-                    # через проверку в check_order_number_exists с учетом профессии
-                    
-                    logger.info("✅ Все миграции выполнены успешно")
-                except Exception as e:
-                    # Игнорируем ошибки, если колонки уже существуют
-                    logger.warning(f"⚠️ Предупреждение при выполнении миграций: {e}")
-                    pass
-                
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS earnings_adjustments (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        month_start DATE NOT NULL,
-                        prep_delta INTEGER NOT NULL,
-                        painting_delta INTEGER NOT NULL,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_earnings_adjustments_user_month ON earnings_adjustments(user_id, month_start)")
-                
-                # Таблица достижений
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS user_achievements (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                        achievement_id VARCHAR(50) NOT NULL,
-                        earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        announced BOOLEAN DEFAULT FALSE,
-                        UNIQUE(user_id, achievement_id)
-                    )
-                """)
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_achievements_user ON user_achievements(user_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_achievements_announced ON user_achievements(announced)")
-                
-                # Индексы для оптимизации
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
-                await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
-                
-            finally:
-                # Освобождаем соединение
-                await self.pool.release(conn)
-                
+            async with self.pool.acquire() as conn:
+                # Быстрая проверка: если схема актуальна, DDL не выполняется
+                if await migrations.get_schema_version(conn) < migrations.LATEST_VERSION:
+                    await migrations.migrate(conn)
+                await self._check_shop_calendar(conn)
+        except ShopCalendarMismatchError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка инициализации таблиц: {e}")
             raise Exception(f"Не удалось инициализировать таблицы: {e}")
 
-    async def get_or_create_user(self, tg_id: int, name: str, profession: str = None) -> int:
-        """Получает или создает пользователя, возвращает user_id"""
+    async def _check_shop_calendar(self, conn):
+        """Сверяет календарь мастерской из настроек с записанным в базе (shop_calendar). Пустая база
+        принимает календарь из настроек (пустые секции пересоздаются), база с данными при расхождении
+        не запускается - ShopCalendarMismatchError"""
+        configured = (periods.BUSINESS_TZ.key, periods.CUTOVER_HOUR)
+        row = await conn.fetchrow("SELECT timezone, cutover_hour FROM shop_calendar")
+        if row and (row['timezone'], row['cutover_hour']) == configured:
+            return
+
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", migrations.MIGRATIONS_LOCK_KEY)
+            row = await conn.fetchrow("SELECT timezone, cutover_hour FROM shop_calendar")
+            if row and (row['timezone'], row['cutover_hour']) == configured:
+                return
+            has_data = await conn.fetchval("""
+                SELECT EXISTS(SELECT 1 FROM orders) OR EXISTS(SELECT 1 FROM orders_archive)
+                    OR EXISTS(SELECT 1 FROM payroll_closed_months)
+            """)
+            if row and has_data:
+                raise ShopCalendarMismatchError(
+                    f"Данные базы размечены по календарю {row['timezone']}, начало суток в {row['cutover_hour']}:00, "
+                    f"а в настройках {configured[0]}, {configured[1]}:00. Верните BUSINESS_TIMEZONE и "
+                    f"SHOP_DAY_CUTOVER_HOUR или перенесите данные (README, «Календарь мастерской»)"
+                )
+
+            # Первый запуск с записью календаря: секции должны быть размечены по календарю из настроек
+            partitions = await conn.fetch("""
+                SELECT c.relname, i.inhparent::regclass::TEXT AS parent,
+                       pg_get_expr(c.relpartbound, c.oid) AS bounds
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent IN ('orders'::regclass, 'orders_archive'::regclass)
+                  AND c.relname ~ '^orders_[0-9]{4}_[0-9]{2}$'
+            """)
+            mismatched = [
+                partition for partition in partitions
+                if partition['bounds'] != orders_partition_bounds(orders_partition_month(partition['relname']))
+            ]
+            if mismatched and has_data:
+                names = ", ".join(sorted(partition['relname'] for partition in mismatched))
+                raise ShopCalendarMismatchError(
+                    f"Секции {names} размечены не по календарю из настроек ({configured[0]}, "
+                    f"начало суток в {configured[1]}:00). Верните BUSINESS_TIMEZONE и SHOP_DAY_CUTOVER_HOUR "
+                    f"или перенесите данные (README, «Календарь мастерской»)"
+                )
+            # В пустой базе секции пересоздаются: сначала удаляются все, чтобы новые границы не пересеклись со старыми
+            for partition in mismatched:
+                await conn.execute(f"DROP TABLE {partition['relname']}")
+            for partition in mismatched:
+                month = orders_partition_month(partition['relname'])
+                await conn.execute(
+                    f"CREATE TABLE {partition['relname']} PARTITION OF {partition['parent']} {orders_partition_bounds(month)}"
+                )
+            await conn.execute("""
+                INSERT INTO shop_calendar (timezone, cutover_hour) VALUES ($1, $2)
+                ON CONFLICT (id) DO UPDATE
+                SET timezone = EXCLUDED.timezone, cutover_hour = EXCLUDED.cutover_hour, updated_at = CURRENT_TIMESTAMP
+            """, *configured)
+        logger.info(f"📅 Календарь мастерской: {configured[0]}, начало суток в {configured[1]}:00")
+
+    async def check_schema_version(self) -> bool:
+        """Проверяет, что схема базы данных актуальна (без DDL)"""
         async with self.pool.acquire() as conn:
-            # Пытаемся найти существующего пользователя
-            user = await conn.fetchrow(
-                "SELECT id, profession FROM users WHERE tg_id = $1", tg_id
-            )
-            
-            if user:
-                # Обновляем только имя, профессию только если она передана явно
-                if profession:
-                    await conn.execute(
-                        "UPDATE users SET profession = $1, name = $2 WHERE tg_id = $3",
-                        profession, name, tg_id
-                    )
+            version = await migrations.get_schema_version(conn)
+        if version < migrations.LATEST_VERSION:
+            logger.warning(f"⚠️ Схема базы данных устарела: версия {version}, ожидается {migrations.LATEST_VERSION}")
+            return False
+        return True
+
+    @query("write")
+    async def ensure_orders_partitions(self, first_month: date, last_month: date) -> List[str]:
+        """Создаёт недостающие месячные секции orders с first_month по last_month включительно.
+        Архивные месяцы пропускаются: их секция уже принадлежит orders_archive"""
+        created = []
+        months = []
+        month = first_month
+        while month <= last_month:
+            months.append(month)
+            month = _add_months(month, 1)
+        async with self.pool.acquire() as conn:
+            archived = {row['month'] for row in await conn.fetch(
+                "SELECT month FROM archived_months WHERE month = ANY($1::DATE[])", months
+            )}
+            # Таблица с именем секции может существовать и вне orders (архив, отсоединённая секция) -
+            # CREATE TABLE IF NOT EXISTS тогда молча ничего не делает, и строки уходят в orders_default
+            existing = {row['relname']: row['parent'] for row in await conn.fetch("""
+                SELECT c.relname, i.inhparent::regclass::TEXT AS parent
+                FROM pg_class c
+                LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+                WHERE c.relname = ANY($1::TEXT[]) AND pg_table_is_visible(c.oid)
+            """, [orders_partition_name(month) for month in months])}
+            for month in months:
+                name = orders_partition_name(month)
+                if month in archived:
+                    logger.warning(f"⚠️ Секция {name} не создана: месяц {month:%m.%Y} перенесён в архив")
+                elif name in existing:
+                    if existing[name] != 'orders':
+                        logger.error(f"❌ Секция {name} не создана: таблица с этим именем уже есть вне orders "
+                                     f"({existing[name] or 'отсоединена'})")
                 else:
-                    await conn.execute(
-                        "UPDATE users SET name = $1 WHERE tg_id = $2",
-                        name, tg_id
-                    )
-                return user['id']
-            
-            # Создаем нового пользователя с профессией по умолчанию
-            default_profession = profession or "painter"
-            user_id = await conn.fetchval(
-                "INSERT INTO users (tg_id, name, profession) VALUES ($1, $2, $3) RETURNING id",
-                tg_id, name, default_profession
+                    try:
+                        await conn.execute(orders_partition_sql(month))
+                        created.append(name)
+                    except asyncpg.exceptions.CheckViolationError:
+                        # Строки этого месяца уже лежат в orders_default - секцию нужно выносить вручную
+                        logger.error(f"❌ Секция {name} не создана: в orders_default есть заказы за этот месяц")
+        if created:
+            logger.info(f"✅ Созданы секции orders: {', '.join(created)}")
+        return created
+
+    @query("read", primary=True)
+    async def get_archived_months(self) -> set:
+        """Месяцы, перенесённые в архив orders_archive"""
+        async with self.pool.acquire() as conn:
+            return {row['month'] for row in await conn.fetch("SELECT month FROM archived_months")}
+
+    @query("write")
+    async def archive_orders_month(self, month_start: date) -> int:
+        """Переносит закрытый месяц в архив orders_archive и сохраняет итоги по пользователям, возвращает число заказов"""
+        if month_start >= periods.month_start():
+            raise ValueError(f"Месяц {month_start:%m.%Y} ещё не закрыт")
+        name = orders_partition_name(month_start)
+        async with self.pool.acquire() as conn, conn.transaction():
+            if await conn.fetchval("SELECT EXISTS(SELECT 1 FROM archived_months WHERE month = $1)", month_start):
+                return 0
+            attached = await conn.fetchval("""
+                SELECT EXISTS(SELECT 1 FROM pg_inherits
+                              WHERE inhrelid = to_regclass($1) AND inhparent = 'orders'::regclass)
+            """, name)
+            if not attached:
+                raise ValueError(f"Секция {name} не найдена среди секций orders")
+            # Архив должен оставаться старше рабочей таблицы (на этом держится постраничный список заказов)
+            older = await conn.fetchval("""
+                SELECT MIN(c.relname) FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'orders'::regclass AND c.relname ~ '^orders_[0-9]{4}_[0-9]{2}$'
+                  AND c.relname < $1
+            """, name)
+            if older:
+                raise ValueError(f"Сначала перенесите в архив более ранний месяц ({older})")
+
+            # Секция переезжает целиком, без копирования строк; агрегаты заработка и статистика не меняются
+            await conn.execute(f"ALTER TABLE orders DETACH PARTITION {name}")
+            await conn.execute(f"""
+                INSERT INTO user_month_summary (user_id, month, orders_count, confirmed_orders, rejected_orders,
+                                                alumochrome_orders, big_size_orders, team_orders, earnings)
+                {_user_month_summary_sql(name)}
+            """, month_start)
+            orders_count = await conn.fetchval(f"SELECT COUNT(*) FROM {name}")
+            await conn.execute(f"ALTER TABLE orders_archive ATTACH PARTITION {name} {orders_partition_bounds(month_start)}")
+            await conn.execute(
+                "INSERT INTO archived_months (month, orders_count) VALUES ($1, $2)",
+                month_start, orders_count
             )
-            return user_id
+        logger.info(f"📦 Месяц {month_start:%m.%Y} перенесён в архив: {orders_count} заказов")
+        return orders_count
+
+    @query("write")
+    async def archive_closed_months(self, keep_months: int) -> List[date]:
+        """Архивирует месяцы старше keep_months последних (текущий месяц не считается), возвращает перенесённые"""
+        boundary = _add_months(periods.month_start(), -keep_months)
+        async with self.pool.acquire() as conn:
+            names = [row['relname'] for row in await conn.fetch("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'orders'::regclass AND c.relname ~ '^orders_[0-9]{4}_[0-9]{2}$'
+                ORDER BY c.relname
+            """)]
+        archived = []
+        for name in names:
+            month = orders_partition_month(name)
+            if month < boundary:
+                await self.archive_orders_month(month)
+                archived.append(month)
+        return archived
+
+    @query("write")
+    async def detach_orders_partition(self, month_start: date) -> str:
+        """Отсоединяет месячную секцию orders (таблица остаётся, её можно выгрузить и удалить)"""
+        name = orders_partition_name(month_start)
+        async with self.pool.acquire() as conn:
+            await conn.execute(f"ALTER TABLE orders DETACH PARTITION {name}")
+        logger.info(f"📦 Секция {name} отсоединена от orders")
+        return name
+
+    async def _apply_order_change(self, conn, old_order: Optional[Dict[str, Any]], new_order: Optional[Dict[str, Any]]):
+        """Переносит изменение заказа в агрегаты user_day_earnings, user_stats и корректировки закрытых месяцев
+        (вызывается внутри транзакции)"""
+        await self._apply_earnings_change(conn, old_order, new_order)
+        await self._apply_stats_change(conn, old_order, new_order)
+        await self._carry_over_closed_months(conn, old_order, new_order)
+
+    async def _release_order_numbers(self, conn, orders):
+        """Освобождает в реестре order_numbers номера удалённых заказов, если их больше никто не использует
+        (ни рабочая таблица, ни архив)"""
+        keys = {(order['order_profession'], order['order_number']) for order in orders if order['order_profession']}
+        if not keys:
+            return
+        professions, numbers = zip(*keys)
+        await conn.execute("""
+            DELETE FROM order_numbers r
+            USING unnest($1::varchar[], $2::varchar[]) AS k(order_profession, order_number)
+            WHERE r.order_profession = k.order_profession AND r.order_number = k.order_number
+              AND NOT EXISTS (
+                  SELECT 1 FROM orders o
+                  WHERE o.order_profession = r.order_profession AND o.order_number = r.order_number
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM orders_archive a
+                  WHERE a.order_profession = r.order_profession AND a.order_number = r.order_number
+              )
+        """, list(professions), list(numbers))
+
+    async def _check_not_archived(self, conn, order_id: int):
+        """Заказа нет в рабочей таблице: если он в архиве - ArchivedOrderError вместо тихого 'не найден'"""
+        archived = await conn.fetchrow("SELECT order_number, created_at FROM orders_archive WHERE id = $1", order_id)
+        if archived:
+            raise ArchivedOrderError(archived['order_number'], periods.month_start(archived['created_at']))
+
+    async def _apply_stats_change(self, conn, old_order: Optional[Dict[str, Any]], new_order: Optional[Dict[str, Any]]):
+        """Переносит изменение заказа в счётчики user_stats"""
+        deltas: Dict[int, Dict[str, Any]] = {}
+        for sign, order in ((-1, old_order), (1, new_order)):
+            for user_id, counters in _order_stat_counters(order).items():
+                user_delta = deltas.setdefault(user_id, {})
+                for field, value in counters.items():
+                    user_delta[field] = user_delta.get(field, 0) + value * sign
+
+        rows = []
+        for user_id, user_delta in deltas.items():
+            if not any(user_delta.values()):
+                continue
+            rows.append((
+                user_id,
+                *(user_delta.get(field, 0) for field in USER_STATS_COUNTERS),
+                Decimal(user_delta.get('lifetime_earnings', 0))
+            ))
+        if not rows:
+            return
+
+        await conn.executemany("""
+            INSERT INTO user_stats (user_id, confirmed_orders, rejected_orders, alumochrome_orders,
+                                    big_size_orders, team_orders, orders_total, lifetime_earnings)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+            ON CONFLICT (user_id) DO UPDATE
+            SET confirmed_orders = user_stats.confirmed_orders + EXCLUDED.confirmed_orders,
+                rejected_orders = user_stats.rejected_orders + EXCLUDED.rejected_orders,
+                alumochrome_orders = user_stats.alumochrome_orders + EXCLUDED.alumochrome_orders,
+                big_size_orders = user_stats.big_size_orders + EXCLUDED.big_size_orders,
+                team_orders = user_stats.team_orders + EXCLUDED.team_orders,
+                orders_total = user_stats.orders_total + EXCLUDED.orders_total,
+                lifetime_earnings = user_stats.lifetime_earnings + EXCLUDED.lifetime_earnings
+        """, rows)
+
+    async def _apply_earnings_change(self, conn, old_order: Optional[Dict[str, Any]], new_order: Optional[Dict[str, Any]]):
+        """Переносит изменение заказа в агрегат user_day_earnings"""
+        deltas: Dict[tuple, list] = {}
+        for sign, order in ((-1, old_order), (1, new_order)):
+            for user_id, day, role, amount in _order_earning_shares(order):
+                delta = deltas.setdefault((user_id, day, role), [Decimal(0), 0])
+                delta[0] += amount * sign
+                delta[1] += sign
+
+        rows = [
+            (user_id, day, role, amount, count)
+            for (user_id, day, role), (amount, count) in deltas.items()
+            if amount != 0 or count != 0
+        ]
+        if not rows:
+            return
+
+        await conn.executemany("""
+            INSERT INTO user_day_earnings (user_id, day, role, amount, orders_count)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (user_id, day, role) DO UPDATE
+            SET amount = user_day_earnings.amount + EXCLUDED.amount,
+                orders_count = user_day_earnings.orders_count + EXCLUDED.orders_count
+        """, rows)
+
+    def _cache_user(self, user: Dict[str, Any]):
+        """Кладёт пользователя в кэш, вытесняя самые старые записи"""
+        self._user_cache[user['tg_id']] = (time.monotonic(), user)
+        self._user_cache.move_to_end(user['tg_id'])
+        while len(self._user_cache) > config.USER_CACHE_SIZE:
+            self._user_cache.popitem(last=False)
+
+    def _cached_user(self, tg_id: int) -> Optional[Dict[str, Any]]:
+        """Пользователь из кэша, если запись ещё не устарела"""
+        cached = self._user_cache.get(tg_id)
+        if not cached:
+            return None
+        cached_at, user = cached
+        if time.monotonic() - cached_at > config.USER_CACHE_TTL:
+            del self._user_cache[tg_id]
+            return None
+        return user
+
+    def invalidate_user_cache(self, tg_id: int = None):
+        """Сбрасывает кэш пользователя (или весь кэш, если tg_id не указан)"""
+        if tg_id is None:
+            self._user_cache.clear()
+        else:
+            self._user_cache.pop(tg_id, None)
+
+    @query("write")
+    async def get_or_create_user(self, tg_id: int, name: str, profession: str = None) -> int:
+        """Получает или создает пользователя, возвращает user_id"""
+        cached = self._cached_user(tg_id)
+        if cached and cached['name'] == name and profession in (None, cached['profession']):
+            return cached['id']
+
+        async with self.pool.acquire() as conn:
+            # Один запрос: вставка нового пользователя, обновление только при изменении имени или профессии
+            user = await conn.fetchrow("""
+                WITH upsert AS (
+                    INSERT INTO users (tg_id, name, profession)
+                    VALUES ($1, $2, COALESCE($3::VARCHAR, 'painter'))
+                    ON CONFLICT (tg_id) DO UPDATE
+                    SET name = EXCLUDED.name,
+                        profession = COALESCE($3::VARCHAR, users.profession)
+                    WHERE users.name IS DISTINCT FROM EXCLUDED.name
+                       OR ($3::VARCHAR IS NOT NULL AND users.profession IS DISTINCT FROM $3::VARCHAR)
+                    RETURNING id, tg_id, name, profession
+                )
+                SELECT id, tg_id, name, profession FROM upsert
+                UNION ALL
+                SELECT id, tg_id, name, profession FROM users
+                WHERE tg_id = $1 AND NOT EXISTS (SELECT 1 FROM upsert)
+            """, tg_id, name, profession)
+
+            if not user:
+                # Пользователя вставили параллельно после снимка запроса
+                user = await conn.fetchrow(
+                    "SELECT id, tg_id, name, profession FROM users WHERE tg_id = $1", tg_id
+                )
+
+        self._cache_user(dict(user))
+        return user['id']
     
+    @query("write")
     async def update_user_profession(self, tg_id: int, profession: str):
         """Обновляет профессию пользователя"""
         async with self.pool.acquire() as conn:
@@ -335,95 +1373,86 @@ class Database:
                 "UPDATE users SET profession = $1 WHERE tg_id = $2",
                 profession, tg_id
             )
+        self.invalidate_user_cache(tg_id)
     
-    async def get_user_profession(self, tg_id: int) -> str:
-        """Получает профессию пользователя"""
+    @query("read", primary=True)
+    async def get_user_by_tg_id(self, tg_id: int) -> Optional[Dict[str, Any]]:
+        """Получает пользователя по Telegram ID (без создания)"""
+        cached = self._cached_user(tg_id)
+        if cached:
+            return cached
+
         async with self.pool.acquire() as conn:
             user = await conn.fetchrow(
-                "SELECT profession FROM users WHERE tg_id = $1",
+                "SELECT id, tg_id, name, profession FROM users WHERE tg_id = $1",
                 tg_id
             )
-            return user['profession'] if user else None
+        if not user:
+            return None
+        user = dict(user)
+        self._cache_user(user)
+        return user
+
+    @query("read", primary=True)
+    async def get_user_profession(self, tg_id: int) -> str:
+        """Получает профессию пользователя"""
+        user = await self.get_user_by_tg_id(tg_id)
+        return user['profession'] if user else None
 
+    @query("write")
     async def create_order(self, order_number: str, user_id: int, set_type: str, 
                           size: str = None, alumochrome: bool = False, price: int = 0, 
                           photo_file_id: str = None, suspensia_type: str = None, quantity: int = 1,
                           spraying_deep: int = 0, spraying_shallow: int = 0, status: str = 'draft',
                           painter_70_id: int = None, painter_30_id: int = None) -> int:
-        """Создает новый заказ"""
-        async with self.pool.acquire() as conn:
-            order_id = await conn.fetchval("""
-                INSERT INTO orders (order_number, user_id, set_type, price, status)
-                VALUES ($1, $2, $3, $4, $5) RETURNING id
-            """, order_number, user_id, set_type, price, status)
+        """Создает новый заказ; если номер занят в пределах профессии - OrderNumberExistsError"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            # Номер сначала резервируется в реестре order_numbers (уникальность на все секции orders)
+            order = await conn.fetchrow("""
+                WITH reserved AS (
+                    INSERT INTO order_numbers (order_profession, order_number)
+                    SELECT COALESCE(u.profession, 'painter'), $1
+                    FROM users u
+                    WHERE u.id = $2
+                    ON CONFLICT DO NOTHING
+                    RETURNING order_profession
+                )
+                INSERT INTO orders (order_number, user_id, order_profession, set_type, size, alumochrome,
+                                    price, photo_file_id, suspensia_type, quantity,
+                                    spraying_deep, spraying_shallow, status, painter_70_id, painter_30_id)
+                SELECT $1, $2, r.order_profession, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14
+                FROM reserved r
+                RETURNING *
+            """, order_number, user_id, set_type, size or None, alumochrome, price,
+                photo_file_id or None, suspensia_type or None, quantity,
+                spraying_deep or 0, spraying_shallow or 0, status,
+                painter_70_id or None, painter_30_id or None)
             
-            # Обновляем заказ с дополнительными данными
-            if size or alumochrome is not None or photo_file_id or suspensia_type or quantity != 1 or spraying_deep or spraying_shallow or painter_70_id or painter_30_id:
-                update_fields = []
-                update_values = []
-                param_count = 1
-                
-                if size:
-                    update_fields.append(f"size = ${param_count}")
-                    update_values.append(size)
-                    param_count += 1
-                
-                if alumochrome is not None:
-                    update_fields.append(f"alumochrome = ${param_count}")
-                    update_values.append(alumochrome)
-                    param_count += 1
-                
-                if photo_file_id:
-                    update_fields.append(f"photo_file_id = ${param_count}")
-                    update_values.append(photo_file_id)
-                    param_count += 1
-                
-                if suspensia_type:
-                    update_fields.append(f"suspensia_type = ${param_count}")
-                    update_values.append(suspensia_type)
-                    param_count += 1
-                
-                if quantity != 1:
-                    update_fields.append(f"quantity = ${param_count}")
-                    update_values.append(quantity)
-                    param_count += 1
-                
-                if spraying_deep:
-                    update_fields.append(f"spraying_deep = ${param_count}")
-                    update_values.append(spraying_deep)
-                    param_count += 1
-                
-                if spraying_shallow:
-                    update_fields.append(f"spraying_shallow = ${param_count}")
-                    update_values.append(spraying_shallow)
-                    param_count += 1
-                
-                if painter_70_id:
-                    update_fields.append(f"painter_70_id = ${param_count}")
-                    update_values.append(painter_70_id)
-                    param_count += 1
-                
-                if painter_30_id:
-                    update_fields.append(f"painter_30_id = ${param_count}")
-                    update_values.append(painter_30_id)
-                    param_count += 1
-                
-                if update_fields:
-                    update_values.append(order_id)
-                    await conn.execute(f"""
-                        UPDATE orders SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP
-                        WHERE id = ${param_count}
-                    """, *update_values)
-            return order_id
+            if not order:
+                profession = await conn.fetchval("SELECT profession FROM users WHERE id = $1", user_id)
+                if profession is None:
+                    raise Exception(f"Пользователь {user_id} не найден")
+                raise OrderNumberExistsError(order_number, profession)
+            
+            # Счётчик заказов пользователя растёт всегда, заработок - только у подтверждённых заказов
+            await self._apply_order_change(conn, None, dict(order))
+            return order['id']
 
+    @query("write")
     async def update_order_status(self, order_id: int, status: str):
-        """Обновляет статус заказа"""
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE orders SET status = $1, updated_at = CURRENT_TIMESTAMP WHERE id = $2",
+        """Обновляет статус заказа (заказ из архива - ArchivedOrderError)"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            old_order = await conn.fetchrow("SELECT * FROM orders WHERE id = $1 FOR UPDATE", order_id)
+            if not old_order:
+                await self._check_not_archived(conn, order_id)
+                return
+            new_order = await conn.fetchrow(
+                "UPDATE orders SET status = $1, updated_at = CURRENT_TIMESTAMP WHERE id = $2 RETURNING *",
                 status, order_id
             )
+            await self._apply_order_change(conn, dict(old_order), dict(new_order))
 
+    @query("read", primary=True)
     async def get_order_by_id(self, order_id: int) -> Optional[Dict[str, Any]]:
         """Получает заказ по ID"""
         async with self.pool.acquire() as conn:
@@ -435,200 +1464,103 @@ class Database:
             """, order_id)
             return dict(order) if order else None
 
-    async def get_user_earnings_today(self, user_id: int) -> int:
-        """Получает заработок пользователя за сегодня (по часовому поясу Уфы)"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_local = start_local + timedelta(days=1)
-
-        start_utc = start_local.astimezone(ZoneInfo("UTC"))
-        end_utc = end_local.astimezone(ZoneInfo("UTC"))
-
-        async with self.pool.acquire() as conn:
-            # Получаем заработок от обычных заказов
-            regular_earnings = await conn.fetchval("""
-                SELECT COALESCE(SUM(price), 0)
-                FROM orders
+    @query("read")
+    async def get_user_earnings_days(self, user_id: int, start_day: date, end_day: date) -> Dict[str, Any]:
+        """Заработок пользователя за локальные дни [start_day, end_day) из агрегата user_day_earnings"""
+        async with self._pool().acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT COALESCE(SUM(amount), 0) AS total,
+                       COALESCE(SUM(amount) FILTER (WHERE role = 'owner'), 0) AS owner,
+                       COALESCE(SUM(amount) FILTER (WHERE role = 'share_70'), 0) AS share_70,
+                       COALESCE(SUM(amount) FILTER (WHERE role = 'share_30'), 0) AS share_30,
+                       COALESCE(SUM(orders_count), 0) AS orders_count,
+                       COUNT(DISTINCT day) FILTER (WHERE orders_count > 0) AS active_days
+                FROM user_day_earnings
                 WHERE user_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type NOT LIKE '70_30_%'
-            """, user_id, start_utc, end_utc) or 0
-            
-            # Получаем заработок от заказов 70/30 (70%)
-            earnings_70 = await conn.fetchval("""
-                SELECT COALESCE(SUM(price * 0.7), 0)
-                FROM orders
-                WHERE painter_70_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type LIKE '70_30_%'
-            """, user_id, start_utc, end_utc) or 0
-            
-            # Получаем заработок от заказов 70/30 (30%)
-            earnings_30 = await conn.fetchval("""
-                SELECT COALESCE(SUM(price * 0.3), 0)
-                FROM orders
-                WHERE painter_30_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type LIKE '70_30_%'
-            """, user_id, start_utc, end_utc) or 0
-            
-            return int(regular_earnings + earnings_70 + earnings_30)
+                  AND day >= $2
+                  AND day <  $3
+            """, user_id, start_day, end_day)
 
-    async def get_user_earnings_month(self, user_id: int) -> int:
-        """Получает заработок пользователя за текущий месяц (по часовому поясу Уфы)"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
+        active_days = int(row['active_days'] or 0)
+        total = Decimal(row['total'] or 0)
+        return {
+            "total": int(total),
+            "owner": int(row['owner'] or 0),
+            "share_70": int(row['share_70'] or 0),
+            "share_30": int(row['share_30'] or 0),
+            "orders_count": int(row['orders_count'] or 0),
+            "active_days": active_days,
+            "avg_per_day": float(total / active_days) if active_days else 0.0
+        }
 
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
+    @query("read")
+    async def get_user_earnings_today(self, user_id: int) -> int:
+        """Получает заработок пользователя за сегодняшний день мастерской"""
+        today = periods.day_window()
+        earnings = await self.get_user_earnings_days(user_id, today.start, today.end)
+        return earnings["total"]
 
-        async with self.pool.acquire() as conn:
-            # Получаем заработок от обычных заказов
-            regular_earnings = await conn.fetchval("""
-                SELECT COALESCE(SUM(price), 0)
-                FROM orders
-                WHERE user_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type NOT LIKE '70_30_%'
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            # Получаем заработок от заказов 70/30 (70%)
-            earnings_70 = await conn.fetchval("""
-                SELECT COALESCE(SUM(price * 0.7), 0)
-                FROM orders
-                WHERE painter_70_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type LIKE '70_30_%'
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            # Получаем заработок от заказов 70/30 (30%)
-            earnings_30 = await conn.fetchval("""
-                SELECT COALESCE(SUM(price * 0.3), 0)
-                FROM orders
-                WHERE painter_30_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type LIKE '70_30_%'
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            return int(regular_earnings + earnings_70 + earnings_30)
+    @query("read")
+    async def get_user_earnings_month(self, user_id: int) -> int:
+        """Получает заработок пользователя за текущий месяц мастерской"""
+        month = periods.month_window()
+        earnings = await self.get_user_earnings_days(user_id, month.start, month.end)
+        return earnings["total"]
 
+    @query("read")
     async def get_user_earnings_month_breakdown(self, user_id: int) -> Dict[str, int]:
         """Возвращает разбивку заработка за месяц по подготовке и покраске (для маляров)."""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
+        month = periods.payroll_window()
+        return await self.get_user_earnings_breakdown(user_id, month.start, month.end)
 
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
+    @query("read")
+    async def get_user_earnings_breakdown(self, user_id: int, start_day: date, end_day: date) -> Dict[str, int]:
+        """Разбивка заработка за дни мастерской [start_day, end_day) на подготовку и покраску
+        (корректировки - за расчётные месяцы, начинающиеся в периоде; закрытые месяцы - из снимков)"""
+        async with self._pool().acquire() as conn:
+            snapshots = {}
+            if start_day.day == 1 and end_day.day == 1:
+                snapshots = {row['month']: row for row in await conn.fetch("""
+                    SELECT c.month, COALESCE(s.total, 0) AS total, COALESCE(s.prep, 0) AS prep,
+                           COALESCE(s.painting, 0) AS painting
+                    FROM payroll_closed_months c
+                    LEFT JOIN payroll_snapshots s ON s.month = c.month AND s.user_id = $1
+                    WHERE c.month >= $2 AND c.month < $3
+                """, user_id, start_day, end_day)}
 
-        total_decimal = Decimal(0)
-        prep_decimal = Decimal(0)
-        painting_decimal = Decimal(0)
+            # Закрытые месяцы берутся из снимков, открытые отрезки между ними считаются по заказам
+            result = {"total": 0, "prep": 0, "painting": 0}
+            live_ranges = []
+            run_start = start_day
+            month = start_day
+            while snapshots and month < end_day:
+                next_month = _add_months(month, 1)
+                if month in snapshots:
+                    for key in result:
+                        result[key] += snapshots[month][key]
+                    if run_start < month:
+                        live_ranges.append((run_start, month))
+                    run_start = next_month
+                month = next_month
+            if run_start < end_day:
+                live_ranges.append((run_start, end_day))
 
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT price,
-                       set_type,
-                       size,
-                       COALESCE(quantity, 1) AS quantity,
-                       COALESCE(alumochrome, FALSE) AS alumochrome,
-                       user_id,
-                       painter_70_id,
-                       painter_30_id
-                FROM orders
-                WHERE status = 'confirmed'
-                  AND (
-                        (user_id = $1 AND (set_type NOT LIKE '70_30_%' OR painter_70_id IS NULL))
-                        OR painter_70_id = $1
-                        OR painter_30_id = $1
-                  )
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-            """, user_id, start_month_utc, end_month_utc)
-
-            adjustments = await conn.fetch("""
-                SELECT prep_delta, painting_delta
-                FROM earnings_adjustments
-                WHERE user_id = $1 AND month_start = $2
-            """, user_id, start_month_local.date())
- 
-        for row in rows:
-            set_type = row["set_type"] or ""
-            price = Decimal(row["price"] or 0)
-            quantity = row["quantity"] or 1
- 
-            if price <= 0:
-                continue
- 
-            # Определяем долю пользователя в заказе
-            share = Decimal(0)
-            if set_type.startswith("70_30_"):
-                if row["painter_70_id"] == user_id:
-                    share = Decimal("0.7")
-                elif row["painter_30_id"] == user_id:
-                    share = Decimal("0.3")
-                elif row["user_id"] == user_id:
-                    share = Decimal(1)
-                else:
-                    continue
-            else:
-                if row["user_id"] != user_id:
-                    continue
-                share = Decimal(1)
- 
-            order_total = price * share
-            total_decimal += order_total
- 
-            base_type = set_type
-            if set_type.startswith("70_30_"):
-                parts = set_type.split("_", 2)
-                base_type = parts[2] if len(parts) > 2 else ""
- 
-            prep_part = Decimal(0)
-            if base_type == "single":
-                prep_part = Decimal(config.PRICE_PREP_SINGLE * max(quantity, 1))
-            elif base_type == "set":
-                prep_part = Decimal(config.PRICE_PREP_SET * max(quantity, 1))
- 
-            prep_decimal += prep_part * share
- 
-        for adj in adjustments:
-            prep_decimal += Decimal(adj['prep_delta'])
-            painting_decimal += Decimal(adj['painting_delta'])
-            total_decimal += Decimal(adj['prep_delta'] + adj['painting_delta'])
-
-        total_int = int(total_decimal)
-        prep_int = int(prep_decimal)
-        painting_int = max(total_int - prep_int, 0)
-
-        return {
-            "total": total_int,
-            "prep": prep_int,
-            "painting": painting_int
-        }
+            for range_start, range_end in live_ranges:
+                window = periods.range_window(range_start, range_end)
+                row = await conn.fetchrow(
+                    USER_EARNINGS_SPLIT_SQL, window.start_utc, window.end_utc,
+                    config.PRICE_PREP_SINGLE, config.PRICE_PREP_SET, range_start, range_end, user_id
+                )
+                if row:
+                    for key, value in _payroll_totals(row).items():
+                        result[key] += value
+        return result
 
+    @query("write")
     async def add_earnings_adjustment(self, user_id: int, prep_delta: int, painting_delta: int, description: str):
-        """Добавляет корректировку заработка за текущий месяц"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        month_start = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0).date()
-        created_at = now_local.replace(tzinfo=None)
+        """Добавляет корректировку заработка за текущий расчётный период"""
+        month_start = periods.payroll_window().start
+        created_at = periods.now().replace(tzinfo=None)
 
         async with self.pool.acquire() as conn:
             await conn.execute(
@@ -644,13 +1576,12 @@ class Database:
                 created_at
             )
 
+    @query("read")
     async def get_earnings_adjustments_history(self, user_id: int) -> List[Dict[str, Any]]:
-        """Возвращает историю корректировок заработка за текущий месяц"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        month_start = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0).date()
+        """Возвращает историю корректировок заработка за текущий расчётный период"""
+        month_start = periods.payroll_window().start
 
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             rows = await conn.fetch(
                 """
                 SELECT id, prep_delta, painting_delta, description, created_at
@@ -664,126 +1595,377 @@ class Database:
 
         return [dict(row) for row in rows]
     
+    @query("write")
     async def delete_earnings_adjustment(self, adjustment_id: int, user_id: int) -> bool:
         """Удаляет корректировку заработка (только свои)"""
         async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                "DELETE FROM earnings_adjustments WHERE id = $1 AND user_id = $2",
-                adjustment_id,
-                user_id
-            )
+            # Корректировки закрытого месяца уже вошли в снимок зарплаты
+            result = await conn.execute("""
+                DELETE FROM earnings_adjustments
+                WHERE id = $1 AND user_id = $2
+                  AND month_start NOT IN (SELECT month FROM payroll_closed_months)
+            """, adjustment_id, user_id)
             return result.split()[-1] == "1"
 
+    @query("write")
+    async def rebuild_user_day_earnings(self) -> int:
+        """Пересобирает агрегат user_day_earnings по таблице заказов (архивные месяцы не трогает), возвращает число строк"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                DELETE FROM user_day_earnings
+                WHERE date_trunc('month', day)::DATE NOT IN (SELECT month FROM archived_months)
+            """)
+            result = await conn.execute(f"""
+                INSERT INTO user_day_earnings (user_id, day, role, amount, orders_count)
+                SELECT * FROM ({USER_DAY_EARNINGS_RECOMPUTE_SQL}) AS e
+                WHERE date_trunc('month', e.day)::DATE NOT IN (SELECT month FROM archived_months)
+            """)
+            return int(result.split()[-1])
+
+    @query("read")
+    async def check_user_day_earnings(self) -> List[Dict[str, Any]]:
+        """Сравнивает агрегат user_day_earnings с полным пересчётом, возвращает расхождения"""
+        async with self._pool().acquire() as conn:
+            rows = await conn.fetch(f"""
+                WITH expected AS (
+                    SELECT * FROM ({USER_DAY_EARNINGS_RECOMPUTE_SQL}) AS e
+                    WHERE date_trunc('month', e.day)::DATE NOT IN (SELECT month FROM archived_months)
+                ),
+                actual AS (
+                    SELECT user_id, day, role, amount, orders_count
+                    FROM user_day_earnings
+                    WHERE (amount <> 0 OR orders_count <> 0)
+                      AND date_trunc('month', day)::DATE NOT IN (SELECT month FROM archived_months)
+                )
+                SELECT COALESCE(e.user_id, a.user_id) AS user_id,
+                       COALESCE(e.day, a.day) AS day,
+                       COALESCE(e.role, a.role) AS role,
+                       e.amount AS expected_amount,
+                       a.amount AS actual_amount,
+                       e.orders_count AS expected_orders,
+                       a.orders_count AS actual_orders
+                FROM expected e
+                FULL OUTER JOIN actual a
+                  ON a.user_id = e.user_id AND a.day = e.day AND a.role = e.role
+                WHERE e.amount IS DISTINCT FROM a.amount
+                   OR e.orders_count IS DISTINCT FROM a.orders_count
+                ORDER BY day, user_id, role
+            """)
+            return [dict(row) for row in rows]
+
+    @query("write")
+    async def rebuild_user_stats(self) -> int:
+        """Полностью пересобирает user_stats по таблице заказов и итогам архивных месяцев, возвращает число строк"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("TRUNCATE user_stats")
+            result = await conn.execute(f"INSERT INTO user_stats {USER_STATS_WITH_ARCHIVE_SQL}")
+            return int(result.split()[-1])
+
+    @query("read")
+    async def check_user_stats(self) -> List[Dict[str, Any]]:
+        """Сравнивает user_stats с полным пересчётом, возвращает расхождения"""
+        async with self._pool().acquire() as conn:
+            rows = await conn.fetch(f"""
+                WITH expected AS ({USER_STATS_WITH_ARCHIVE_SQL})
+                SELECT e.*,
+                       s.confirmed_orders AS actual_confirmed_orders,
+                       s.rejected_orders AS actual_rejected_orders,
+                       s.alumochrome_orders AS actual_alumochrome_orders,
+                       s.big_size_orders AS actual_big_size_orders,
+                       s.team_orders AS actual_team_orders,
+                       s.lifetime_earnings AS actual_lifetime_earnings,
+                       s.orders_total AS actual_orders_total
+                FROM expected e
+                LEFT JOIN user_stats s ON s.user_id = e.user_id
+                WHERE COALESCE(s.confirmed_orders, 0) <> e.confirmed_orders
+                   OR COALESCE(s.rejected_orders, 0) <> e.rejected_orders
+                   OR COALESCE(s.alumochrome_orders, 0) <> e.alumochrome_orders
+                   OR COALESCE(s.big_size_orders, 0) <> e.big_size_orders
+                   OR COALESCE(s.team_orders, 0) <> e.team_orders
+                   OR COALESCE(s.lifetime_earnings, 0) <> e.lifetime_earnings
+                   OR COALESCE(s.orders_total, 0) <> e.orders_total
+                ORDER BY e.user_id
+            """)
+            return [dict(row) for row in rows]
+
+    # === ЗАКРЫТИЕ РАСЧЁТНОГО ПЕРИОДА ===
+
+    @query("write")
+    async def close_payroll_month(self, month_start: date) -> int:
+        """Закрывает расчётный месяц: замораживает итоги каждого сотрудника в payroll_snapshots, возвращает их число"""
+        month = periods.payroll_window(month_start)
+        if month.start >= periods.payroll_window().start:
+            raise ValueError(f"Месяц {month.start:%m.%Y} ещё не закончился")
+
+        async with self.pool.acquire() as conn, conn.transaction():
+            # Правки заказов ждут конца закрытия: иначе изменение не попало бы ни в снимок, ни в перенос
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", PAYROLL_LOCK_KEY)
+            if await conn.fetchval("SELECT EXISTS(SELECT 1 FROM payroll_closed_months WHERE month = $1)", month.start):
+                return 0
+            rows = await conn.fetch(
+                PAYROLL_SPLIT_SQL, month.start_utc, month.end_utc,
+                config.PRICE_PREP_SINGLE, config.PRICE_PREP_SET, month.start, month.end
+            )
+            records = []
+            for row in rows:
+                totals = _payroll_totals(row)
+                records.append((
+                    row['user_id'], month.start, row['orders_count'], row['owner'], row['share_70'], row['share_30'],
+                    row['prep_adjustment'], row['painting_adjustment'], totals['total'], totals['prep'], totals['painting']
+                ))
+            await conn.executemany("""
+                INSERT INTO payroll_snapshots (user_id, month, orders_count, owner, share_70, share_30,
+                                               prep_adjustment, painting_adjustment, total, prep, painting)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+            """, records)
+            await conn.execute(
+                "INSERT INTO payroll_closed_months (month, users_count) VALUES ($1, $2)",
+                month.start, len(records)
+            )
+        logger.info(f"🔒 Расчётный месяц {month.start:%m.%Y} закрыт, сотрудников: {len(records)}")
+        return len(records)
+
+    @query("read")
+    async def get_payroll_month(self, month_start: date) -> Dict[str, Any]:
+        """Зарплата всех сотрудников за расчётный месяц: из снимков, если месяц закрыт, иначе по заказам"""
+        month = periods.payroll_window(month_start)
+        async with self._pool().acquire() as conn:
+            closed_at = await conn.fetchval("SELECT closed_at FROM payroll_closed_months WHERE month = $1", month.start)
+            if closed_at:
+                rows = [dict(row) for row in await conn.fetch("""
+                    SELECT s.*, u.name, u.profession
+                    FROM payroll_snapshots s
+                    JOIN users u ON u.id = s.user_id
+                    WHERE s.month = $1
+                    ORDER BY s.total DESC
+                """, month.start)]
+            else:
+                rows = []
+                for row in await conn.fetch(f"""
+                    SELECT p.*, u.name, u.profession
+                    FROM ({PAYROLL_SPLIT_SQL}) AS p
+                    JOIN users u ON u.id = p.user_id
+                """, month.start_utc, month.end_utc, config.PRICE_PREP_SINGLE, config.PRICE_PREP_SET,
+                        month.start, month.end):
+                    rows.append({**dict(row), **_payroll_totals(row)})
+                rows.sort(key=lambda row: row['total'], reverse=True)
+        return {"month": month.start, "closed": closed_at is not None, "closed_at": closed_at, "rows": rows}
+
+    async def _carry_over_closed_months(self, conn, old_order: Optional[Dict[str, Any]], new_order: Optional[Dict[str, Any]]):
+        """Изменение заказа закрытого месяца не трогает снимок, а записывается корректировкой в текущий период"""
+        deltas: Dict[tuple, List[Decimal]] = {}
+        for sign, order in ((-1, old_order), (1, new_order)):
+            for user_id, month, amount, prep in _order_payroll_shares(order):
+                delta = deltas.setdefault((user_id, month), [Decimal(0), Decimal(0)])
+                delta[0] += amount * sign
+                delta[1] += prep * sign
+
+        current = periods.payroll_window().start
+        months = {month for (_, month), delta in deltas.items() if month < current and any(delta)}
+        if not months:
+            return
+        await conn.execute("SELECT pg_advisory_xact_lock_shared($1)", PAYROLL_LOCK_KEY)
+        closed = {row['month'] for row in await conn.fetch(
+            "SELECT month FROM payroll_closed_months WHERE month = ANY($1::DATE[])", list(months)
+        )}
+        if not closed:
+            return
+
+        order = new_order or old_order
+        created_at = periods.now().replace(tzinfo=None)
+        rows = []
+        for (user_id, month), (amount, prep) in deltas.items():
+            if month not in closed:
+                continue
+            prep_delta = int(round(prep))
+            painting_delta = int(round(amount)) - prep_delta
+            if prep_delta or painting_delta:
+                rows.append((
+                    user_id, current, prep_delta, painting_delta,
+                    f"Перенос за {month:%m.%Y}: заказ №{order.get('order_number')}", created_at
+                ))
+        if rows:
+            await conn.executemany("""
+                INSERT INTO earnings_adjustments (user_id, month_start, prep_delta, painting_delta, description, created_at)
+                VALUES ($1, $2, $3, $4, $5, $6)
+            """, rows)
+            logger.info(f"🔁 Изменение заказа №{order.get('order_number')} в закрытом месяце перенесено корректировками: {len(rows)}")
+
     # === АНАЛИТИКА ===
     
+    @query("read", primary=True)
     async def get_top_employees_month(self, profession: str = None, limit: int = 10) -> List[Dict[str, Any]]:
-        """Топ сотрудников месяца по заработку"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
-        
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
-        
-        async with self.pool.acquire() as conn:
-            query = """
-                WITH user_earnings AS (
-                    -- Обычные заказы
-                    SELECT u.id, u.name, u.profession, 
-                           COALESCE(SUM(o.price), 0) as earnings,
-                           COUNT(o.id) as orders_count
-                    FROM users u
-                    LEFT JOIN orders o ON o.user_id = u.id 
-                        AND o.status = 'confirmed'
-                        AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                        AND (o.created_at AT TIME ZONE 'UTC') < $2
-                        AND o.set_type NOT LIKE '70_30_%'
-                    WHERE 1=1 {profession_filter}
-                    GROUP BY u.id, u.name, u.profession
-                    
-                    UNION ALL
-                    
-                    -- Заказы 70/30 (70%)
-                    SELECT u.id, u.name, u.profession,
-                           COALESCE(SUM(o.price * 0.7), 0) as earnings,
-                           COUNT(o.id) as orders_count
-                    FROM users u
-                    LEFT JOIN orders o ON o.painter_70_id = u.id
-                        AND o.status = 'confirmed'
-                        AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                        AND (o.created_at AT TIME ZONE 'UTC') < $2
-                        AND o.set_type LIKE '70_30_%'
-                    WHERE 1=1 {profession_filter}
-                    GROUP BY u.id, u.name, u.profession
-                    
-                    UNION ALL
-                    
-                    -- Заказы 70/30 (30%)
-                    SELECT u.id, u.name, u.profession,
-                           COALESCE(SUM(o.price * 0.3), 0) as earnings,
-                           COUNT(o.id) as orders_count
-                    FROM users u
-                    LEFT JOIN orders o ON o.painter_30_id = u.id
-                        AND o.status = 'confirmed'
-                        AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                        AND (o.created_at AT TIME ZONE 'UTC') < $2
-                        AND o.set_type LIKE '70_30_%'
-                    WHERE 1=1 {profession_filter}
-                    GROUP BY u.id, u.name, u.profession
+        """Топ сотрудников месяца по заработку (из снимка в памяти, пока работает лента изменений)"""
+        month_start = periods.month_start()
+        if not self._listener or self._listener.is_closed():
+            # Без ленты изменений снимок не узнает о записях других процессов - читаем из базы
+            self._leaderboard_month = None
+            return _leaderboard_top(await self._load_leaderboard(month_start), profession)[:limit]
+
+        if self._leaderboard_month != month_start:
+            # Изменения, пришедшие во время загрузки, дочитываются сразу после неё
+            self._leaderboard_stale.clear()
+            self._leaderboard = {row['id']: row for row in await self._load_leaderboard(month_start)}
+            self._leaderboard_month = month_start
+            self._leaderboard_tops.clear()
+            self._schedule_leaderboard_refresh()
+        top = self._leaderboard_tops.get(profession)
+        if top is None:
+            top = self._leaderboard_tops[profession] = _leaderboard_top(self._leaderboard.values(), profession)
+        return [dict(row) for row in top[:limit]]
+
+    @query("read", primary=True)
+    async def _load_leaderboard(self, month_start: date, user_ids: List[int] = None) -> List[Dict[str, Any]]:
+        """Заработок и число заказов за месяц одним проходом по user_day_earnings (все или только user_ids)"""
+        month_end = _add_months(month_start, 1)
+        async with self._pool().acquire() as conn:
+            if user_ids is None:
+                rows = await conn.fetch(LEADERBOARD_SQL.format(user_filter=""), month_start, month_end)
+            else:
+                rows = await conn.fetch(
+                    LEADERBOARD_SQL.format(user_filter="AND u.id = ANY($3::INTEGER[])"),
+                    month_start, month_end, user_ids
                 )
-                SELECT id, name, profession,
-                       SUM(earnings)::INTEGER as total_earnings,
-                       SUM(orders_count)::INTEGER as total_orders
-                FROM user_earnings
-                GROUP BY id, name, profession
-                HAVING SUM(earnings) > 0 OR SUM(orders_count) > 0
-                ORDER BY total_earnings DESC
-                LIMIT $3
-            """
-            
-            profession_filter = "AND u.profession = $4" if profession else ""
-            query = query.format(profession_filter=profession_filter)
-            
+            return [dict(row) for row in rows]
+
+    def _on_leaderboard_change(self, event: Dict[str, Any]):
+        """Изменения заказов и пользователей: перечитать затронутых пользователей в снимке рейтинга"""
+        if event.get('op') == 'reset':
+            self._leaderboard_month = None
+            return
+        if event.get('t') == 'orders':
+            user_ids = {event.get('user_id'), event.get('painter_70_id'), event.get('painter_30_id')}
+        else:
+            user_ids = {event.get('id')}
+        self._leaderboard_stale.update(user_ids - {None})
+        self._schedule_leaderboard_refresh()
+
+    def _schedule_leaderboard_refresh(self):
+        """Запускает фоновое обновление снимка рейтинга, если есть изменения и снимок загружен"""
+        if not self._leaderboard_stale or self._leaderboard_month is None:
+            return
+        if self._leaderboard_task is None or self._leaderboard_task.done():
+            self._leaderboard_task = asyncio.get_running_loop().create_task(self._refresh_leaderboard())
+
+    async def _refresh_leaderboard(self):
+        """Обновляет в снимке рейтинга строки изменившихся пользователей (события копятся, пока идёт запрос)"""
+        while self._leaderboard_stale and self._leaderboard_month is not None:
+            user_ids, month_start = list(self._leaderboard_stale), self._leaderboard_month
+            self._leaderboard_stale.clear()
+            try:
+                rows = {row['id']: row for row in await self._load_leaderboard(month_start, user_ids)}
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось обновить рейтинг месяца, снимок будет пересобран: {e}")
+                self._leaderboard_month = None
+                return
+            if self._leaderboard_month != month_start:
+                continue
+            for user_id in user_ids:
+                row = rows.get(user_id)
+                if row and (row['total_earnings'] or row['total_orders']):
+                    self._leaderboard[user_id] = row
+                else:
+                    self._leaderboard.pop(user_id, None)
+            self._leaderboard_tops.clear()
+
+    @query("read")
+    async def get_range_report(self, start_day: date, end_day: date, profession: str = None) -> Dict[str, Any]:
+        """Итоги за дни мастерской [start_day, end_day) по агрегату user_day_earnings: заработок, заказы,
+        активные сотрудники и дни (годовой диапазон - несколько тысяч строк агрегата, а не заказы)"""
+        async with self._pool().acquire() as conn:
+            row = await conn.fetchrow(RANGE_REPORT_SQL, start_day, end_day, profession)
+        return {
+            "start": start_day,
+            "end": end_day,
+            "total_earnings": int(row['total_earnings']),
+            "total_orders": int(row['total_orders']),
+            "active_users": int(row['active_users']),
+            "active_days": int(row['active_days']),
+        }
+
+    @query("read")
+    async def get_top_employees_range(self, start_day: date, end_day: date, profession: str = None,
+                                      limit: int = 10) -> List[Dict[str, Any]]:
+        """Топ сотрудников за дни мастерской [start_day, end_day) по заработку"""
+        month = periods.month_window()
+        if start_day == month.start and end_day == month.end:
+            # Текущий месяц отдаётся из снимка в памяти
+            return await self.get_top_employees_month(profession, limit)
+        async with self._pool().acquire() as conn:
             if profession:
-                rows = await conn.fetch(query, start_month_utc, end_month_utc, limit, profession)
+                rows = await conn.fetch(
+                    LEADERBOARD_SQL.format(user_filter="AND u.profession = $3"), start_day, end_day, profession
+                )
             else:
-                rows = await conn.fetch(query, start_month_utc, end_month_utc, limit)
-            
-            return [dict(row) for row in rows]
-    
+                rows = await conn.fetch(LEADERBOARD_SQL.format(user_filter=""), start_day, end_day)
+        return [dict(row) for row in _leaderboard_top(rows, None)[:limit]]
+
+    @query("read")
+    async def get_period_comparison(self, start_day: date, end_day: date, profession: str = None) -> Dict[str, Any]:
+        """Итоги периода и предыдущего: для целых месяцев - столько же предыдущих месяцев,
+        иначе такой же по длине отрезок (неделя к неделе)"""
+        if start_day.day == 1 and end_day.day == 1:
+            months = (end_day.year - start_day.year) * 12 + end_day.month - start_day.month
+            previous_start = _add_months(start_day, -months)
+        else:
+            previous_start = start_day - (end_day - start_day)
+        return {
+            "current": await self.get_range_report(start_day, end_day, profession),
+            "previous": await self.get_range_report(previous_start, start_day, profession),
+        }
+
+    @query("read")
+    async def get_month_report(self, month_start: date, profession: str = None) -> Dict[str, Any]:
+        """Итоги месяца мастерской (в том числе прошедшего или перенесённого в архив)"""
+        month = periods.month_window(month_start)
+        return await self.get_range_report(month.start, month.end, profession)
+
+    @query("read")
+    async def export_orders(self, start_utc: datetime, end_utc: datetime, writer,
+                            chunk_size: int = None) -> int:
+        """Выгружает заказы периода (включая архив) порциями через серверный курсор, возвращает число строк.
+        writer.begin() вызывается перед первой порцией (и заново при повторе запроса на основной базе)"""
+        chunk_size = chunk_size or config.EXPORT_CHUNK_SIZE
+        total = 0
+        async with self._pool().acquire() as conn, conn.transaction(readonly=True):
+            cursor = await conn.cursor(ORDERS_EXPORT_SQL, _to_db_utc(start_utc), _to_db_utc(end_utc))
+            await writer.begin()
+            while True:
+                rows = await cursor.fetch(chunk_size)
+                if not rows:
+                    break
+                await writer.write_rows(rows)
+                total += len(rows)
+        return total
+
+    @query("read")
     async def get_orders_by_weekday(self, profession: str = None) -> Dict[int, int]:
         """Статистика заказов по дням недели (0=понедельник, 6=воскресенье)"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
-        
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
+        month = periods.month_window()
+        start_month_utc, end_month_utc = month.start_utc, month.end_utc
         
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             if profession:
-                rows = await conn.fetch("""
-                    SELECT EXTRACT(DOW FROM (o.created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Yekaterinburg'))::INTEGER as weekday,
+                rows = await conn.fetch(f"""
+                    SELECT EXTRACT(DOW FROM {periods.shop_time_sql('o.created_at')})::INTEGER as weekday,
                            COUNT(*) as count
                     FROM orders o
                     JOIN users u ON o.user_id = u.id
                     WHERE o.status = 'confirmed'
                       AND u.profession = $3
-                      AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                      AND (o.created_at AT TIME ZONE 'UTC') < $2
+                      AND o.created_at >= $1
+                      AND o.created_at < $2
                     GROUP BY weekday
                     ORDER BY weekday
                 """, start_month_utc, end_month_utc, profession)
             else:
-                rows = await conn.fetch("""
-                    SELECT EXTRACT(DOW FROM (o.created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Yekaterinburg'))::INTEGER as weekday,
+                rows = await conn.fetch(f"""
+                    SELECT EXTRACT(DOW FROM {periods.shop_time_sql('o.created_at')})::INTEGER as weekday,
                            COUNT(*) as count
                     FROM orders o
                     WHERE o.status = 'confirmed'
-                      AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                      AND (o.created_at AT TIME ZONE 'UTC') < $2
+                      AND o.created_at >= $1
+                      AND o.created_at < $2
                     GROUP BY weekday
                     ORDER BY weekday
                 """, start_month_utc, end_month_utc)
@@ -797,17 +1979,13 @@ class Database:
             
             return result
     
+    @query("read")
     async def get_popular_sizes(self, profession: str = None, limit: int = 10) -> List[Dict[str, Any]]:
         """Популярные размеры дисков"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
-        
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
+        month = periods.month_window()
+        start_month_utc, end_month_utc = month.start_utc, month.end_utc
         
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             if profession:
                 rows = await conn.fetch("""
                     SELECT o.size, COUNT(*) as count
@@ -816,8 +1994,8 @@ class Database:
                     WHERE o.status = 'confirmed'
                       AND o.size IS NOT NULL
                       AND u.profession = $3
-                      AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                      AND (o.created_at AT TIME ZONE 'UTC') < $2
+                      AND o.created_at >= $1
+                      AND o.created_at < $2
                     GROUP BY o.size
                     ORDER BY count DESC
                     LIMIT $4
@@ -828,8 +2006,8 @@ class Database:
                     FROM orders
                     WHERE status = 'confirmed'
                       AND size IS NOT NULL
-                      AND (created_at AT TIME ZONE 'UTC') >= $1
-                      AND (created_at AT TIME ZONE 'UTC') < $2
+                      AND created_at >= $1
+                      AND created_at < $2
                     GROUP BY size
                     ORDER BY count DESC
                     LIMIT $3
@@ -837,17 +2015,13 @@ class Database:
             
             return [dict(row) for row in rows]
     
+    @query("read")
     async def get_average_order_price(self, profession: str = None) -> Dict[str, Any]:
         """Средний чек по профессии"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
+        month = periods.month_window()
+        start_month_utc, end_month_utc = month.start_utc, month.end_utc
         
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
-        
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             if profession:
                 row = await conn.fetchrow("""
                     SELECT COUNT(*) as total_orders,
@@ -858,8 +2032,8 @@ class Database:
                     JOIN users u ON o.user_id = u.id
                     WHERE o.status = 'confirmed'
                       AND u.profession = $3
-                      AND (o.created_at AT TIME ZONE 'UTC') >= $1
-                      AND (o.created_at AT TIME ZONE 'UTC') < $2
+                      AND o.created_at >= $1
+                      AND o.created_at < $2
                 """, start_month_utc, end_month_utc, profession)
             else:
                 row = await conn.fetchrow("""
@@ -869,14 +2043,15 @@ class Database:
                            COALESCE(MAX(price), 0)::INTEGER as max_price
                     FROM orders
                     WHERE status = 'confirmed'
-                      AND (created_at AT TIME ZONE 'UTC') >= $1
-                      AND (created_at AT TIME ZONE 'UTC') < $2
+                      AND created_at >= $1
+                      AND created_at < $2
                 """, start_month_utc, end_month_utc)
             
             return dict(row) if row else {"total_orders": 0, "avg_price": 0, "min_price": 0, "max_price": 0}
 
     # === ДОСТИЖЕНИЯ ===
     
+    @query("read", primary=True)
     async def has_achievement(self, user_id: int, achievement_id: str) -> bool:
         """Проверяет, есть ли у пользователя ачивка"""
         async with self.pool.acquire() as conn:
@@ -886,6 +2061,7 @@ class Database:
             )
             return result or False
     
+    @query("write")
     async def grant_achievement(self, user_id: int, achievement_id: str) -> bool:
         """Выдать ачивку пользователю (если ещё нет)"""
         async with self.pool.acquire() as conn:
@@ -894,20 +2070,24 @@ class Database:
                     "INSERT INTO user_achievements (user_id, achievement_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
                     user_id, achievement_id
                 )
+                if user_id in self._earned_achievements:
+                    self._earned_achievements[user_id].add(achievement_id)
                 return True
             except Exception as e:
                 logger.error(f"Ошибка выдачи ачивки {achievement_id} пользователю {user_id}: {e}")
                 return False
     
+    @query("read")
     async def get_user_achievements(self, user_id: int) -> List[Dict[str, Any]]:
         """Получить все ачивки пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             rows = await conn.fetch(
                 "SELECT achievement_id, earned_at FROM user_achievements WHERE user_id = $1 ORDER BY earned_at DESC",
                 user_id
             )
             return [dict(row) for row in rows]
     
+    @query("read", primary=True)
     async def get_unannounced_achievements(self) -> List[Dict[str, Any]]:
         """Получить неанонсированные ачивки для публикации"""
         async with self.pool.acquire() as conn:
@@ -920,6 +2100,7 @@ class Database:
             """)
             return [dict(row) for row in rows]
     
+    @query("write")
     async def mark_achievement_announced(self, achievement_record_id: int):
         """Отметить ачивку как анонсированную"""
         async with self.pool.acquire() as conn:
@@ -928,226 +2109,138 @@ class Database:
                 achievement_record_id
             )
     
+    async def _get_earned_achievements(self, conn, user_id: int) -> set:
+        """Набор полученных ачивок пользователя (кэшируется, пока работает лента изменений)"""
+        if not self._listener or self._listener.is_closed():
+            # Без ленты изменений кэш не узнает об ачивках, выданных или удалённых другими процессами
+            self._earned_achievements.clear()
+            rows = await conn.fetch("SELECT achievement_id FROM user_achievements WHERE user_id = $1", user_id)
+            return {row['achievement_id'] for row in rows}
+        earned = self._earned_achievements.get(user_id)
+        if earned is None:
+            rows = await conn.fetch("SELECT achievement_id FROM user_achievements WHERE user_id = $1", user_id)
+            earned = {row['achievement_id'] for row in rows}
+            self._earned_achievements[user_id] = earned
+        return earned
+
+    @query("write")
     async def check_and_grant_achievements(self, user_id: int, order_data: dict = None) -> List[str]:
         """Проверить условия и выдать новые ачивки, вернуть список новых"""
-        from achievements import ACHIEVEMENTS
-        
-        new_achievements = []
+        from achievements import (
+            get_pending_achievements, get_required_metrics, order_metrics,
+            evaluate_achievements, ORDER_METRICS
+        )
         
-        # Получаем данные пользователя
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
+        tz = periods.BUSINESS_TZ
+        today = periods.day_window()
+        month = periods.month_window(today.start)
+        order_created_at = order_data.get("created_at") if order_data else None
+        # Серии считаются от дня мастерской заказа, а не от момента проверки (заказ могли подтвердить позже)
+        order_day = periods.shop_day(order_created_at) if order_created_at else today.start
         
         async with self.pool.acquire() as conn:
-            # Общее количество подтверждённых заказов
-            total_orders = await conn.fetchval(
-                "SELECT COUNT(*) FROM orders WHERE user_id = $1 AND status = 'confirmed'",
-                user_id
-            ) or 0
-            
-            # Заработок за текущий месяц
-            month_earnings_result = await self.get_user_earnings_month(user_id)
-            
-            # Заработок за всё время
-            total_earnings = await conn.fetchval("""
-                SELECT COALESCE(SUM(price), 0) + 
-                       COALESCE((SELECT SUM(price * 0.7) FROM orders WHERE painter_70_id = $1 AND status = 'confirmed'), 0) +
-                       COALESCE((SELECT SUM(price * 0.3) FROM orders WHERE painter_30_id = $1 AND status = 'confirmed'), 0)
-                FROM orders 
-                WHERE user_id = $1 AND status = 'confirmed' AND set_type NOT LIKE '70_30_%'
-            """, user_id) or 0
-            
-            # Заказы за сегодня
-            today_start = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_start_utc = today_start.astimezone(ZoneInfo("UTC"))
-            today_end_utc = (today_start + timedelta(days=1)).astimezone(ZoneInfo("UTC"))
-            
-            today_orders = await conn.fetchval("""
-                SELECT COUNT(*) FROM orders 
-                WHERE user_id = $1 AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') < $3
-            """, user_id, today_start_utc, today_end_utc) or 0
-            
-            today_earnings = await self.get_user_earnings_today(user_id)
-            
-            # Заказы 70/30
-            team_orders = await conn.fetchval("""
-                SELECT COUNT(*) FROM orders 
-                WHERE (painter_70_id = $1 OR painter_30_id = $1) 
-                  AND status = 'confirmed'
-                  AND set_type LIKE '70_30_%'
-            """, user_id) or 0
-            
-            # Заказы с алюмохромом
-            alumochrome_orders = await conn.fetchval(
-                "SELECT COUNT(*) FROM orders WHERE user_id = $1 AND status = 'confirmed' AND alumochrome = TRUE",
-                user_id
-            ) or 0
-            
-            # Заказы с большими размерами (R20+)
-            big_size_orders = await conn.fetchval("""
-                SELECT COUNT(*) FROM orders 
-                WHERE user_id = $1 AND status = 'confirmed' 
-                  AND size IN ('R20', 'R21', 'R22', 'R23', 'R24')
-            """, user_id) or 0
-            
-            # Заказы без отклонений
-            rejected_orders = await conn.fetchval(
-                "SELECT COUNT(*) FROM orders WHERE user_id = $1 AND status = 'rejected'",
-                user_id
-            ) or 0
-            perfect_orders = total_orders if rejected_orders == 0 else 0
-        
-        # Проверяем все ачивки
-        for achievement_id, achievement in ACHIEVEMENTS.items():
-            if await self.has_achievement(user_id, achievement_id):
-                continue
+            earned = await self._get_earned_achievements(conn, user_id)
+            pending = get_pending_achievements(earned)
+            if not pending:
+                # Все ачивки уже получены - ничего не считаем
+                return []
             
-            condition = achievement.get("condition", {})
-            cond_type = condition.get("type")
-            cond_value = condition.get("value")
+            user_metrics = order_metrics(order_data, tz)
+            sql_metrics = [
+                name for name in sorted(get_required_metrics(pending) - ORDER_METRICS)
+                if name in ACHIEVEMENT_METRICS_SQL
+            ]
+            if "hour_orders" in sql_metrics and not order_created_at:
+                sql_metrics.remove("hour_orders")
             
-            granted = False
+            if sql_metrics:
+                # Нужные метрики - одним запросом
+                params = _QueryParams(
+                    {
+                        "user_id": user_id,
+                        "today_start": today.start_utc,
+                        "today_end": today.end_utc,
+                        "today": today.start,
+                        "month_start": month.start,
+                        "month_end": month.end,
+                        "order_day": order_day,
+                        "order_created_at": _to_db_utc(order_created_at) if order_created_at else None,
+                    },
+                    {
+                        "user_id": "INTEGER", "today_start": "TIMESTAMP", "today_end": "TIMESTAMP",
+                        "today": "DATE", "month_start": "DATE", "month_end": "DATE",
+                        "order_day": "DATE", "order_created_at": "TIMESTAMP",
+                    }
+                )
+                columns = ",\n".join(
+                    f"{ACHIEVEMENT_METRICS_SQL[name].format_map(params)} AS {name}" for name in sql_metrics
+                )
+                row = await conn.fetchrow(f"SELECT {columns}", *params.args)
+                for name in sql_metrics:
+                    value = row[name]
+                    user_metrics[name] = int(value) if value is not None else None
             
-            if cond_type == "orders_count" and total_orders >= cond_value:
-                granted = True
-            elif cond_type == "month_earnings" and month_earnings_result >= cond_value:
-                granted = True
-            elif cond_type == "total_earnings" and total_earnings >= cond_value:
-                granted = True
-            elif cond_type == "orders_per_day" and today_orders >= cond_value:
-                granted = True
-            elif cond_type == "day_earnings" and today_earnings >= cond_value:
-                granted = True
-            elif cond_type == "team_orders" and team_orders >= cond_value:
-                granted = True
-            elif cond_type == "alumochrome_orders" and alumochrome_orders >= cond_value:
-                granted = True
-            elif cond_type == "big_sizes" and big_size_orders >= cond_value:
-                granted = True
-            elif cond_type == "perfect_orders" and perfect_orders >= cond_value:
-                granted = True
-            elif cond_type == "single_order_price" and order_data and order_data.get("price", 0) >= cond_value:
-                granted = True
-            elif cond_type == "night_order" and order_data:
-                # Проверка времени создания заказа (22:00-06:00)
-                created = order_data.get("created_at")
-                if created:
-                    if created.tzinfo is None:
-                        created = created.replace(tzinfo=ZoneInfo("UTC"))
-                    created_local = created.astimezone(tz)
-                    hour = created_local.hour
-                    if hour >= 22 or hour < 6:
-                        granted = True
-            elif cond_type == "early_order" and order_data:
-                # Проверка времени создания заказа (до 07:00)
-                created = order_data.get("created_at")
-                if created:
-                    if created.tzinfo is None:
-                        created = created.replace(tzinfo=ZoneInfo("UTC"))
-                    created_local = created.astimezone(tz)
-                    if created_local.hour < 7:
-                        granted = True
+            to_grant = evaluate_achievements(pending, user_metrics)
+            if not to_grant:
+                return []
             
-            if granted:
-                await self.grant_achievement(user_id, achievement_id)
-                new_achievements.append(achievement_id)
+            # Выдаём все новые ачивки одним запросом
+            rows = await conn.fetch("""
+                INSERT INTO user_achievements (user_id, achievement_id)
+                SELECT $1, unnest($2::VARCHAR[])
+                ON CONFLICT DO NOTHING
+                RETURNING achievement_id
+            """, user_id, to_grant)
         
-        return new_achievements
+        earned.update(to_grant)
+        inserted = {row['achievement_id'] for row in rows}
+        return [achievement_id for achievement_id in to_grant if achievement_id in inserted]
     
+    @query("read")
     async def get_user_achievement_stats(self, user_id: int) -> Dict[str, Any]:
         """Статистика по ачивкам пользователя"""
         from achievements import ACHIEVEMENTS
         
         total_achievements = len(ACHIEVEMENTS)
-        user_achievements = await self.get_user_achievements(user_id)
-        earned_count = len(user_achievements)
+        async with self._pool().acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT (SELECT COUNT(*) FROM user_achievements WHERE user_id = $1) AS earned,
+                       st.confirmed_orders, st.rejected_orders, st.alumochrome_orders,
+                       st.big_size_orders, st.team_orders, st.lifetime_earnings
+                FROM (SELECT $1::INTEGER AS user_id) AS u
+                LEFT JOIN user_stats st ON st.user_id = u.user_id
+            """, user_id)
+        earned_count = row['earned'] or 0
         
         return {
             "total": total_achievements,
             "earned": earned_count,
-            "percentage": (earned_count / total_achievements * 100) if total_achievements > 0 else 0
+            "percentage": (earned_count / total_achievements * 100) if total_achievements > 0 else 0,
+            "confirmed_orders": row['confirmed_orders'] or 0,
+            "rejected_orders": row['rejected_orders'] or 0,
+            "alumochrome_orders": row['alumochrome_orders'] or 0,
+            "big_size_orders": row['big_size_orders'] or 0,
+            "team_orders": row['team_orders'] or 0,
+            "lifetime_earnings": int(row['lifetime_earnings'] or 0)
         }
 
+    @query("read")
     async def get_user_avg_earnings_per_day(self, user_id: int) -> float:
         """Получает средний заработок пользователя за день в текущем месяце"""
-        tz = ZoneInfo("Asia/Yekaterinburg")
-        now_local = datetime.now(tz)
-        start_month_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_month_local = (start_month_local + timedelta(days=32)).replace(day=1)
-
-        start_month_utc = start_month_local.astimezone(ZoneInfo("UTC"))
-        end_month_utc = end_month_local.astimezone(ZoneInfo("UTC"))
-
-        async with self.pool.acquire() as conn:
-            # Получаем общий заработок за месяц (обычные заказы + 70/30)
-            regular_earnings = await conn.fetchval("""
-                SELECT COALESCE(SUM(price), 0)
-                FROM orders
-                WHERE user_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type NOT LIKE '70_30_%'
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            earnings_70 = await conn.fetchval("""
-                SELECT COALESCE(SUM(price * 0.7), 0)
-                FROM orders
-                WHERE painter_70_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type LIKE '70_30_%'
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            earnings_30 = await conn.fetchval("""
-                SELECT COALESCE(SUM(price * 0.3), 0)
-                FROM orders
-                WHERE painter_30_id = $1
-                  AND status = 'confirmed'
-                  AND (created_at AT TIME ZONE 'UTC') >= $2
-                  AND (created_at AT TIME ZONE 'UTC') <  $3
-                  AND set_type LIKE '70_30_%'
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            total_earnings = regular_earnings + earnings_70 + earnings_30
-            
-            # Получаем количество уникальных дней с заказами
-            days_with_orders = await conn.fetchval("""
-                SELECT COUNT(DISTINCT DATE(created_at AT TIME ZONE 'UTC'))
-                FROM (
-                    SELECT created_at FROM orders WHERE user_id = $1 AND status = 'confirmed' AND (created_at AT TIME ZONE 'UTC') >= $2 AND (created_at AT TIME ZONE 'UTC') < $3 AND set_type NOT LIKE '70_30_%'
-                    UNION ALL
-                    SELECT created_at FROM orders WHERE painter_70_id = $1 AND status = 'confirmed' AND (created_at AT TIME ZONE 'UTC') >= $2 AND (created_at AT TIME ZONE 'UTC') < $3 AND set_type LIKE '70_30_%'
-                    UNION ALL
-                    SELECT created_at FROM orders WHERE painter_30_id = $1 AND status = 'confirmed' AND (created_at AT TIME ZONE 'UTC') >= $2 AND (created_at AT TIME ZONE 'UTC') < $3 AND set_type LIKE '70_30_%'
-                ) AS all_orders
-            """, user_id, start_month_utc, end_month_utc) or 0
-            
-            # Возвращаем 0 если не было заказов, иначе средний заработок
-            if days_with_orders == 0:
-                return 0.0
-            return total_earnings / days_with_orders
-
-    async def get_user_orders_count(self, user_id: int) -> int:
-        """Получает количество заказов пользователя"""
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchval(
-                "SELECT COUNT(*) FROM orders WHERE user_id = $1", user_id
-            )
-            return result or 0
+        month = periods.month_window()
+        earnings = await self.get_user_earnings_days(user_id, month.start, month.end)
+        # 0, если не было заказов, иначе средний заработок за день с заказами
+        return earnings["avg_per_day"]
 
+    @query("read", primary=True)
     async def check_order_number_exists(self, order_number: str, user_profession: str = None) -> bool:
         """Проверяет, существует ли заказ с таким номером для определенной профессии"""
         async with self.pool.acquire() as conn:
             if user_profession:
-                # Проверяем только среди пользователей с той же профессией
+                # Проверяем только среди заказов той же профессии
                 result = await conn.fetchval("""
-                    SELECT EXISTS(SELECT 1 FROM orders o 
-                    JOIN users u ON o.user_id = u.id 
-                    WHERE o.order_number = $1 AND u.profession = $2)
+                    SELECT EXISTS(SELECT 1 FROM order_numbers
+                    WHERE order_profession = $2 AND order_number = $1)
                 """, order_number, user_profession)
             else:
                 # Проверяем среди всех заказов (для обратной совместимости)
@@ -1156,27 +2249,37 @@ class Database:
                 )
             return result or False
 
+    @query("write")
     async def delete_order_by_number(self, order_number: str) -> bool:
         """Удаляет заказ по номеру"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                "DELETE FROM orders WHERE order_number = $1", order_number
+        async with self.pool.acquire() as conn, conn.transaction():
+            deleted = await conn.fetch(
+                "DELETE FROM orders WHERE order_number = $1 RETURNING *", order_number
             )
-            return result.split()[-1] == "1"  # Проверяем, что была удалена 1 запись
+            for order in deleted:
+                await self._apply_order_change(conn, dict(order), None)
+            await self._release_order_numbers(conn, deleted)
+            return len(deleted) == 1  # Проверяем, что была удалена 1 запись
     
+    @query("write")
     async def delete_order_by_number_and_profession(self, order_number: str, profession: str) -> bool:
         """Удаляет заказ по номеру и профессии"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute("""
+        async with self.pool.acquire() as conn, conn.transaction():
+            deleted = await conn.fetch("""
                 DELETE FROM orders 
                 WHERE order_number = $1 
-                AND user_id IN (SELECT id FROM users WHERE profession = $2)
+                AND order_profession = $2
+                RETURNING *
             """, order_number, profession)
-            return result.split()[-1] == "1"  # Проверяем, что была удалена 1 запись
+            for order in deleted:
+                await self._apply_order_change(conn, dict(order), None)
+            await self._release_order_numbers(conn, deleted)
+            return len(deleted) == 1  # Проверяем, что была удалена 1 запись
 
+    @query("read")
     async def get_user_orders(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """Получает заказы пользователя (включая заказы 70/30)"""
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             # Получаем заказы пользователя (обычные + где он участвует в 70/30)
             orders = await conn.fetch("""
                 SELECT o.*, u.profession FROM orders o
@@ -1187,6 +2290,7 @@ class Database:
             """, user_id, limit)
             return [dict(order) for order in orders]
 
+    @query("read", primary=True)
     async def get_order_by_number(self, order_number: str) -> Optional[Dict[str, Any]]:
         """Получает заказ по номеру (возвращает первый найденный)"""
         async with self.pool.acquire() as conn:
@@ -1199,6 +2303,7 @@ class Database:
             """, order_number)
             return dict(order) if order else None
     
+    @query("read", primary=True)
     async def get_order_by_number_and_profession(self, order_number: str, profession: str) -> Optional[Dict[str, Any]]:
         """Получает заказ по номеру и профессии"""
         async with self.pool.acquire() as conn:
@@ -1206,10 +2311,11 @@ class Database:
                 SELECT o.*, u.tg_id, u.name as user_name, u.profession
                 FROM orders o
                 JOIN users u ON o.user_id = u.id
-                WHERE o.order_number = $1 AND u.profession = $2
+                WHERE o.order_number = $1 AND o.order_profession = $2
             """, order_number, profession)
             return dict(order) if order else None
     
+    @query("read", primary=True)
     async def get_user_order_by_number(self, user_id: int, order_number: str) -> Optional[Dict[str, Any]]:
         """Получает заказ пользователя по номеру"""
         async with self.pool.acquire() as conn:
@@ -1221,6 +2327,7 @@ class Database:
             """, order_number, user_id)
             return dict(order) if order else None
     
+    @query("read", primary=True)
     async def get_order_by_id(self, order_id: int) -> Optional[Dict[str, Any]]:
         """Получает заказ по ID"""
         async with self.pool.acquire() as conn:
@@ -1232,22 +2339,36 @@ class Database:
             """, order_id)
             return dict(order) if order else None
 
+    @query("write")
     async def update_order_price(self, order_id: int, new_price: int) -> bool:
-        """Обновляет цену заказа"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute("""
+        """Обновляет цену заказа (заказ из архива - ArchivedOrderError)"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            old_order = await conn.fetchrow("SELECT * FROM orders WHERE id = $1 FOR UPDATE", order_id)
+            if not old_order:
+                await self._check_not_archived(conn, order_id)
+                return False
+            new_order = await conn.fetchrow("""
                 UPDATE orders 
                 SET price = $1, updated_at = CURRENT_TIMESTAMP 
                 WHERE id = $2
+                RETURNING *
             """, new_price, order_id)
-            return result.split()[-1] == "1"
+            await self._apply_order_change(conn, dict(old_order), dict(new_order))
+            return True
 
+    @query("write")
     async def delete_order_by_id(self, order_id: int) -> bool:
-        """Удаляет заказ по ID"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute("DELETE FROM orders WHERE id = $1", order_id)
-            return result.split()[-1] == "1"
+        """Удаляет заказ по ID (заказ из архива - ArchivedOrderError)"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            deleted = await conn.fetchrow("DELETE FROM orders WHERE id = $1 RETURNING *", order_id)
+            if not deleted:
+                await self._check_not_archived(conn, order_id)
+                return False
+            await self._apply_order_change(conn, dict(deleted), None)
+            await self._release_order_numbers(conn, [deleted])
+            return True
 
+    @query("read", primary=True)
     async def get_user_order_by_id(self, user_id: int, order_id: int) -> Optional[Dict[str, Any]]:
         """Получает заказ пользователя по ID"""
         async with self.pool.acquire() as conn:
@@ -1257,26 +2378,33 @@ class Database:
             """, order_id, user_id)
             return dict(order) if order else None
     
-    async def get_user_orders_paginated(self, user_id: int, limit: int = 5, offset: int = 0) -> List[Dict[str, Any]]:
-        """Получает заказы пользователя с пагинацией (включая заказы 70/30)"""
-        async with self.pool.acquire() as conn:
-            orders = await conn.fetch("""
-                SELECT o.*, u.profession FROM orders o
-                JOIN users u ON o.user_id = u.id
-                WHERE o.user_id = $1 OR o.painter_70_id = $1 OR o.painter_30_id = $1
-                ORDER BY o.created_at DESC 
-                LIMIT $2 OFFSET $3
-            """, user_id, limit, offset)
-            return [dict(order) for order in orders]
+    @query("read")
+    async def get_user_orders_page(self, user_id: int, limit: int = 5, cursor: Optional[tuple] = None,
+                                   backward: bool = False) -> List[Dict[str, Any]]:
+        """Страница заказов пользователя (включая заказы 70/30) от новых к старым по ключу (created_at, id).
+        cursor - ключ последнего заказа предыдущей страницы; backward=True - страница перед первым заказом cursor"""
+        # Архив всегда старше рабочей таблицы: вперёд сначала orders, назад - сначала архив
+        sources = ('orders_archive', 'orders') if backward else ('orders', 'orders_archive')
+        orders = []
+        async with self._pool().acquire() as conn:
+            for source in sources:
+                rows = await conn.fetch(
+                    _user_orders_keyset_sql(source, cursor is not None, backward),
+                    user_id, limit - len(orders), *(cursor or ())
+                )
+                orders.extend(dict(row) for row in rows)
+                if len(orders) >= limit:
+                    break
+        return orders[::-1] if backward else orders
 
+    @query("read")
     async def get_user_orders_total_count(self, user_id: int) -> int:
-        """Получает общее количество заказов пользователя (включая заказы 70/30)"""
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchval(
-                "SELECT COUNT(*) FROM orders WHERE user_id = $1 OR painter_70_id = $1 OR painter_30_id = $1", user_id
-            )
+        """Получает общее количество заказов пользователя (включая заказы 70/30 и архив) из счётчика user_stats"""
+        async with self._pool().acquire() as conn:
+            result = await conn.fetchval("SELECT orders_total FROM user_stats WHERE user_id = $1", user_id)
             return result or 0
     
+    @query("read", primary=True)
     async def get_unconfirmed_orders_older_than(self, minutes: int) -> List[Dict[str, Any]]:
         """Получает неподтвержденные заказы старше указанного количества минут (только те, которым еще не отправлено напоминание)"""
         async with self.pool.acquire() as conn:
@@ -1291,34 +2419,24 @@ class Database:
             """ % minutes)
             return [dict(order) for order in orders]
     
-    async def mark_order_as_reminded(self, order_id: int):
-        """Помечает заказ как напомненный"""
+    @query("write")
+    async def record_reminders(self, reminders: List[tuple]):
+        """Одним запросом помечает заказы как напомненные и сохраняет ID сообщений: [(order, message_id)]"""
+        if not reminders:
+            return
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE orders SET reminder_sent = TRUE WHERE id = $1",
-                order_id
-            )
-    
-    async def save_reminder_message_id(self, order_id: int, message_id: int):
-        """Сохраняет ID сообщения с напоминанием"""
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE orders SET reminder_message_id = $1 WHERE id = $2",
-                message_id, order_id
-            )
-    
-    async def get_reminder_message_id(self, order_id: int) -> Optional[int]:
-        """Получает ID сообщения с напоминанием"""
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchval(
-                "SELECT reminder_message_id FROM orders WHERE id = $1",
-                order_id
-            )
-            return result
+            await conn.execute("""
+                UPDATE orders o
+                SET reminder_sent = TRUE, reminder_message_id = r.message_id
+                FROM unnest($1::INTEGER[], $2::TIMESTAMP[], $3::BIGINT[]) AS r(order_id, created_at, message_id)
+                WHERE o.id = r.order_id AND o.created_at = r.created_at
+            """, [order['id'] for order, _ in reminders], [order['created_at'] for order, _ in reminders],
+                [message_id for _, message_id in reminders])
 
+    @query("read")
     async def get_all_painters(self) -> List[Dict[str, Any]]:
         """Получает всех маляров из базы данных"""
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             painters = await conn.fetch("""
                 SELECT tg_id, name
                 FROM users
@@ -1326,27 +2444,30 @@ class Database:
             """)
             return [dict(painter) for painter in painters]
 
+    @query("read")
     async def get_user_name_by_tg_id(self, tg_id: int) -> Optional[str]:
         """Получает имя пользователя по Telegram ID"""
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             user = await conn.fetchrow(
                 "SELECT name FROM users WHERE tg_id = $1",
                 tg_id
             )
             return user['name'] if user else None
 
+    @query("read")
     async def get_user_name_by_id(self, user_id: int) -> Optional[str]:
         """Получает имя пользователя по ID"""
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             user = await conn.fetchrow(
                 "SELECT name FROM users WHERE id = $1",
                 user_id
             )
             return user['name'] if user else None
 
+    @query("read")
     async def get_user_tg_id_by_id(self, user_id: int) -> Optional[int]:
         """Получает Telegram ID пользователя по внутреннему ID"""
-        async with self.pool.acquire() as conn:
+        async with self._pool().acquire() as conn:
             user = await conn.fetchrow(
                 "SELECT tg_id FROM users WHERE id = $1",
                 user_id
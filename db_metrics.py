@@ -0,0 +1,215 @@
+"""
+Метрики запросов к базе данных: задержки по методам Database, ожидание соединения из пула,
+число строк, ошибки и журнал медленных запросов
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек (мс); последняя корзина - всё, что дольше
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class MethodStats:
+    """Накопленная статистика одного метода Database"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.acquire_ms = 0.0
+        self.max_acquire_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, elapsed_ms: float, acquire_ms: float, rows: int, error: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.rows += rows
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.acquire_ms += acquire_ms
+        self.max_acquire_ms = max(self.max_acquire_ms, acquire_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля по гистограмме (верхняя граница корзины)"""
+        if not self.calls:
+            return 0.0
+        target = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return min(float(LATENCY_BUCKETS_MS[i]), self.max_ms) if i < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rows": self.rows,
+            "avg_ms": self.total_ms / calls,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_ms,
+            "avg_acquire_ms": self.acquire_ms / calls,
+            "max_acquire_ms": self.max_acquire_ms,
+            "buckets": dict(zip([f"<={b}" for b in LATENCY_BUCKETS_MS] + ["inf"], self.buckets)),
+        }
+
+
+class _Call:
+    """Текущий вызов метода: сюда складывается ожидание соединений из пула"""
+
+    __slots__ = ("method", "started", "acquire_ms")
+
+    def __init__(self, method: str):
+        self.method = method
+        self.started = time.perf_counter()
+        self.acquire_ms = 0.0
+
+
+_current_call: ContextVar[Optional[_Call]] = ContextVar("db_current_call", default=None)
+
+
+def _count_rows(result: Any) -> int:
+    """Число строк по результату метода (список - его длина, одна запись - 1)"""
+    if result is None or isinstance(result, (bool, int, float, str)):
+        return 0
+    if isinstance(result, (list, tuple, set)):
+        return len(result)
+    return 1
+
+
+def _param_shape(value: Any) -> str:
+    """Форма параметра запроса без самого значения (в лог не попадают персональные данные)"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, (list, tuple)):
+        inner = type(value[0]).__name__ if value else "?"
+        return f"{inner}[{len(value)}]"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+class QueryMetrics:
+    """Сборщик метрик по методам Database"""
+
+    def __init__(self):
+        self.methods: Dict[str, MethodStats] = {}
+        self.since = time.time()
+
+    def start(self, method: str):
+        """Начинает замер вызова метода, возвращает токен для finish()"""
+        call = _Call(method)
+        return call, _current_call.set(call)
+
+    def finish(self, started, result: Any = None, error: bool = False):
+        """Завершает замер вызова и записывает статистику"""
+        call, token = started
+        _current_call.reset(token)
+        elapsed_ms = (time.perf_counter() - call.started) * 1000
+        stats = self.methods.setdefault(call.method, MethodStats())
+        stats.observe(elapsed_ms, call.acquire_ms, 0 if error else _count_rows(result), error)
+
+        if elapsed_ms >= config.DB_SLOW_QUERY_MS:
+            logger.warning(
+                f"🐢 Медленный вызов db.{call.method}: {elapsed_ms:.0f} мс "
+                f"(ожидание соединения {call.acquire_ms:.0f} мс, запросы {elapsed_ms - call.acquire_ms:.0f} мс)"
+            )
+
+    def add_acquire_wait(self, wait_ms: float):
+        """Учитывает ожидание свободного соединения в текущем вызове"""
+        call = _current_call.get()
+        if call:
+            call.acquire_ms += wait_ms
+
+    def log_query(self, record):
+        """Обработчик asyncpg query logger: журнал медленных SQL-запросов с формой параметров"""
+        elapsed_ms = record.elapsed * 1000
+        if elapsed_ms < config.DB_SLOW_QUERY_MS:
+            return
+        call = _current_call.get()
+        method = call.method if call else "?"
+        query = " ".join(record.query.split())
+        if len(query) > 300:
+            query = query[:300] + "..."
+        shapes = ", ".join(f"${i}={_param_shape(v)}" for i, v in enumerate(record.args or (), start=1))
+        status = f", ошибка: {record.exception}" if record.exception else ""
+        logger.warning(f"🐢 Медленный запрос ({method}) {elapsed_ms:.0f} мс{status}: {query} | параметры: {shapes or '-'}")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Статистика по всем методам"""
+        return {method: stats.as_dict() for method, stats in self.methods.items()}
+
+    def reset(self):
+        self.methods.clear()
+        self.since = time.time()
+
+    def log_summary(self, limit: int = 10):
+        """Пишет в лог самые затратные методы с момента последнего сброса"""
+        if not self.methods:
+            return
+        top: List[tuple] = sorted(self.methods.items(), key=lambda item: item[1].total_ms, reverse=True)[:limit]
+        minutes = (time.time() - self.since) / 60
+        logger.info(f"📊 Статистика запросов к БД за {minutes:.0f} мин:")
+        for method, stats in top:
+            data = stats.as_dict()
+            logger.info(
+                f"   - {method}: {data['calls']} вызовов, ошибок {data['errors']}, строк {data['rows']}, "
+                f"p50 {data['p50_ms']:.0f} мс, p95 {data['p95_ms']:.0f} мс, макс {data['max_ms']:.0f} мс, "
+                f"ожидание пула ср. {data['avg_acquire_ms']:.1f} / макс {data['max_acquire_ms']:.0f} мс"
+            )
+
+
+metrics = QueryMetrics()
+
+
+class _TimedAcquire:
+    """Контекст pool.acquire() с замером ожидания свободного соединения"""
+
+    def __init__(self, acquire_context):
+        self._context = acquire_context
+
+    async def _timed(self, acquire):
+        started = time.perf_counter()
+        try:
+            return await acquire
+        finally:
+            metrics.add_acquire_wait((time.perf_counter() - started) * 1000)
+
+    async def __aenter__(self):
+        return await self._timed(self._context.__aenter__())
+
+    async def __aexit__(self, *exc_info):
+        return await self._context.__aexit__(*exc_info)
+
+    def __await__(self):
+        return self._timed(self._context).__await__()
+
+
+class InstrumentedPool:
+    """Обёртка над asyncpg.Pool: замеряет ожидание соединений, остальное передаёт пулу как есть"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def acquire(self, *, timeout: float = None) -> _TimedAcquire:
+        return _TimedAcquire(self._pool.acquire(timeout=timeout))
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
@@ -8,8 +8,11 @@ import asyncio
 import asyncpg
 import logging
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
 from config import config
+import migrations
+from db import orders_partition_bounds, local_month_start
+from periods import add_months
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,6 +21,77 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Горячие запросы к orders для проверки планов по каждой роли пользователя
+ROLE_COLUMNS = ("user_id", "painter_70_id", "painter_30_id")
+# Заработок за период: $1 - пользователь, $2/$3 - границы в наивном UTC
+PERIOD_PLAN_QUERY = "SELECT price FROM orders WHERE {column} = $1 AND status = 'confirmed' AND created_at >= $2 AND created_at < $3"
+# Страница списка заказов по ключу (created_at, id): $1 - пользователь, $2 - created_at ключа
+KEYSET_PLAN_QUERY = "SELECT id FROM orders WHERE {column} = $1 AND (created_at, id) < ($2, 0) ORDER BY created_at DESC, id DESC LIMIT 5"
+
+INDEX_SCAN_NODES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+# Синтетические данные для воспроизводимой проверки планов (откатываются после проверки)
+SYNTHETIC_USERS = 200
+SYNTHETIC_TG_ID_BASE = -9_000_000_000
+SYNTHETIC_DAYS = 365
+
+
+def synthetic_partition_sql(month_start) -> str:
+    """DDL временной месячной секции orders для синтетических заказов (границы - календарь мастерской)"""
+    return f"CREATE TABLE orders_plan_{month_start:%Y_%m} PARTITION OF orders {orders_partition_bounds(month_start)}"
+
+
+async def create_synthetic_partitions(conn, start_utc: datetime, end_utc: datetime) -> int:
+    """Создаёт в текущей транзакции недостающие месячные секции orders за [start_utc, end_utc]:
+    без них синтетические заказы уходят в orders_default и планы не похожи на боевые"""
+    months = []
+    month = local_month_start(start_utc)
+    while month <= local_month_start(end_utc):
+        months.append(month)
+        month = add_months(month, 1)
+
+    # Секции самой orders по нижней границе; архивные месяцы отсоединены и секции в orders не имеют
+    attached = {
+        row['bound'] for row in await conn.fetch("""
+            SELECT pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'orders'::regclass
+        """)
+    }
+    created = 0
+    for month in months:
+        if orders_partition_bounds(month) in attached:
+            continue
+        try:
+            # Точка сохранения: если в orders_default уже есть строки за месяц, заказы останутся там
+            async with conn.transaction():
+                await conn.execute(synthetic_partition_sql(month))
+            created += 1
+        except asyncpg.CheckViolationError:
+            logger.warning(f"⚠️ Секция за {month:%Y-%m} не создана: строки месяца лежат в orders_default")
+    return created
+
+
+async def explain_plans(conn, user_id: int, start_utc: datetime, end_utc: datetime) -> bool:
+    """EXPLAIN горячих запросов: ни одного Seq Scan по orders и её секциям, только индексные сканы"""
+    queries = []
+    for column in ROLE_COLUMNS:
+        queries.append((f"заработку по {column}", PERIOD_PLAN_QUERY.format(column=column), (user_id, start_utc, end_utc)))
+        queries.append((f"списку заказов по {column}", KEYSET_PLAN_QUERY.format(column=column), (user_id, end_utc)))
+
+    all_ok = True
+    for name, query, args in queries:
+        plan_rows = await conn.fetch(f"EXPLAIN {query}", *args)
+        plan = "\n".join(row[0] for row in plan_rows)
+        if "Seq Scan on orders" in plan or not any(node in plan for node in INDEX_SCAN_NODES):
+            all_ok = False
+            logger.warning(f"⚠️ Запрос по {name} не использует индекс:\n{plan}")
+        else:
+            logger.info(f"✅ Запрос по {name} использует индекс:\n{plan}")
+    return all_ok
+
+
 class DatabaseRecovery:
     def __init__(self):
         self.pool = None
@@ -147,6 +221,13 @@ class DatabaseRecovery:
             else:
                 logger.warning("⚠️ Таблица orders не существует")
             
+            # Версия схемы по журналу миграций
+            schema_version = await migrations.get_schema_version(conn)
+            if schema_version < migrations.LATEST_VERSION:
+                logger.warning(f"⚠️ Версия схемы {schema_version}, ожидается {migrations.LATEST_VERSION} - миграции применятся при запуске бота")
+            else:
+                logger.info(f"✅ Версия схемы актуальна: {schema_version}")
+            
             await conn.close()
             return users_exists and orders_exists
             
@@ -154,6 +235,97 @@ class DatabaseRecovery:
             logger.error(f"❌ Ошибка проверки таблиц: {e}")
             return False
 
+    async def check_query_plans(self):
+        """Проверяет через EXPLAIN, что запросы заработка за период используют индексы"""
+        try:
+            logger.info("🔄 Проверка планов запросов за период...")
+            conn = await asyncpg.connect(
+                host=config.DB_HOST,
+                port=config.DB_PORT,
+                database=config.DB_NAME,
+                user=config.DB_USER,
+                password=config.DB_PASSWORD,
+                timeout=10
+            )
+            
+            # Берём самого активного пользователя и последний месяц - как в реальных запросах
+            user_id = await conn.fetchval("""
+                SELECT user_id FROM orders WHERE status = 'confirmed'
+                GROUP BY user_id ORDER BY count(*) DESC LIMIT 1
+            """)
+            if user_id is None:
+                logger.warning("⚠️ Нет подтверждённых заказов, проверка планов пропущена")
+                await conn.close()
+                return True
+            
+            end_utc = datetime.utcnow()
+            start_utc = end_utc - timedelta(days=31)
+            all_ok = await explain_plans(conn, user_id, start_utc, end_utc)
+            
+            await conn.close()
+            return all_ok
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки планов запросов: {e}")
+            return False
+
+    async def check_query_plans_synthetic(self, rows: int = 1_000_000):
+        """Воспроизводимая проверка планов: rows синтетических заказов за год в транзакции, ANALYZE,
+        EXPLAIN горячих запросов; транзакция откатывается, данные базы не меняются"""
+        try:
+            logger.info(f"🔄 Проверка планов запросов на {rows} синтетических заказах...")
+            conn = await asyncpg.connect(
+                host=config.DB_HOST,
+                port=config.DB_PORT,
+                database=config.DB_NAME,
+                user=config.DB_USER,
+                password=config.DB_PASSWORD,
+                timeout=10,
+                command_timeout=3600
+            )
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                # Лента изменений не нужна: события всё равно не уйдут после отката
+                await conn.execute("SET LOCAL app.change_feed = 'off'")
+                user_ids = [row['id'] for row in await conn.fetch("""
+                    INSERT INTO users (tg_id, name, profession)
+                    SELECT $1 - g, 'plan check ' || g, 'painter' FROM generate_series(1, $2) AS g
+                    RETURNING id
+                """, SYNTHETIC_TG_ID_BASE, SYNTHETIC_USERS)]
+
+                # Каждый десятый заказ - 70/30; статусы: 60% подтверждённых, по 20% черновиков и отклонённых
+                end_utc = datetime.utcnow()
+                created = await create_synthetic_partitions(conn, end_utc - timedelta(days=SYNTHETIC_DAYS), end_utc)
+                if created:
+                    logger.info(f"📦 Временных секций orders для синтетических заказов: {created}")
+                await conn.execute("""
+                    INSERT INTO orders (order_number, order_profession, user_id, set_type, size, price,
+                                        status, created_at, painter_70_id, painter_30_id)
+                    SELECT 'plan-' || g, 'painter', u.ids[1 + g % u.n],
+                           CASE WHEN g % 10 = 0 THEN '70_30_set' ELSE 'set' END, 'R16', 1000,
+                           CASE g % 5 WHEN 0 THEN 'draft' WHEN 1 THEN 'rejected' ELSE 'confirmed' END,
+                           $3::TIMESTAMP - (g % ($4 * 86400)) * INTERVAL '1 second',
+                           CASE WHEN g % 10 = 0 THEN u.ids[1 + (g / 10) % u.n] END,
+                           CASE WHEN g % 10 = 0 THEN u.ids[1 + (g / 10 + 1) % u.n] END
+                    FROM generate_series(1, $2) AS g,
+                         (SELECT $1::INTEGER[] AS ids, cardinality($1::INTEGER[]) AS n) AS u
+                """, user_ids, rows, end_utc, SYNTHETIC_DAYS)
+                await conn.execute("ANALYZE orders")
+
+                all_ok = await explain_plans(conn, user_ids[0], end_utc - timedelta(days=31), end_utc)
+            finally:
+                await transaction.rollback()
+                await conn.close()
+
+            if all_ok:
+                logger.info("✅ На синтетических данных все горячие запросы используют индексы")
+            return all_ok
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки планов на синтетических данных: {e}")
+            return False
+
     async def recreate_tables(self):
         """Пересоздает таблицы (ОСТОРОЖНО!)"""
         try:
@@ -174,45 +346,15 @@ class DatabaseRecovery:
                 timeout=30
             )
             
-            # Удаляем таблицы если существуют
-            await conn.execute("DROP TABLE IF EXISTS orders CASCADE")
-            await conn.execute("DROP TABLE IF EXISTS users CASCADE")
-            
-            # Создаем таблицы заново
-            await conn.execute("""
-                CREATE TABLE users (
-                    id SERIAL PRIMARY KEY,
-                    tg_id BIGINT UNIQUE NOT NULL,
-                    name VARCHAR(255) NOT NULL,
-                    profession VARCHAR(20) DEFAULT 'painter',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            await conn.execute("""
-                CREATE TABLE orders (
-                    id SERIAL PRIMARY KEY,
-                    order_number VARCHAR(50) NOT NULL,
-                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                    set_type VARCHAR(20) NOT NULL,
-                    size VARCHAR(10),
-                    alumochrome BOOLEAN DEFAULT FALSE,
-                    suspensia_type VARCHAR(20),
-                    quantity INTEGER DEFAULT 1,
-                    spraying_deep INTEGER DEFAULT 0,
-                    spraying_shallow INTEGER DEFAULT 0,
-                    price INTEGER NOT NULL,
-                    status VARCHAR(20) DEFAULT 'draft',
-                    photo_file_id VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+            # Удаляем таблицы если существуют (вместе с журналом миграций)
+            for table in ("user_stats", "user_day_earnings", "user_achievements",
+                          "earnings_adjustments", "orders", "orders_archive", "order_numbers",
+                          "user_month_summary", "archived_months", "payroll_snapshots",
+                          "payroll_closed_months", "shop_calendar", "users", "schema_migrations"):
+                await conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
             
-            # Создаем индексы
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
+            # Создаем таблицы заново всеми миграциями
+            await migrations.migrate(conn)
             
             logger.info("✅ Таблицы успешно пересозданы")
             await conn.close()
@@ -266,6 +408,14 @@ async def main():
     """Основная функция восстановления"""
     recovery = DatabaseRecovery()
     
+    # python db_recovery.py --plans [N] - только проверка планов на N синтетических заказах
+    if "--plans" in sys.argv:
+        index = sys.argv.index("--plans")
+        rows = int(sys.argv[index + 1]) if len(sys.argv) > index + 1 else 1_000_000
+        if not await recovery.check_query_plans_synthetic(rows):
+            sys.exit(1)
+        return
+    
     logger.info("🚀 Запуск диагностики базы данных")
     logger.info(f"📋 Параметры подключения:")
     logger.info(f"   - Хост: {config.DB_HOST}:{config.DB_PORT}")
@@ -295,6 +445,9 @@ async def main():
         if response.lower() == 'yes':
             await recovery.recreate_tables()
     
+    # Проверяем, что запросы за период используют индексы
+    await recovery.check_query_plans()
+    
     # Завершаем простаивающие соединения
     await recovery.kill_idle_connections()
     
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Скрипт обслуживания агрегатов заработка
+Использование:
+    python db_rollups.py backfill  - пересобрать user_day_earnings и user_stats по таблице заказов
+    python db_rollups.py check     - сравнить user_day_earnings и user_stats с полным пересчётом
+"""
+
+import asyncio
+import logging
+import sys
+from db import db
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def backfill():
+    """Пересобирает агрегаты заработка и статистики"""
+    logger.info("🔄 Пересборка агрегата user_day_earnings...")
+    rows = await db.rebuild_user_day_earnings()
+    logger.info(f"✅ Агрегат пересобран, строк: {rows}")
+    
+    logger.info("🔄 Пересборка статистики user_stats...")
+    rows = await db.rebuild_user_stats()
+    logger.info(f"✅ Статистика пересобрана, пользователей: {rows}")
+    return True
+
+
+async def check():
+    """Проверяет агрегаты на расхождения с полным пересчётом"""
+    logger.info("🔄 Проверка агрегата user_day_earnings...")
+    mismatches = await db.check_user_day_earnings()
+    if mismatches:
+        logger.warning(f"⚠️ Найдено расхождений в user_day_earnings: {len(mismatches)}")
+        for row in mismatches[:50]:
+            logger.warning(
+                f"   - user_id={row['user_id']} день={row['day']} роль={row['role']}: "
+                f"ожидалось {row['expected_amount']} ({row['expected_orders']} зак.), "
+                f"в агрегате {row['actual_amount']} ({row['actual_orders']} зак.)"
+            )
+    else:
+        logger.info("✅ user_day_earnings: расхождений не найдено")
+
+    logger.info("🔄 Проверка статистики user_stats...")
+    stats_mismatches = await db.check_user_stats()
+    if stats_mismatches:
+        logger.warning(f"⚠️ Найдено расхождений в user_stats: {len(stats_mismatches)}")
+        for row in stats_mismatches[:50]:
+            diff = ", ".join(
+                f"{field}: {row[field]} != {row['actual_' + field]}"
+                for field in ('confirmed_orders', 'rejected_orders', 'alumochrome_orders',
+                              'big_size_orders', 'team_orders', 'orders_total', 'lifetime_earnings')
+                if row[field] != (row['actual_' + field] or 0)
+            )
+            logger.warning(f"   - user_id={row['user_id']}: {diff}")
+    else:
+        logger.info("✅ user_stats: расхождений не найдено")
+
+    if mismatches or stats_mismatches:
+        logger.warning("   Для исправления выполните: python db_rollups.py backfill")
+        return False
+    return True
+
+
+async def main():
+    """Основная функция"""
+    commands = {"backfill": backfill, "check": check}
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command not in commands:
+        logger.error(f"❌ Укажите команду: {', '.join(commands)}")
+        sys.exit(2)
+
+    await db.create_pool()
+    try:
+        await db.init_tables()
+        ok = await commands[command]()
+    finally:
+        await db.close_pool()
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("❌ Операция прервана пользователем")
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка: {e}")
+        sys.exit(1)
@@ -1,11 +1,25 @@
 import logging
+import re
+from datetime import datetime, timedelta
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import CallbackQuery, Message, FSInputFile
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
 # Убрали импорт Command - теперь все через кнопки
 
 from config import config
-from db import db
-from keyboards import get_admin_order_keyboard
+from db import db, ArchivedOrderError
+import periods
+from handlers.fsm import ReportStates
+from handlers.edit_handlers import safe_edit_message
+from keyboards import (
+    get_admin_order_keyboard,
+    get_admin_reports_keyboard,
+    get_admin_export_keyboard,
+    get_admin_payroll_keyboard,
+    get_cancel_keyboard
+)
+from orders_export import OrdersExportWriter, is_xlsx_available
 
 router = Router()
 
@@ -37,12 +51,8 @@ def get_order_type_text(order: dict) -> str:
 async def is_moderator(user_id: int, chat_id: int, bot) -> bool:
     """Проверяет, является ли пользователь модератором в чате"""
     try:
-        # Проверяем, является ли пользователь главным администратором бота
-        if user_id == config.ADMIN_CHAT_ID:
-            return True
-            
-        # Проверяем, есть ли пользователь в списке модераторов
-        if user_id in config.MODERATORS:
+        # Проверяем, является ли пользователь главным администратором бота или модератором из списка
+        if config.is_configured_moderator(user_id):
             return True
             
         # Проверяем права в чате модерации (для обратной совместимости)
@@ -79,7 +89,11 @@ async def admin_confirm_order(callback: CallbackQuery):
         return
     
     # Обновляем статус заказа
-    await db.update_order_status(order['id'], "confirmed")
+    try:
+        await db.update_order_status(order['id'], "confirmed")
+    except ArchivedOrderError as e:
+        await callback.answer(f"❌ {e}", show_alert=True)
+        return
     
     # Проверяем и выдаём ачивки
     user_id = order.get('user_id')
@@ -123,7 +137,7 @@ async def admin_confirm_order(callback: CallbackQuery):
                 logging.error(f"Ошибка уведомления пользователя об ачивках: {e}")
     
     # Удаляем сообщение с напоминанием, если оно было отправлено
-    reminder_msg_id = await db.get_reminder_message_id(order['id'])
+    reminder_msg_id = order.get('reminder_message_id')
     if reminder_msg_id:
         try:
             await callback.bot.delete_message(chat_id=config.MODERATION_CHAT_ID, message_id=reminder_msg_id)
@@ -273,10 +287,14 @@ async def admin_reject_order(callback: CallbackQuery):
         return
     
     # Обновляем статус заказа
-    await db.update_order_status(order['id'], "rejected")
+    try:
+        await db.update_order_status(order['id'], "rejected")
+    except ArchivedOrderError as e:
+        await callback.answer(f"❌ {e}", show_alert=True)
+        return
     
     # Удаляем сообщение с напоминанием, если оно было отправлено
-    reminder_msg_id = await db.get_reminder_message_id(order['id'])
+    reminder_msg_id = order.get('reminder_message_id')
     if reminder_msg_id:
         try:
             await callback.bot.delete_message(chat_id=config.MODERATION_CHAT_ID, message_id=reminder_msg_id)
@@ -413,3 +431,270 @@ async def admin_edit_order(callback: CallbackQuery):
     await callback.answer("✏️ Маляр уведомлен о необходимости исправления")
 
 # Убрали команду /stats - теперь все через кнопки
+
+
+# === ОТЧЁТЫ ЗА ПЕРИОД ===
+
+REPORT_RANGE_RE = re.compile(r"^\s*(\d{1,2}\.\d{1,2}\.\d{4})\s*[-–]\s*(\d{1,2}\.\d{1,2}\.\d{4})\s*$")
+
+
+def get_report_window(kind: str):
+    """Заголовок и окно отчёта для кнопки (None - неизвестный отчёт)"""
+    today = periods.shop_day()
+    if kind == "today":
+        return "Сегодня", periods.day_window(today)
+    if kind == "week":
+        return "Текущая неделя", periods.week_window(today)
+    if kind == "month":
+        return "Текущий месяц", periods.month_window(today)
+    if kind == "prev_month":
+        month = periods.add_months(today.replace(day=1), -1)
+        return f"Месяц {month:%m.%Y}", periods.month_window(month)
+    if kind == "year":
+        return f"С начала {today.year} года", periods.range_window(today.replace(month=1, day=1), today + timedelta(days=1))
+    return None
+
+
+def format_change(current: int, previous: int) -> str:
+    """Изменение к предыдущему периоду в процентах"""
+    if not previous:
+        return ""
+    change = (current - previous) / previous * 100
+    arrow = "🔺" if change > 0 else "🔻" if change < 0 else "▫️"
+    return f" ({arrow} {change:+.1f}% к пред. периоду)"
+
+
+async def build_report_text(title: str, window: periods.Period) -> str:
+    """Текст отчёта: итоги периода, сравнение с предыдущим и топ сотрудников"""
+    comparison = await db.get_period_comparison(window.start, window.end)
+    current, previous = comparison["current"], comparison["previous"]
+    top = await db.get_top_employees_range(window.start, window.end, limit=10)
+
+    last_day = window.end - timedelta(days=1)
+    text = (
+        f"📈 <b>Отчёт: {title}</b>\n"
+        f"📅 {window.start:%d.%m.%Y} – {last_day:%d.%m.%Y}\n\n"
+        f"💰 <b>Заработок:</b> {current['total_earnings']:,} руб."
+        f"{format_change(current['total_earnings'], previous['total_earnings'])}\n"
+        f"📦 <b>Заказов:</b> {current['total_orders']}"
+        f"{format_change(current['total_orders'], previous['total_orders'])}\n"
+        f"👥 <b>Сотрудников с заказами:</b> {current['active_users']}\n"
+        f"📆 <b>Рабочих дней:</b> {current['active_days']}"
+    )
+    if top:
+        lines = []
+        for idx, emp in enumerate(top, start=1):
+            profession_emoji = "🎨" if emp['profession'] == "painter" else "💨"
+            lines.append(
+                f"{idx}. {profession_emoji} <b>{emp['name']}</b> — "
+                f"{emp['total_earnings']:,} руб. | {emp['total_orders']} заказов"
+            )
+        text += "\n\n🏆 <b>Топ сотрудников:</b>\n" + "\n".join(lines)
+    return text
+
+
+@router.callback_query(F.data == "admin_reports")
+async def show_admin_reports(callback: CallbackQuery, state: FSMContext):
+    """Меню отчётов администратора"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Отчёты доступны только модераторам", show_alert=True)
+        return
+
+    await state.clear()
+    text = (
+        "📈 <b>Отчёты за период</b>\n\n"
+        "Заработок и заказы всех сотрудников со сравнением с предыдущим периодом.\n"
+        "Выберите период:"
+    )
+    await safe_edit_message(callback, text, get_admin_reports_keyboard())
+    await callback.answer()
+
+
+@router.callback_query(F.data == "admin_report_custom")
+async def ask_report_range(callback: CallbackQuery, state: FSMContext):
+    """Запрос своего периода отчёта"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Отчёты доступны только модераторам", show_alert=True)
+        return
+
+    await state.set_state(ReportStates.waiting_for_range)
+    await safe_edit_message(
+        callback,
+        "✍️ <b>Свой период</b>\n\n"
+        "Введите даты начала и конца включительно, например:\n"
+        "<code>01.09.2025-30.09.2025</code>",
+        get_cancel_keyboard()
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_report_"))
+async def show_admin_report(callback: CallbackQuery):
+    """Отчёт за выбранный период"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Отчёты доступны только модераторам", show_alert=True)
+        return
+
+    report = get_report_window(callback.data[len("admin_report_"):])
+    if not report:
+        await callback.answer("❌ Неизвестный отчёт", show_alert=True)
+        return
+
+    title, window = report
+    text = await build_report_text(title, window)
+    await safe_edit_message(callback, text, get_admin_reports_keyboard())
+    await callback.answer()
+
+
+@router.message(StateFilter(ReportStates.waiting_for_range))
+async def process_report_range(message: Message, state: FSMContext):
+    """Отчёт за введённый период"""
+    if not await is_moderator(message.from_user.id, message.chat.id, message.bot):
+        await state.clear()
+        return
+
+    match = REPORT_RANGE_RE.match(message.text or "")
+    try:
+        start_day, last_day = (datetime.strptime(value, "%d.%m.%Y").date() for value in match.groups())
+    except (AttributeError, ValueError):
+        await message.answer("Не удалось разобрать даты. Пример: <code>01.09.2025-30.09.2025</code>", parse_mode="HTML")
+        return
+    if last_day < start_day:
+        await message.answer("Дата конца раньше даты начала. Попробуйте ещё раз.")
+        return
+
+    await state.clear()
+    window = periods.range_window(start_day, last_day + timedelta(days=1))
+    text = await build_report_text("Свой период", window)
+    await message.answer(text, parse_mode="HTML", reply_markup=get_admin_reports_keyboard())
+
+
+@router.callback_query(F.data == "admin_export")
+async def show_admin_export(callback: CallbackQuery):
+    """Меню выгрузки заказов для бухгалтерии"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Выгрузка доступна только модераторам", show_alert=True)
+        return
+
+    text = (
+        "📤 <b>Выгрузка заказов</b>\n\n"
+        "Все заказы месяца с сотрудниками и малярами 70/30 одним файлом.\n"
+        "Выберите месяц и формат:"
+    )
+    await safe_edit_message(callback, text, get_admin_export_keyboard(is_xlsx_available()))
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_export_"))
+async def send_orders_export(callback: CallbackQuery):
+    """Выгружает заказы месяца в файл и отправляет документом"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Выгрузка доступна только модераторам", show_alert=True)
+        return
+
+    kind, _, file_format = callback.data[len("admin_export_"):].rpartition("_")
+    report = get_report_window(kind) if kind in ("month", "prev_month") else None
+    if not report or file_format not in ("csv", "xlsx"):
+        await callback.answer("❌ Неизвестная выгрузка", show_alert=True)
+        return
+    if file_format == "xlsx" and not is_xlsx_available():
+        await callback.answer("❌ Выгрузка в XLSX недоступна", show_alert=True)
+        return
+
+    title, window = report
+    await callback.answer("⏳ Готовлю файл...")
+    writer = OrdersExportWriter(file_format)
+    try:
+        rows = await db.export_orders(window.start_utc, window.end_utc, writer)
+        path = await writer.finish()
+        await callback.message.answer_document(
+            FSInputFile(path, filename=f"orders_{window.start:%Y_%m}.{file_format}"),
+            caption=f"📤 Заказы: {title.lower()} ({window.start:%m.%Y}), строк: {rows}"
+        )
+        logging.info(f"📤 ВЫГРУЗКА ЗАКАЗОВ | {window.start:%m.%Y} | {file_format} | строк: {rows}")
+    except Exception as e:
+        logging.error(f"Ошибка выгрузки заказов: {e}")
+        await callback.message.answer("❌ Не удалось выгрузить заказы, попробуйте позже")
+    finally:
+        writer.cleanup()
+
+
+def previous_payroll_month():
+    """Первое число прошлого расчётного месяца"""
+    return periods.add_months(periods.payroll_window().start, -1)
+
+
+async def build_payroll_text(month_start) -> tuple:
+    """Текст зарплаты за месяц и признак закрытия"""
+    payroll = await db.get_payroll_month(month_start)
+    status = (
+        f"🔒 Месяц закрыт {payroll['closed_at']:%d.%m.%Y}, суммы заморожены"
+        if payroll['closed'] else "🔓 Месяц открыт, суммы считаются по заказам"
+    )
+    text = f"💼 <b>Зарплата за {payroll['month']:%m.%Y}</b>\n{status}\n\n"
+    if not payroll['rows']:
+        return text + "Нет начислений за этот месяц.", payroll['closed']
+
+    lines = []
+    for row in payroll['rows']:
+        profession_emoji = "🎨" if row['profession'] == "painter" else "💨"
+        line = f"{profession_emoji} <b>{row['name']}</b> — {row['total']:,} руб."
+        if row['profession'] == "painter":
+            line += f" (подготовка {row['prep']:,}, покраска {row['painting']:,})"
+        adjustments = row['prep_adjustment'] + row['painting_adjustment']
+        if adjustments:
+            line += f", корректировки {adjustments:+,}"
+        lines.append(line)
+    total = sum(row['total'] for row in payroll['rows'])
+    return text + "\n".join(lines) + f"\n\n💰 <b>Итого:</b> {total:,} руб.", payroll['closed']
+
+
+@router.callback_query(F.data == "admin_payroll")
+async def show_admin_payroll(callback: CallbackQuery):
+    """Зарплата сотрудников за прошлый месяц"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Раздел доступен только модераторам", show_alert=True)
+        return
+
+    month_start = previous_payroll_month()
+    text, closed = await build_payroll_text(month_start)
+    month_key = None if closed else f"{month_start:%Y_%m}"
+    await safe_edit_message(callback, text, get_admin_payroll_keyboard(month_key))
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_payroll_close_"))
+async def ask_close_payroll(callback: CallbackQuery):
+    """Подтверждение закрытия расчётного месяца"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Раздел доступен только модераторам", show_alert=True)
+        return
+
+    month_key = callback.data[len("admin_payroll_close_"):]
+    text, _ = await build_payroll_text(datetime.strptime(month_key, "%Y_%m").date())
+    text += (
+        "\n\n⚠️ После закрытия суммы месяца не меняются. Правки заказов этого месяца "
+        "попадут корректировками в текущий месяц."
+    )
+    await safe_edit_message(callback, text, get_admin_payroll_keyboard(month_key, confirm=True))
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("admin_payroll_confirm_"))
+async def confirm_close_payroll(callback: CallbackQuery):
+    """Закрывает расчётный месяц"""
+    if not await is_moderator(callback.from_user.id, callback.message.chat.id, callback.bot):
+        await callback.answer("❌ Раздел доступен только модераторам", show_alert=True)
+        return
+
+    month_start = datetime.strptime(callback.data[len("admin_payroll_confirm_"):], "%Y_%m").date()
+    try:
+        users_count = await db.close_payroll_month(month_start)
+    except ValueError as e:
+        await callback.answer(f"❌ {e}", show_alert=True)
+        return
+    logging.info(f"🔒 ЗАКРЫТИЕ МЕСЯЦА | {month_start:%m.%Y} | модератор {callback.from_user.id} | сотрудников: {users_count}")
+
+    text, _ = await build_payroll_text(month_start)
+    await safe_edit_message(callback, text, get_admin_payroll_keyboard())
+    await callback.answer("✅ Месяц закрыт")
@@ -11,6 +11,7 @@ from handlers.fsm import EditOrderStates
 from keyboards import (
     get_edit_orders_keyboard,
     get_my_orders_keyboard,
+    decode_orders_cursor,
     get_order_actions_keyboard,
     get_status_keyboard,
     get_confirm_delete_keyboard,
@@ -18,7 +19,9 @@ from keyboards import (
     get_cancel_keyboard
 )
 from config import config
-from db import db
+from db import db, ArchivedOrderError
+import periods
+from middleware import ensure_user
 
 router = Router()
 
@@ -151,7 +154,7 @@ async def format_order_info(order: dict) -> str:
     
     # Завершаем информацию
     # Конвертируем время из UTC в часовой пояс Уфы
-    tz_ufa = ZoneInfo("Asia/Yekaterinburg")
+    tz_ufa = periods.BUSINESS_TZ
     created_at_utc = order['created_at']
     
     # Если время уже в UTC, конвертируем в Уфу
@@ -181,43 +184,29 @@ async def show_edit_orders_menu(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data == "my_orders")
-async def show_my_orders(callback: CallbackQuery, page: int = 0):
+async def show_my_orders(callback: CallbackQuery, db_user: dict = None):
     """Показать заказы пользователя"""
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
-    
-    # Получаем заказы с пагинацией
-    orders = await db.get_user_orders_paginated(user_id, limit=5, offset=page * 5)
-    total_count = await db.get_user_orders_total_count(user_id)
-    
-    if not orders:
-        text = "📋 <b>Ваши заказы</b>\n\nУ вас пока нет заказов."
-        keyboard = get_edit_orders_keyboard()
-    else:
-        text = f"📋 <b>Ваши заказы (стр. {page + 1}):</b>\n\n"
-        for i, order in enumerate(orders, 1):
-            text += f"{i}. {await format_order_info(order)}\n\n"
-        text = text[:4000]  # Ограничиваем длину сообщения
-        # Создаем клавиатуру с кнопками для каждого заказа и пагинацией
-        keyboard = get_my_orders_keyboard(orders, page, total_count)
-    
-    await safe_edit_message(callback, text, keyboard)
-    await callback.answer()
+    user_id = (await ensure_user(db_user, callback.from_user))['id']
+    await show_orders_page(callback, user_id, page=0)
 
 @router.callback_query(F.data.startswith("my_orders_page_"))
-async def show_my_orders_page(callback: CallbackQuery):
+async def show_my_orders_page(callback: CallbackQuery, db_user: dict = None):
     """Показать определенную страницу заказов пользователя"""
-    page = int(callback.data.split("_")[3])  # my_orders_page_{page}
+    parts = callback.data.split("_")  # my_orders_page_{page}_{n|p}_{created_at}_{id}
+    user_id = (await ensure_user(db_user, callback.from_user))['id']
     
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
+    if len(parts) != 7:
+        # Кнопки старого формата (номер страницы без ключа) - начинаем с первой страницы
+        await show_orders_page(callback, user_id, page=0)
+        return
+    await show_orders_page(
+        callback, user_id, page=int(parts[3]),
+        cursor=decode_orders_cursor(parts[5], parts[6]), backward=parts[4] == "p"
     )
-    
-    # Получаем заказы с пагинацией
-    orders = await db.get_user_orders_paginated(user_id, limit=5, offset=page * 5)
+
+async def show_orders_page(callback: CallbackQuery, user_id: int, page: int, cursor: tuple = None, backward: bool = False):
+    """Показать страницу заказов пользователя по ключу соседнего заказа"""
+    orders = await db.get_user_orders_page(user_id, limit=5, cursor=cursor, backward=backward)
     total_count = await db.get_user_orders_total_count(user_id)
     
     if not orders:
@@ -245,7 +234,7 @@ async def start_find_order(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(StateFilter(EditOrderStates.waiting_for_order_number))
-async def process_find_order_number(message: Message, state: FSMContext):
+async def process_find_order_number(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка номера заказа для поиска"""
     if not message.text:
         await message.answer("❌ Номер заказа не может быть пустым. Попробуйте еще раз:")
@@ -258,10 +247,7 @@ async def process_find_order_number(message: Message, state: FSMContext):
         return
     
     # Получаем user_id пользователя
-    user_id = await db.get_or_create_user(
-        message.from_user.id,
-        message.from_user.full_name or message.from_user.username or "Unknown"
-    )
+    user_id = (await ensure_user(db_user, message.from_user))['id']
     
     # Ищем заказ по номеру только среди заказов этого пользователя
     order = await db.get_user_order_by_number(user_id, order_number)
@@ -286,15 +272,12 @@ async def process_find_order_number(message: Message, state: FSMContext):
     await state.clear()
 
 @router.callback_query(F.data.startswith("order_actions_"))
-async def show_order_actions(callback: CallbackQuery):
+async def show_order_actions(callback: CallbackQuery, db_user: dict = None):
     """Показать действия с заказом"""
     order_id = int(callback.data.split("_")[2])
     
     # Проверяем, что заказ принадлежит пользователю
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
+    user_id = (await ensure_user(db_user, callback.from_user))['id']
     
     order = await db.get_user_order_by_id(user_id, order_id)
     
@@ -324,17 +307,14 @@ async def start_change_status(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("set_status_"))
-async def process_change_status(callback: CallbackQuery):
+async def process_change_status(callback: CallbackQuery, db_user: dict = None):
     """Обработка изменения статуса заказа"""
     parts = callback.data.split("_")
     order_id = int(parts[2])
     new_status = parts[3]
     
     # Проверяем, что заказ принадлежит пользователю
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
+    user_id = (await ensure_user(db_user, callback.from_user))['id']
     
     order = await db.get_user_order_by_id(user_id, order_id)
     
@@ -343,7 +323,11 @@ async def process_change_status(callback: CallbackQuery):
         return
     
     # Обновляем статус
-    await db.update_order_status(order_id, new_status)
+    try:
+        await db.update_order_status(order_id, new_status)
+    except ArchivedOrderError as e:
+        await callback.answer(f"❌ {e}", show_alert=True)
+        return
     
     # Получаем обновленную информацию о заказе
     updated_order = await db.get_user_order_by_id(user_id, order_id)
@@ -369,7 +353,7 @@ async def start_change_price(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.message(StateFilter(EditOrderStates.waiting_for_new_price))
-async def process_change_price(message: Message, state: FSMContext):
+async def process_change_price(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка изменения цены заказа"""
     if not message.text:
         await message.answer("❌ Цена не может быть пустой. Попробуйте еще раз:")
@@ -386,10 +370,7 @@ async def process_change_price(message: Message, state: FSMContext):
             return
         
         # Проверяем, что заказ принадлежит пользователю
-        user_id = await db.get_or_create_user(
-            message.from_user.id,
-            message.from_user.full_name or message.from_user.username or "Unknown"
-        )
+        user_id = (await ensure_user(db_user, message.from_user))['id']
         
         order = await db.get_user_order_by_id(user_id, order_id)
         
@@ -402,7 +383,12 @@ async def process_change_price(message: Message, state: FSMContext):
             return
         
         # Обновляем цену
-        success = await db.update_order_price(order_id, new_price)
+        try:
+            success = await db.update_order_price(order_id, new_price)
+        except ArchivedOrderError as e:
+            await message.answer(f"❌ {e}", reply_markup=get_edit_orders_keyboard())
+            await state.clear()
+            return
         
         if success:
             # Получаем обновленную информацию о заказе
@@ -441,15 +427,12 @@ async def start_delete_order(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("confirm_delete_"))
-async def process_delete_order(callback: CallbackQuery):
+async def process_delete_order(callback: CallbackQuery, db_user: dict = None):
     """Обработка удаления заказа"""
     order_id = int(callback.data.split("_")[2])
     
     # Проверяем, что заказ принадлежит пользователю
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
+    user_id = (await ensure_user(db_user, callback.from_user))['id']
     
     order = await db.get_user_order_by_id(user_id, order_id)
     
@@ -458,7 +441,11 @@ async def process_delete_order(callback: CallbackQuery):
         return
     
     # Удаляем заказ
-    success = await db.delete_order_by_id(order_id)
+    try:
+        success = await db.delete_order_by_id(order_id)
+    except ArchivedOrderError as e:
+        await callback.answer(f"❌ {e}", show_alert=True)
+        return
     
     if success:
         text = (f"✅ <b>Заказ удален!</b>\n\n"
@@ -35,6 +35,11 @@ class EarningsStates(StatesGroup):
     waiting_for_description = State()
 
 
+class ReportStates(StatesGroup):
+    """Состояния для отчёта администратора за свой период"""
+    waiting_for_range = State()
+
+
 class BetaOrderStates(StatesGroup):
     """Состояния для бета-версии создания заказа с OCR"""
     waiting_for_photo = State()
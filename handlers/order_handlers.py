@@ -1,6 +1,5 @@
 import logging
 import re
-from zoneinfo import ZoneInfo
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, PhotoSize, InlineKeyboardMarkup
 from aiogram.filters import Command, StateFilter
@@ -11,6 +10,7 @@ from handlers.fsm import OrderStates, UserStates, EarningsStates, BetaOrderState
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 import ocr_helper
+import periods
 from keyboards import (
     get_main_menu_keyboard,
     get_set_type_keyboard, 
@@ -32,7 +32,8 @@ from keyboards import (
     get_spraying_keyboard
 )
 from config import config
-from db import db
+from db import db, OrderNumberExistsError
+from middleware import ensure_user
 
 router = Router()
 
@@ -292,7 +293,7 @@ def calculate_price(profession: str, set_type: str, size: str = None, alumochrom
     return base_price
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db_user: dict = None):
     """Обработчик команды /start"""
     # Игнорируем сообщения из чата модерации
     if str(message.chat.id) == str(config.MODERATION_CHAT_ID):
@@ -301,7 +302,7 @@ async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
     
     # Проверяем, есть ли уже профессия у пользователя
-    user_profession = await db.get_user_profession(message.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     profession_emoji = "🎨" if user_profession == "painter" else "💨" if user_profession else "❓"
     profession_name = "Маляр" if user_profession == "painter" else "Пескоструйщик" if user_profession == "sandblaster" else "Неопределена"
     logging.info(f"👤 Пользователь {message.from_user.id} | Профессия: {profession_emoji} {profession_name}")
@@ -349,12 +350,12 @@ async def process_profession_selection(callback: CallbackQuery, state: FSMContex
     await callback.answer()
 
 @router.callback_query(F.data == "main_menu")
-async def show_main_menu(callback: CallbackQuery, state: FSMContext):
+async def show_main_menu(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Показать главное меню"""
     await state.clear()
     
     # Получаем профессию пользователя
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     if user_profession == "painter":
         text = "👋 <b>Добро пожаловать в бот для маляров!</b>\n\nВыберите действие:"
@@ -376,10 +377,10 @@ async def show_main_menu(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "create_order")
-async def start_create_order(callback: CallbackQuery, state: FSMContext):
+async def start_create_order(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Начать создание заказа"""
     # Получаем профессию пользователя из базы данных
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     if user_profession is None:
         # Если профессия не определена, показываем выбор профессии
@@ -399,9 +400,9 @@ async def start_create_order(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data == "salary_menu")
-async def show_salary_menu(callback: CallbackQuery):
+async def show_salary_menu(callback: CallbackQuery, db_user: dict = None):
     """Показать раздел зарплаты"""
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     text = (
         "💰 <b>Раздел зарплаты</b>\n\n"
         "Выберите нужный раздел:"
@@ -413,23 +414,23 @@ async def show_salary_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "analytics_menu")
-async def show_analytics_menu(callback: CallbackQuery):
+async def show_analytics_menu(callback: CallbackQuery, db_user: dict = None):
     """Показать раздел аналитики и зарплаты"""
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     text = (
         "📊 <b>Аналитика и статистика</b>\n\n"
         "Данные за текущий месяц:"
     )
-    keyboard = get_analytics_keyboard(user_profession)
+    keyboard = get_analytics_keyboard(user_profession, is_admin=config.is_configured_moderator(callback.from_user.id))
 
     await safe_edit_message(callback, text, keyboard)
     await callback.answer()
 
 
 @router.callback_query(F.data == "analytics_top_employees")
-async def show_top_employees(callback: CallbackQuery):
+async def show_top_employees(callback: CallbackQuery, db_user: dict = None):
     """Показать топ сотрудников месяца"""
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     top = await db.get_top_employees_month(profession=user_profession, limit=10)
     
@@ -454,9 +455,9 @@ async def show_top_employees(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "analytics_weekdays")
-async def show_weekdays_stats(callback: CallbackQuery):
+async def show_weekdays_stats(callback: CallbackQuery, db_user: dict = None):
     """Показать статистику по дням недели"""
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     weekday_stats = await db.get_orders_by_weekday(profession=user_profession)
     
@@ -487,9 +488,9 @@ async def show_weekdays_stats(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "analytics_popular_sizes")
-async def show_popular_sizes(callback: CallbackQuery):
+async def show_popular_sizes(callback: CallbackQuery, db_user: dict = None):
     """Показать популярные размеры дисков"""
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     sizes = await db.get_popular_sizes(profession=user_profession, limit=10)
     
@@ -512,9 +513,9 @@ async def show_popular_sizes(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "analytics_avg_price")
-async def show_avg_price(callback: CallbackQuery):
+async def show_avg_price(callback: CallbackQuery, db_user: dict = None):
     """Показать средний чек"""
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     stats = await db.get_average_order_price(profession=user_profession)
     
@@ -534,19 +535,16 @@ async def show_avg_price(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "my_achievements")
-async def show_my_achievements(callback: CallbackQuery):
+async def show_my_achievements(callback: CallbackQuery, db_user: dict = None):
     """Показать достижения пользователя"""
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user = await ensure_user(db_user, callback.from_user)
+    user_id = user['id']
+    user_profession = user['profession']
     
     user_achievements = await db.get_user_achievements(user_id)
     stats = await db.get_user_achievement_stats(user_id)
     
     from achievements import get_achievement_info
-    from zoneinfo import ZoneInfo
     
     if not user_achievements:
         text = (
@@ -557,7 +555,7 @@ async def show_my_achievements(callback: CallbackQuery):
         )
     else:
         lines = []
-        ufa_tz = ZoneInfo("Asia/Yekaterinburg")
+        ufa_tz = periods.BUSINESS_TZ
         
         for ach in user_achievements:
             ach_id = ach['achievement_id']
@@ -589,13 +587,11 @@ async def show_my_achievements(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "earnings_day")
-async def show_earnings_day(callback: CallbackQuery):
+async def show_earnings_day(callback: CallbackQuery, db_user: dict = None):
     """Показать заработок за сегодня"""
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user = await ensure_user(db_user, callback.from_user)
+    user_id = user['id']
+    user_profession = user['profession']
     
     earnings = await db.get_user_earnings_today(user_id)
     avg_earnings = await db.get_user_avg_earnings_per_day(user_id)
@@ -610,9 +606,9 @@ async def show_earnings_day(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "earnings_month")
-async def show_earnings_month(callback: CallbackQuery):
+async def show_earnings_month(callback: CallbackQuery, db_user: dict = None):
     """Показать заработок за месяц"""
-    context = await build_month_earnings_context(callback.from_user)
+    context = await build_month_earnings_context(callback.from_user, db_user)
     await safe_edit_message(callback, context["text"], context["keyboard"])
     await callback.answer()
 
@@ -675,13 +671,13 @@ async def show_beta_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "beta_create_order")
-async def beta_start_create_order(callback: CallbackQuery, state: FSMContext):
+async def beta_start_create_order(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Начать бета-создание заказа с OCR"""
     if not ocr_helper.is_ocr_available():
         await callback.answer("❌ OCR недоступен на сервере", show_alert=True)
         return
     
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     if user_profession is None:
         text = "👨‍🎨 <b>Сначала выберите вашу профессию:</b>"
@@ -873,13 +869,13 @@ async def beta_process_non_photo(message: Message):
 
 
 @router.message(StateFilter(OrderStates.waiting_for_photo), F.photo)
-async def process_photo(message: Message, state: FSMContext):
+async def process_photo(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка фото от пользователя"""
     # Сохраняем file_id самого большого фото
     photo = max(message.photo, key=lambda x: x.file_size)
     
     # Получаем профессию пользователя из базы данных
-    user_profession = await db.get_user_profession(message.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     if user_profession is None:
         await message.answer(
@@ -909,7 +905,7 @@ async def process_non_photo(message: Message):
 
 
 @router.message(StateFilter(OrderStates.waiting_for_order_number))
-async def process_order_number(message: Message, state: FSMContext):
+async def process_order_number(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка номера заказа"""
     if not message.text:
         await message.answer("❌ Номер заказа не может быть пустым. Попробуйте еще раз:")
@@ -922,7 +918,7 @@ async def process_order_number(message: Message, state: FSMContext):
         return
     
     # Получаем профессию пользователя из базы данных
-    user_profession = await db.get_user_profession(message.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     if user_profession is None:
         # Пользователь не выбрал профессию, перенаправляем на выбор
@@ -954,7 +950,7 @@ async def process_order_number(message: Message, state: FSMContext):
     await state.set_state(OrderStates.waiting_for_set_type)
 
 @router.callback_query(F.data.startswith("set_type_"), StateFilter(OrderStates.waiting_for_set_type))
-async def process_set_type(callback: CallbackQuery, state: FSMContext):
+async def process_set_type(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Обработка выбора типа заказа"""
     # Для типа 70_30 нужно учитывать, что callback_data = "set_type_70_30"
     callback_parts = callback.data.split("_")
@@ -975,7 +971,7 @@ async def process_set_type(callback: CallbackQuery, state: FSMContext):
         await state.update_data(price=price)
         
         # Создаем заказ
-        await create_order_from_data(callback, state)
+        await create_order_from_data(callback, state, db_user)
         return
         
     elif set_type == "suspensia":
@@ -1137,7 +1133,7 @@ async def process_suspensia_type(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 @router.callback_query(F.data.startswith("spraying_"), StateFilter(OrderStates.waiting_for_spraying))
-async def process_spraying(callback: CallbackQuery, state: FSMContext):
+async def process_spraying(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Обработка выбора напыления для пескоструйщика"""
     spraying_choice = callback.data.split("_")[1]  # yes или no
     
@@ -1151,7 +1147,7 @@ async def process_spraying(callback: CallbackQuery, state: FSMContext):
         price = calculate_price(profession, set_type, size, spraying_deep=0, spraying_shallow=0)
         await state.update_data(price=price, spraying_deep=0, spraying_shallow=0)
         
-        await create_order_from_data(callback, state)
+        await create_order_from_data(callback, state, db_user)
         return
     else:
         # Есть напыление - спрашиваем количество глубоких
@@ -1190,7 +1186,7 @@ async def process_deep_spraying(message: Message, state: FSMContext):
         return
 
 @router.message(StateFilter(OrderStates.waiting_for_shallow_spraying))
-async def process_shallow_spraying(message: Message, state: FSMContext):
+async def process_shallow_spraying(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка количества неглубоких напылений"""
     if not message.text:
         await message.answer("❌ Количество не может быть пустым. Попробуйте еще раз:")
@@ -1215,14 +1211,14 @@ async def process_shallow_spraying(message: Message, state: FSMContext):
         price = calculate_price(profession, set_type, size, spraying_deep=spraying_deep, spraying_shallow=shallow_count)
         await state.update_data(price=price)
         
-        await create_order_from_message_data(message, state)
+        await create_order_from_message_data(message, state, db_user)
         
     except ValueError:
         await message.answer("❌ Неверный формат количества. Введите число:")
         return
 
 @router.message(StateFilter(OrderStates.waiting_for_suspensia_quantity))
-async def process_suspensia_quantity(message: Message, state: FSMContext):
+async def process_suspensia_quantity(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка количества супортов"""
     if not message.text:
         await message.answer("❌ Количество не может быть пустым. Попробуйте еще раз:")
@@ -1256,14 +1252,14 @@ async def process_suspensia_quantity(message: Message, state: FSMContext):
         await state.update_data(price=price)
         
         # Создаем заказ
-        await create_order_from_message_data(message, state)
+        await create_order_from_message_data(message, state, db_user)
         
     except ValueError:
         await message.answer("❌ Неверный формат количества. Введите число:")
         return
 
 @router.message(StateFilter(OrderStates.waiting_for_free_price))
-async def process_free_price(message: Message, state: FSMContext):
+async def process_free_price(message: Message, state: FSMContext, db_user: dict = None):
     """Обработка цены свободного заказа"""
     if not message.text:
         await message.answer("❌ Цена не может быть пустой. Попробуйте еще раз:")
@@ -1279,33 +1275,18 @@ async def process_free_price(message: Message, state: FSMContext):
         await state.update_data(price=price)
         
         # Создаем заказ
-        await create_order_from_message_data(message, state)
+        await create_order_from_message_data(message, state, db_user)
         
     except ValueError:
         await message.answer("❌ Неверный формат цены. Введите число:")
         return
 
-async def create_order_from_message_data(message: Message, state: FSMContext):
+async def create_order_from_message_data(message: Message, state: FSMContext, db_user: dict = None):
     """Создает заказ из данных состояния для сообщений"""
     data = await state.get_data()
     
-    # Получаем профессию пользователя
-    user_profession = await db.get_user_profession(message.from_user.id)
-    
     # Создаем заказ в базе данных
-    user_id = await db.get_or_create_user(
-        message.from_user.id,
-        message.from_user.full_name or message.from_user.username or "Unknown"
-    )
-    
-    # Проверяем, не существует ли уже такой номер заказа среди пользователей той же профессии
-    if await db.check_order_number_exists(data["order_number"], user_profession):
-        await message.answer(
-            f"⚠️ <b>Заказ с номером '{data['order_number']}' уже существует среди {user_profession}ов!</b>\n\nЧто вы хотите сделать?",
-            parse_mode="HTML",
-            reply_markup=get_order_exists_keyboard(data["order_number"])
-        )
-        return
+    user_id = (await ensure_user(db_user, message.from_user))['id']
     
     try:
         # Определяем статус в зависимости от профессии
@@ -1371,12 +1352,20 @@ async def create_order_from_message_data(message: Message, state: FSMContext):
         
         await message.answer(text, parse_mode="HTML", reply_markup=get_back_to_menu_keyboard())
         
+    except OrderNumberExistsError as e:
+        # Номер уже занят среди заказов той же профессии - предлагаем перезаписать
+        await message.answer(
+            f"⚠️ <b>Заказ с номером '{e.order_number}' уже существует среди {e.profession}ов!</b>\n\nЧто вы хотите сделать?",
+            parse_mode="HTML",
+            reply_markup=get_order_exists_keyboard(e.order_number)
+        )
+        return
     except Exception as e:
         logging.error(f"Ошибка создания заказа: {e}")
         await message.answer(
             f"❌ <b>Ошибка создания заказа!</b>\n\n"
-            f"Заказ с номером '{data['order_number']}' уже существует.\n"
-            f"Пожалуйста, используйте другой номер заказа.",
+            f"Не удалось сохранить заказ '{data['order_number']}'.\n"
+            f"Пожалуйста, попробуйте ещё раз.",
             parse_mode="HTML",
             reply_markup=get_back_to_menu_keyboard()
         )
@@ -1434,7 +1423,7 @@ def get_set_type_text(set_type: str, data: dict) -> str:
     return profession_text
 
 @router.callback_query(F.data.startswith("alumochrome_"), StateFilter(OrderStates.waiting_for_alumochrome))
-async def process_alumochrome(callback: CallbackQuery, state: FSMContext):
+async def process_alumochrome(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Обработка выбора алюмохрома"""
     alumochrome = callback.data.split("_")[1] == "yes"
     
@@ -1465,10 +1454,10 @@ async def process_alumochrome(callback: CallbackQuery, state: FSMContext):
         return
     
     # Создаем заказ
-    await create_order_from_data(callback, state)
+    await create_order_from_data(callback, state, db_user)
 
 @router.callback_query(F.data.startswith("painter_"), StateFilter(OrderStates.waiting_for_painter_selection))
-async def process_painter_selection(callback: CallbackQuery, state: FSMContext):
+async def process_painter_selection(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Обработка выбора маляра для типа 70/30"""
     painter_tg_id = int(callback.data.split("_")[1])
     
@@ -1500,29 +1489,14 @@ async def process_painter_selection(callback: CallbackQuery, state: FSMContext):
         await state.update_data(painter_30=painter_id)
         
         # Создаем заказ
-        await create_order_from_data(callback, state)
+        await create_order_from_data(callback, state, db_user)
 
-async def create_order_from_data(callback: CallbackQuery, state: FSMContext):
+async def create_order_from_data(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Создает заказ из данных состояния"""
     data = await state.get_data()
     
-    # Получаем профессию пользователя
-    user_profession = await db.get_user_profession(callback.from_user.id)
-    
     # Создаем заказ в базе данных
-    user_id = await db.get_or_create_user(
-        callback.from_user.id,
-        callback.from_user.full_name or callback.from_user.username or "Unknown"
-    )
-    
-    # Проверяем, не существует ли уже такой номер заказа среди пользователей той же профессии
-    if await db.check_order_number_exists(data["order_number"], user_profession):
-        text = f"⚠️ <b>Заказ с номером '{data['order_number']}' уже существует среди {user_profession}ов!</b>\n\nЧто вы хотите сделать?"
-        keyboard = get_order_exists_keyboard(data["order_number"])
-        
-        await safe_edit_message(callback, text, keyboard)
-        await callback.answer("❌ Номер заказа уже существует")
-        return
+    user_id = (await ensure_user(db_user, callback.from_user))['id']
     
     try:
         # Определяем статус в зависимости от профессии
@@ -1588,26 +1562,34 @@ async def create_order_from_data(callback: CallbackQuery, state: FSMContext):
         
         await safe_edit_message(callback, text, get_back_to_menu_keyboard())
         
+    except OrderNumberExistsError as e:
+        # Номер уже занят среди заказов той же профессии - предлагаем перезаписать
+        text = f"⚠️ <b>Заказ с номером '{e.order_number}' уже существует среди {e.profession}ов!</b>\n\nЧто вы хотите сделать?"
+        keyboard = get_order_exists_keyboard(e.order_number)
+        
+        await safe_edit_message(callback, text, keyboard)
+        await callback.answer("❌ Номер заказа уже существует")
+        return
     except Exception as e:
         logging.error(f"Ошибка создания заказа: {e}")
         text = (f"❌ <b>Ошибка создания заказа!</b>\n\n"
-                f"Заказ с номером '{data['order_number']}' уже существует.\n"
-                f"Пожалуйста, используйте другой номер заказа.")
+                f"Не удалось сохранить заказ '{data['order_number']}'.\n"
+                f"Пожалуйста, попробуйте ещё раз.")
         
         await safe_edit_message(callback, text, get_back_to_menu_keyboard())
-        await callback.answer("❌ Ошибка: номер заказа уже существует")
+        await callback.answer("❌ Ошибка создания заказа")
         return
     
     await state.set_state(OrderStates.order_confirmed)
     await callback.answer("✅ Заказ создан")
 
 @router.callback_query(F.data.startswith("overwrite_order_"))
-async def process_overwrite_order(callback: CallbackQuery, state: FSMContext):
+async def process_overwrite_order(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Обработка перезаписи заказа"""
     order_number = callback.data.split("_", 2)[2]  # Получаем номер заказа
     
     # Получаем профессию пользователя
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     if not user_profession:
         await callback.answer("❌ Профессия не определена", show_alert=True)
         return
@@ -1647,12 +1629,12 @@ async def process_change_order_number(callback: CallbackQuery, state: FSMContext
     await callback.answer("Введите новый номер заказа")
 
 @router.callback_query(F.data == "cancel")
-async def process_cancel(callback: CallbackQuery, state: FSMContext):
+async def process_cancel(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Обработка отмены заказа"""
     await state.clear()
     
     # Получаем профессию пользователя
-    user_profession = await db.get_user_profession(callback.from_user.id)
+    user_profession = db_user['profession'] if db_user else None
     
     text = "❌ <b>Заказ отменен</b>\n\nВыберите действие:"
     keyboard = get_main_menu_keyboard(user_profession)
@@ -1826,7 +1808,7 @@ async def process_salary_painting_delta(message: Message, state: FSMContext):
 
 
 @router.message(StateFilter(EarningsStates.waiting_for_description))
-async def process_salary_description(message: Message, state: FSMContext):
+async def process_salary_description(message: Message, state: FSMContext, db_user: dict = None):
     text = (message.text or "").strip()
 
     if _is_cancel_text(text):
@@ -1844,10 +1826,7 @@ async def process_salary_description(message: Message, state: FSMContext):
     user_id = data.get("salary_user_id")
 
     if not user_id:
-        user_id = await db.get_or_create_user(
-            message.from_user.id,
-            message.from_user.full_name or message.from_user.username or "Unknown"
-        )
+        user_id = (await ensure_user(db_user, message.from_user))['id']
 
     await db.add_earnings_adjustment(user_id, prep_delta, painting_delta, text)
 
@@ -1863,14 +1842,14 @@ async def process_salary_description(message: Message, state: FSMContext):
     await message.answer(summary, parse_mode="HTML")
     await restore_salary_state(state)
 
-    context = await build_month_earnings_context(message.from_user)
+    context = await build_month_earnings_context(message.from_user, db_user)
     await message.answer(context["text"], parse_mode="HTML", reply_markup=context["keyboard"])
 
 
 @router.callback_query(F.data.startswith("delete_adjustment_"))
-async def delete_adjustment(callback: CallbackQuery):
+async def delete_adjustment(callback: CallbackQuery, db_user: dict = None):
     """Удаление корректировки заработка"""
-    context = await build_month_earnings_context(callback.from_user)
+    context = await build_month_earnings_context(callback.from_user, db_user)
 
     if context.get("profession") != "painter":
         await callback.answer("Раздел доступен только для маляров", show_alert=True)
@@ -1889,7 +1868,7 @@ async def delete_adjustment(callback: CallbackQuery):
         
         # Обновляем историю
         history = await db.get_earnings_adjustments_history(context["user_id"])
-        ufa_tz = ZoneInfo("Asia/Yekaterinburg")
+        ufa_tz = periods.BUSINESS_TZ
 
         if not history:
             text = "🗂 <b>История корректировок</b>\n\nПока нет записей за текущий месяц."
@@ -1927,7 +1906,7 @@ async def delete_adjustment(callback: CallbackQuery):
 
 
 @router.message()
-async def handle_any_message(message: Message, state: FSMContext):
+async def handle_any_message(message: Message, state: FSMContext, db_user: dict = None):
     """Обработчик для всех остальных сообщений"""
     # Игнорируем сообщения из чата модерации
     if str(message.chat.id) == str(config.MODERATION_CHAT_ID):
@@ -1954,13 +1933,8 @@ async def handle_any_message(message: Message, state: FSMContext):
     # Если пользователь не в процессе создания заказа, показываем главное меню
     if current_state is None:
         # Регистрируем пользователя в базе данных
-        user_id = await db.get_or_create_user(
-            message.from_user.id, 
-            message.from_user.full_name or message.from_user.username or "Unknown"
-        )
-        
-        # Получаем профессию пользователя
-        user_profession = await db.get_user_profession(message.from_user.id)
+        user = await ensure_user(db_user, message.from_user)
+        user_profession = user['profession']
         
         if user_profession == "painter":
             text = "🎨 <b>Добро пожаловать в бот для маляров!</b>\n\nВыберите действие:"
@@ -1980,7 +1954,7 @@ async def handle_any_message(message: Message, state: FSMContext):
         )
 
 @router.callback_query(F.data.startswith("price_list"))
-async def show_price_list(callback: CallbackQuery):
+async def show_price_list(callback: CallbackQuery, db_user: dict = None):
     """Показать прайс-лист"""
     from config import config
     from keyboards import get_back_to_menu_keyboard
@@ -1992,7 +1966,7 @@ async def show_price_list(callback: CallbackQuery):
         profession = "sandblaster"
     else:
         # Если callback_data просто "price_list", получаем профессию пользователя
-        profession = await db.get_user_profession(callback.from_user.id) or "painter"
+        profession = db_user['profession'] if db_user and db_user['profession'] else "painter"
     
     # Формируем прайс-лист
     if profession == "painter":
@@ -2081,11 +2055,11 @@ async def show_price_list(callback: CallbackQuery):
 def _format_signed(value: int) -> str:
     return f"+{value}" if value >= 0 else str(value)
 
-async def build_month_earnings_context(tg_user) -> dict:
+async def build_month_earnings_context(tg_user, db_user: dict = None) -> dict:
     """Возвращает данные для отображения заработка за месяц"""
-    display_name = tg_user.full_name or tg_user.username or "Unknown"
-    user_id = await db.get_or_create_user(tg_user.id, display_name)
-    profession = await db.get_user_profession(tg_user.id)
+    user = await ensure_user(db_user, tg_user)
+    user_id = user['id']
+    profession = user['profession']
 
     context = {
         "user_id": user_id,
@@ -2130,9 +2104,9 @@ def _is_cancel_text(text: str) -> bool:
     return text.lower() in {"отмена", "cancel", "/cancel"}
 
 @router.callback_query(F.data == "salary_edit_menu")
-async def show_salary_edit_menu(callback: CallbackQuery):
+async def show_salary_edit_menu(callback: CallbackQuery, db_user: dict = None):
     """Показать меню редактирования заработка (только для маляров)"""
-    context = await build_month_earnings_context(callback.from_user)
+    context = await build_month_earnings_context(callback.from_user, db_user)
 
     if context.get("profession") != "painter":
         await callback.answer("Раздел доступен только для маляров", show_alert=True)
@@ -2153,16 +2127,16 @@ async def show_salary_edit_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "salary_edit_history")
-async def show_salary_edit_history(callback: CallbackQuery):
+async def show_salary_edit_history(callback: CallbackQuery, db_user: dict = None):
     """Показать историю корректировок заработка за месяц"""
-    context = await build_month_earnings_context(callback.from_user)
+    context = await build_month_earnings_context(callback.from_user, db_user)
 
     if context.get("profession") != "painter":
         await callback.answer("Раздел доступен только для маляров", show_alert=True)
         return
 
     history = await db.get_earnings_adjustments_history(context["user_id"])
-    ufa_tz = ZoneInfo("Asia/Yekaterinburg")
+    ufa_tz = periods.BUSINESS_TZ
 
     if not history:
         text = "🗂 <b>История корректировок</b>\n\nПока нет записей за текущий месяц."
@@ -2199,9 +2173,9 @@ async def show_salary_edit_history(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "salary_edit_start")
-async def start_salary_edit(callback: CallbackQuery, state: FSMContext):
+async def start_salary_edit(callback: CallbackQuery, state: FSMContext, db_user: dict = None):
     """Запуск ввода корректировок заработка"""
-    context = await build_month_earnings_context(callback.from_user)
+    context = await build_month_earnings_context(callback.from_user, db_user)
 
     if context.get("profession") != "painter":
         await callback.answer("Раздел доступен только для маляров", show_alert=True)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Скрипт массового импорта исторических заказов (CSV или JSONL)
+
+Использование:
+    python import_orders.py orders.csv [--batch-size 5000] [--create-users] [--defer-indexes]
+
+Поля строки:
+    order_number, tg_id, set_type        - обязательные
+    name, profession                     - для создания пользователя (с --create-users)
+    size, alumochrome, suspensia_type, quantity, spraying_deep, spraying_shallow
+    price                                - если не указана, считается через calculate_price
+    status                               - по умолчанию 'confirmed'
+    created_at                           - ISO-формат; без часового пояса считается временем мастерской (BUSINESS_TIMEZONE)
+    painter_70_tg_id, painter_30_tg_id   - для заказов 70/30
+    photo_file_id
+
+Заказы загружаются через COPY пачками, агрегаты заработка и статистики
+пересобираются один раз в конце. Строки за месяцы, перенесённые в архив, пропускаются.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sys
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+import periods
+from db import db, local_month_start, CHANGE_FEED_CHANNEL
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+LOCAL_TZ = periods.BUSINESS_TZ
+
+ORDER_COLUMNS = [
+    'order_number', 'user_id', 'order_profession', 'set_type', 'size', 'alumochrome',
+    'suspensia_type', 'quantity', 'spraying_deep', 'spraying_shallow', 'price', 'status',
+    'photo_file_id', 'painter_70_id', 'painter_30_id', 'reminder_sent', 'created_at', 'updated_at'
+]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'да', 't', 'y'}
+
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Построчно читает файл импорта (CSV или JSONL), не загружая его в память целиком"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def _text(value: Any) -> Optional[str]:
+    """Пустые значения превращает в None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int(value: Any, default: int = 0) -> int:
+    value = _text(value)
+    return int(value) if value is not None else default
+
+
+def _bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    value = _text(value)
+    return value is not None and value.lower() in TRUE_VALUES
+
+
+def _created_at(value: Any) -> datetime:
+    """Время создания в наивном UTC (как хранится orders.created_at)"""
+    value = _text(value)
+    if value is None:
+        return datetime.utcnow()
+    created = datetime.fromisoformat(value)
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=LOCAL_TZ)
+    return created.astimezone(periods.UTC).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=4096)
+def price_for(profession: str, set_type: str, size: Optional[str], alumochrome: bool,
+              suspensia_type: Optional[str], quantity: int, spraying_deep: int, spraying_shallow: int) -> int:
+    """Цена по прайсу (кэшируется - в истории много одинаковых позиций)"""
+    from handlers.order_handlers import calculate_price
+
+    base_type = set_type[len("70_30_"):] if set_type.startswith("70_30_") else set_type
+    return calculate_price(profession, base_type, size, alumochrome, suspensia_type,
+                           quantity, spraying_deep, spraying_shallow)
+
+
+class OrderImporter:
+    def __init__(self, batch_size: int, create_users: bool):
+        self.batch_size = batch_size
+        self.create_users = create_users
+        self.users: Dict[int, Dict[str, Any]] = {}  # tg_id -> {id, profession}
+        self.seen_numbers = set()  # (профессия, номер) уже загруженные в этом запуске
+        self.archived_months = set()  # месяцы в orders_archive: их секции не принимают новые заказы
+        self.imported = 0
+        self.skipped = 0
+
+    async def resolve_users(self, conn, rows: List[Dict[str, Any]]):
+        """Находит (и при необходимости создаёт) пользователей пачки одним-двумя запросами"""
+        wanted = {}
+        for row in rows:
+            for field in ('tg_id', 'painter_70_tg_id', 'painter_30_tg_id'):
+                tg_id = _text(row.get(field))
+                if tg_id is not None and int(tg_id) not in self.users:
+                    wanted.setdefault(int(tg_id), row if field == 'tg_id' else {})
+
+        if not wanted:
+            return
+
+        found = await conn.fetch(
+            "SELECT id, tg_id, profession FROM users WHERE tg_id = ANY($1::BIGINT[])",
+            list(wanted)
+        )
+        for user in found:
+            self.users[user['tg_id']] = {"id": user['id'], "profession": user['profession'] or 'painter'}
+
+        missing = [tg_id for tg_id in wanted if tg_id not in self.users]
+        if missing and self.create_users:
+            created = await conn.fetch("""
+                INSERT INTO users (tg_id, name, profession)
+                SELECT * FROM unnest($1::BIGINT[], $2::VARCHAR[], $3::VARCHAR[])
+                ON CONFLICT (tg_id) DO UPDATE SET tg_id = EXCLUDED.tg_id
+                RETURNING id, tg_id, profession
+            """,
+                missing,
+                [_text(wanted[tg_id].get('name')) or "Unknown" for tg_id in missing],
+                [_text(wanted[tg_id].get('profession')) or 'painter' for tg_id in missing]
+            )
+            for user in created:
+                self.users[user['tg_id']] = {"id": user['id'], "profession": user['profession'] or 'painter'}
+            logger.info(f"👤 Создано пользователей: {len(created)}")
+
+    def build_record(self, row: Dict[str, Any], line_no: int) -> Optional[tuple]:
+        """Преобразует строку файла в запись для COPY (None - строка пропущена)"""
+        order_number = _text(row.get('order_number'))
+        tg_id = _text(row.get('tg_id'))
+        set_type = _text(row.get('set_type'))
+        if not order_number or not tg_id or not set_type:
+            logger.warning(f"⚠️ Строка {line_no}: нет order_number/tg_id/set_type, пропущена")
+            return None
+
+        user = self.users.get(int(tg_id))
+        if not user:
+            logger.warning(f"⚠️ Строка {line_no}: пользователь tg_id={tg_id} не найден, пропущена")
+            return None
+
+        profession = user['profession']
+        if (profession, order_number) in self.seen_numbers:
+            logger.warning(f"⚠️ Строка {line_no}: номер '{order_number}' ({profession}) уже существует, пропущена")
+            return None
+
+        painters = {}
+        for field in ('painter_70_tg_id', 'painter_30_tg_id'):
+            painter_tg_id = _text(row.get(field))
+            if painter_tg_id is None:
+                painters[field] = None
+                continue
+            painter = self.users.get(int(painter_tg_id))
+            if not painter:
+                # Без маляра заказ 70/30 целиком засчитался бы владельцу
+                logger.warning(f"⚠️ Строка {line_no}: маляр {field}={painter_tg_id} не найден, пропущена")
+                return None
+            painters[field] = painter['id']
+
+        size = _text(row.get('size'))
+        alumochrome = _bool(row.get('alumochrome'))
+        suspensia_type = _text(row.get('suspensia_type'))
+        quantity = _int(row.get('quantity'), 1)
+        spraying_deep = _int(row.get('spraying_deep'))
+        spraying_shallow = _int(row.get('spraying_shallow'))
+
+        price = _text(row.get('price'))
+        if price is None:
+            price = price_for(profession, set_type, size, alumochrome, suspensia_type,
+                              quantity, spraying_deep, spraying_shallow)
+
+        created_at = _created_at(row.get('created_at'))
+        month = local_month_start(created_at)
+        if month in self.archived_months:
+            logger.warning(f"⚠️ Строка {line_no}: месяц {month:%m.%Y} перенесён в архив, пропущена")
+            return None
+
+        # reminder_sent = TRUE: по историческим черновикам напоминания модераторам не нужны
+        self.seen_numbers.add((profession, order_number))
+        return (
+            order_number, user['id'], profession, set_type, size, alumochrome,
+            suspensia_type, quantity, spraying_deep, spraying_shallow, int(price),
+            _text(row.get('status')) or 'confirmed', _text(row.get('photo_file_id')),
+            painters['painter_70_tg_id'], painters['painter_30_tg_id'], True, created_at, created_at
+        )
+
+    async def load_batch(self, rows: List[tuple]):
+        """Загружает пачку строк через COPY"""
+        async with db.pool.acquire() as conn:
+            await self.resolve_users(conn, [row for _, row in rows])
+
+            # Номера, которые уже есть в базе, пропускаем (уникальность в пределах профессии)
+            existing = await conn.fetch(
+                "SELECT order_profession, order_number FROM order_numbers WHERE order_number = ANY($1::VARCHAR[])",
+                list({_text(row.get('order_number')) for _, row in rows} - {None})
+            )
+            self.seen_numbers.update((r['order_profession'], r['order_number']) for r in existing)
+
+            records = []
+            for line_no, row in rows:
+                try:
+                    record = self.build_record(row, line_no)
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"⚠️ Строка {line_no}: {e}, пропущена")
+                    record = None
+                if record:
+                    records.append(record)
+                else:
+                    self.skipped += 1
+
+            if records:
+                # Месячные секции под даты пачки (иначе строки уйдут в orders_default)
+                months = sorted({local_month_start(record[-1]) for record in records})
+                await db.ensure_orders_partitions(months[0], months[-1])
+                async with conn.transaction():
+                    # Построчные события ленты изменений не нужны: после импорта кэши сбрасываются одним событием
+                    await conn.execute("SET LOCAL app.change_feed = 'off'")
+                    # Бот мог занять номер после проверки выше - такие записи пропускаются, а не срывают пачку
+                    reserved = {(row['order_profession'], row['order_number']) for row in await conn.fetch("""
+                        INSERT INTO order_numbers (order_profession, order_number)
+                        SELECT * FROM unnest($1::varchar[], $2::varchar[])
+                        ON CONFLICT DO NOTHING
+                        RETURNING order_profession, order_number
+                    """, [record[2] for record in records], [record[0] for record in records])}
+                    taken = [record for record in records if (record[2], record[0]) not in reserved]
+                    for record in taken:
+                        logger.warning(f"⚠️ Номер '{record[0]}' ({record[2]}) занят во время импорта, заказ пропущен")
+                    records = [record for record in records if (record[2], record[0]) in reserved]
+                    self.skipped += len(taken)
+                    if records:
+                        await conn.copy_records_to_table('orders', records=records, columns=ORDER_COLUMNS)
+            self.imported += len(records)
+            logger.info(f"📦 Загружено: {self.imported}, пропущено: {self.skipped}")
+
+    async def run(self, path: str):
+        """Импортирует файл пачками"""
+        self.archived_months = await db.get_archived_months()
+        batch = []
+        for line_no, row in enumerate(read_rows(path), start=1):
+            batch.append((line_no, row))
+            if len(batch) >= self.batch_size:
+                await self.load_batch(batch)
+                batch = []
+        if batch:
+            await self.load_batch(batch)
+
+
+async def drop_secondary_indexes() -> List[str]:
+    """Удаляет вторичные индексы orders на время загрузки, возвращает их определения"""
+    async with db.pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = 'orders' AND indexname LIKE 'idx_orders_%'
+        """)
+        for row in rows:
+            await conn.execute(f'DROP INDEX IF EXISTS "{row["indexname"]}"')
+    return [row['indexdef'] for row in rows]
+
+
+async def restore_indexes(index_defs: List[str]):
+    """Создаёт заново индексы, удалённые на время загрузки"""
+    async with db.pool.acquire() as conn:
+        for index_def in index_defs:
+            await conn.execute(index_def)
+
+
+async def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description="Импорт исторических заказов")
+    parser.add_argument("path", help="CSV или JSONL файл")
+    parser.add_argument("--batch-size", type=int, default=5000, help="размер пачки COPY")
+    parser.add_argument("--create-users", action="store_true", help="создавать отсутствующих пользователей")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="удалить вторичные индексы на время загрузки и построить их в конце")
+    args = parser.parse_args()
+
+    await db.create_pool()
+    try:
+        await db.init_tables()
+
+        dropped = []
+        if args.defer_indexes:
+            dropped = await drop_secondary_indexes()
+            logger.info(f"🔄 Индексы отключены на время загрузки: {len(dropped)}")
+
+        importer = OrderImporter(args.batch_size, args.create_users)
+        try:
+            await importer.run(args.path)
+        finally:
+            if dropped:
+                logger.info("🔄 Построение индексов...")
+                await restore_indexes(dropped)
+
+        logger.info("🔄 Пересборка агрегатов заработка и статистики...")
+        await db.rebuild_user_day_earnings()
+        await db.rebuild_user_stats()
+        async with db.pool.acquire() as conn:
+            await conn.execute("ANALYZE orders")
+            await conn.execute("SELECT pg_notify($1, $2)", CHANGE_FEED_CHANNEL, json.dumps({"op": "reset"}))
+
+        logger.info(f"✅ Импорт завершён: загружено {importer.imported}, пропущено {importer.skipped}")
+    finally:
+        await db.close_pool()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("❌ Операция прервана пользователем")
+    except Exception as e:
+        logger.error(f"❌ Критическая ошибка: {e}")
+        sys.exit(1)
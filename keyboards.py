@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 
@@ -126,24 +127,45 @@ def get_edit_orders_keyboard() -> InlineKeyboardMarkup:
     builder.adjust(1)
     return builder.as_markup()
 
+ORDERS_CURSOR_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_orders_cursor(order: dict) -> str:
+    """Ключ заказа для callback_data: created_at (микросекунды, наивный UTC) и id"""
+    micros = (order['created_at'] - ORDERS_CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{order['id']}"
+
+
+def decode_orders_cursor(micros: str, order_id: str) -> tuple:
+    """Ключ заказа (created_at, id) из callback_data"""
+    return ORDERS_CURSOR_EPOCH + timedelta(microseconds=int(micros)), int(order_id)
+
+
 def get_my_orders_keyboard(orders: list, page: int = 0, total_count: int = 0) -> InlineKeyboardMarkup:
-    """Клавиатура для списка заказов пользователя с пагинацией"""
+    """Клавиатура для списка заказов пользователя с пагинацией по ключу заказа"""
     builder = InlineKeyboardBuilder()
     
-    # Кнопки заказов
+    # Навигация по страницам: my_orders_page_{страница}_{n - дальше / p - назад}_{ключ заказа}
+    nav_buttons = []
+    if page == 1:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data="my_orders"))
+    elif page > 1:
+        nav_buttons.append(InlineKeyboardButton(
+            text="◀️ Назад", callback_data=f"my_orders_page_{page-1}_p_{encode_orders_cursor(orders[0])}"
+        ))
+    if (page + 1) * 5 < total_count:
+        nav_buttons.append(InlineKeyboardButton(
+            text="Вперёд ▶️", callback_data=f"my_orders_page_{page+1}_n_{encode_orders_cursor(orders[-1])}"
+        ))
+    
+    # Кнопки заказов (архивные заказы закрытых месяцев только для просмотра)
+    orders = [order for order in orders if not order.get('archived')]
     for order in orders:
         builder.add(InlineKeyboardButton(
             text=f"📋 Заказ #{order['order_number']}",
             callback_data=f"order_actions_{order['id']}"
         ))
     
-    # Навигация по страницам
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"my_orders_page_{page-1}"))
-    if (page + 1) * 5 < total_count:
-        nav_buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"my_orders_page_{page+1}"))
-    
     if nav_buttons:
         for btn in nav_buttons:
             builder.add(btn)
@@ -256,8 +278,8 @@ def get_salary_edit_history_keyboard(adjustments_list: list = None) -> InlineKey
     builder.adjust(2)  # По 2 кнопки удаления в ряд
     return builder.as_markup()
 
-def get_analytics_keyboard(profession: str = None) -> InlineKeyboardMarkup:
-    """Клавиатура раздела аналитики"""
+def get_analytics_keyboard(profession: str = None, is_admin: bool = False) -> InlineKeyboardMarkup:
+    """Клавиатура раздела аналитики (для модераторов - с отчётами за период)"""
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="💰 Заработок за день", callback_data="earnings_day"))
     builder.add(InlineKeyboardButton(text="📊 Заработок за месяц", callback_data="earnings_month"))
@@ -274,6 +296,8 @@ def get_analytics_keyboard(profession: str = None) -> InlineKeyboardMarkup:
     builder.add(InlineKeyboardButton(text="📅 График по дням недели", callback_data="analytics_weekdays"))
     builder.add(InlineKeyboardButton(text="📏 Популярные размеры", callback_data="analytics_popular_sizes"))
     builder.add(InlineKeyboardButton(text="💵 Средний чек", callback_data="analytics_avg_price"))
+    if is_admin:
+        builder.add(InlineKeyboardButton(text="📈 Отчёты за период", callback_data="admin_reports"))
     builder.add(InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
     builder.adjust(1)
     return builder.as_markup()
@@ -295,3 +319,46 @@ def get_salary_keyboard(profession: str = None) -> InlineKeyboardMarkup:
     builder.add(InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu"))
     builder.adjust(1)
     return builder.as_markup()
+
+
+def get_admin_reports_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура отчётов администратора за период"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="📅 Сегодня", callback_data="admin_report_today"))
+    builder.add(InlineKeyboardButton(text="🗓 Неделя к прошлой неделе", callback_data="admin_report_week"))
+    builder.add(InlineKeyboardButton(text="📆 Текущий месяц", callback_data="admin_report_month"))
+    builder.add(InlineKeyboardButton(text="⏪ Прошлый месяц", callback_data="admin_report_prev_month"))
+    builder.add(InlineKeyboardButton(text="📊 С начала года", callback_data="admin_report_year"))
+    builder.add(InlineKeyboardButton(text="✍️ Свой период", callback_data="admin_report_custom"))
+    builder.add(InlineKeyboardButton(text="📤 Выгрузка заказов", callback_data="admin_export"))
+    builder.add(InlineKeyboardButton(text="💼 Зарплата за прошлый месяц", callback_data="admin_payroll"))
+    builder.add(InlineKeyboardButton(text="🔙 Назад", callback_data="analytics_menu"))
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def get_admin_export_keyboard(xlsx_available: bool = True) -> InlineKeyboardMarkup:
+    """Клавиатура выгрузки заказов за месяц"""
+    builder = InlineKeyboardBuilder()
+    formats = ("csv", "xlsx") if xlsx_available else ("csv",)
+    for kind, title in (("month", "Текущий месяц"), ("prev_month", "Прошлый месяц")):
+        for file_format in formats:
+            builder.add(InlineKeyboardButton(
+                text=f"📤 {title} ({file_format.upper()})",
+                callback_data=f"admin_export_{kind}_{file_format}"
+            ))
+    builder.add(InlineKeyboardButton(text="🔙 Назад", callback_data="admin_reports"))
+    builder.adjust(len(formats))
+    return builder.as_markup()
+
+
+def get_admin_payroll_keyboard(month_key: str = None, confirm: bool = False) -> InlineKeyboardMarkup:
+    """Клавиатура зарплаты за месяц: закрытие расчётного периода (month_key - ГГГГ_ММ открытого месяца)"""
+    builder = InlineKeyboardBuilder()
+    if month_key and confirm:
+        builder.add(InlineKeyboardButton(text="✅ Да, закрыть", callback_data=f"admin_payroll_confirm_{month_key}"))
+    elif month_key:
+        builder.add(InlineKeyboardButton(text="🔒 Закрыть месяц", callback_data=f"admin_payroll_close_{month_key}"))
+    builder.add(InlineKeyboardButton(text="🔙 Назад", callback_data="admin_reports"))
+    builder.adjust(1)
+    return builder.as_markup()
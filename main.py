@@ -2,15 +2,15 @@ import asyncio
 import logging
 import signal
 import sys
-from datetime import datetime, time, timedelta
-from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import config
-from db import db
+import periods
+from db import db, ShopCalendarMismatchError
+from db_metrics import metrics
 from handlers import order_handlers, admin_handlers, edit_handlers
-from middleware import DatabaseMiddleware, AccessMiddleware, set_database_available, is_database_available
+from middleware import DatabaseMiddleware, AccessMiddleware, UserContextMiddleware, set_database_available, is_database_available
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,21 +24,13 @@ import random
 from greetings import GREETING_MESSAGES
 
 async def send_daily_greeting_task(bot):
-    """Задача для отправки ежедневного приветствия в 9:00 по Уфе"""
+    """Задача для отправки ежедневного приветствия в 9:00 по времени мастерской"""
     while True:
         try:
-            # Используем Уфимское время (как в расчёте заработка)
-            tz = ZoneInfo("Asia/Yekaterinburg")
-            now_datetime = datetime.now(tz)
-            target_time = now_datetime.replace(hour=9, minute=0, second=0, microsecond=0)
-            
-            # Если уже прошло 9:00 сегодня, ждем до завтра
-            if now_datetime >= target_time:
-                target_time += timedelta(days=1)
-            
-            # Вычисляем секунды до следующего 9:00
-            wait_seconds = (target_time - now_datetime).total_seconds()
-            logger.info(f"⏰ Ожидание до следующего приветствия (9:00 по Уфе): {wait_seconds/3600:.1f} часов")
+            # Ближайшие 9:00 по часам мастерской (как в расчёте заработка)
+            target_time = periods.next_local_time(9)
+            wait_seconds = (target_time - periods.now()).total_seconds()
+            logger.info(f"⏰ Ожидание до следующего приветствия (9:00 по времени мастерской): {wait_seconds/3600:.1f} часов")
             
             # Ждем до 9:00
             await asyncio.sleep(wait_seconds)
@@ -73,6 +65,7 @@ async def check_unconfirmed_orders_task(bot):
             
             # Получаем заказы старше 30 минут без подтверждения
             unconfirmed_orders = await db.get_unconfirmed_orders_older_than(30)
+            sent_reminders = []
             
             for order in unconfirmed_orders:
                 try:
@@ -100,16 +93,16 @@ async def check_unconfirmed_orders_task(bot):
                             parse_mode="HTML"
                         )
                         
-                        # Сохраняем ID сообщения с напоминанием в базе для последующего удаления
-                        await db.save_reminder_message_id(order['id'], reminder_msg.message_id)
-                        
-                        # Помечаем заказ как напомненный
-                        await db.mark_order_as_reminded(order['id'])
+                        # ID сообщения с напоминанием сохраняется в базе для последующего удаления
+                        sent_reminders.append((order, reminder_msg.message_id))
                         
                         logger.info(f"⏰ Отправлено напоминание о заказе #{order['order_number']} ({profession_text})")
                     
                 except Exception as e:
                     logger.error(f"Ошибка отправки напоминания о заказе {order.get('id')}: {e}")
+            
+            # Помечаем заказы как напомненные одним запросом за всю проверку
+            await db.record_reminders(sent_reminders)
                     
         except Exception as e:
             logger.error(f"Ошибка в задаче проверки неподтвержденных заказов: {e}")
@@ -119,34 +112,42 @@ async def health_check_task():
     """Задача для периодической проверки состояния базы данных"""
     while True:
         try:
-            await asyncio.sleep(300)  # Проверяем каждые 5 минут
-            if not await db.health_check():
-                logger.warning("⚠️ База данных недоступна, попытка переподключения...")
-                try:
-                    await db.reconnect()
-                    # Дополнительная проверка после переподключения
-                    if await db.health_check():
-                        set_database_available(True)
-                        logger.info("✅ База данных восстановлена")
-                    else:
-                        set_database_available(False)
-                        logger.warning("⚠️ Переподключение выполнено, но health check не прошел")
-                except Exception as reconnect_error:
-                    logger.error(f"❌ Не удалось переподключиться к БД: {reconnect_error}")
-                    set_database_available(False)
-                    # Если база данных не существует, не пытаемся переподключиться
-                    if "не существует" in str(reconnect_error) or "does not exist" in str(reconnect_error):
-                        logger.error("❌ База данных не существует. Требуется ручное вмешательство.")
-                        await asyncio.sleep(600)  # Ждем 10 минут перед следующей попыткой
+            await asyncio.sleep(30)  # Проверяем каждые 30 секунд
+            if db.breaker.is_closed:
+                # Ошибки учитываются предохранителем; после серии ошибок он размыкается
+                if await db.health_check():
+                    # Переподписка на ленту изменений, если её соединение было потеряно
+                    await db.start_change_feed()
             else:
-                if not is_database_available():
-                    set_database_available(True)
-                    logger.info("✅ База данных снова доступна")
+                # Пробный запрос; при необходимости пул пересоздаётся и подменяется без закрытия текущих запросов
+                await db.ensure_available()
         except Exception as e:
             logger.error(f"❌ Ошибка в health check: {e}")
-            set_database_available(False)
             await asyncio.sleep(60)  # Ждем минуту при ошибке
 
+async def db_metrics_task():
+    """Задача для периодической сводки метрик запросов к базе данных"""
+    while True:
+        try:
+            await asyncio.sleep(config.DB_METRICS_LOG_INTERVAL)
+            metrics.log_summary()
+            metrics.reset()
+        except Exception as e:
+            logger.error(f"❌ Ошибка в сводке метрик БД: {e}")
+
+async def orders_partitions_task():
+    """Задача обслуживания секций orders: создание текущего и следующего месяца, перенос старых месяцев в архив"""
+    while True:
+        try:
+            if is_database_available():
+                current_month = periods.month_start()
+                await db.ensure_orders_partitions(current_month, periods.add_months(current_month, 1))
+                if config.ORDERS_ARCHIVE_KEEP_MONTHS > 0:
+                    await db.archive_closed_months(config.ORDERS_ARCHIVE_KEEP_MONTHS)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обслуживания секций orders: {e}")
+        await asyncio.sleep(6 * 3600)  # Проверяем каждые 6 часов
+
 async def graceful_shutdown(signum, frame):
     """Обработчик для корректного завершения работы"""
     logger.info("🛑 Получен сигнал завершения, закрываем соединения...")
@@ -179,11 +180,13 @@ async def main():
     bot = Bot(token=config.BOT_TOKEN)
     dp = Dispatcher(storage=MemoryStorage())
     
-    # Добавляем middleware: доступ и проверка БД
+    # Добавляем middleware: доступ, проверка БД и контекст пользователя
     dp.message.middleware(AccessMiddleware())
     dp.callback_query.middleware(AccessMiddleware())
     dp.message.middleware(DatabaseMiddleware())
     dp.callback_query.middleware(DatabaseMiddleware())
+    dp.message.middleware(UserContextMiddleware())
+    dp.callback_query.middleware(UserContextMiddleware())
     
     # Регистрируем роутеры (порядок важен!)
     # edit_handlers должен быть первым, чтобы обработать состояния поиска заказа
@@ -207,10 +210,15 @@ async def main():
                 # Дополнительная проверка после инициализации
                 if await db.health_check():
                     set_database_available(True)
+                    await db.start_change_feed()
                     logger.info("✅ База данных успешно инициализирована")
                     break
                 else:
                     raise Exception("Health check не прошел после инициализации")
+            except ShopCalendarMismatchError as calendar_error:
+                # Повторные попытки не помогут: на базе с данными календарь менять нельзя
+                logger.error(f"❌ {calendar_error}")
+                raise
             except Exception as db_error:
                 logger.warning(f"⚠️  Попытка {attempt + 1}/{max_retries} подключения к БД неудачна: {db_error}")
                 
@@ -231,6 +239,13 @@ async def main():
         # Запускаем задачу мониторинга базы данных
         health_task = asyncio.create_task(health_check_task())
         
+        # Запускаем задачу создания секций orders на следующий месяц
+        partitions_task = asyncio.create_task(orders_partitions_task())
+        
+        # Запускаем задачу сводки метрик запросов к БД
+        if config.DB_METRICS_LOG_INTERVAL > 0:
+            metrics_task = asyncio.create_task(db_metrics_task())
+        
         # Запускаем задачу проверки неподтвержденных заказов
         reminder_task = asyncio.create_task(check_unconfirmed_orders_task(bot))
         
@@ -251,6 +266,10 @@ async def main():
             reminder_task.cancel()
         if 'greeting_task' in locals():
             greeting_task.cancel()
+        if 'metrics_task' in locals():
+            metrics_task.cancel()
+        if 'partitions_task' in locals():
+            partitions_task.cancel()
         # Закрываем соединения
         logger.info("🔌 Закрытие соединений...")
         await db.close_pool()
@@ -1,19 +1,17 @@
 """
-Middleware для обработки недоступности базы данных и ограничения доступа
+Middleware для обработки недоступности базы данных, ограничения доступа и контекста пользователя
 """
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional
 import logging
 from config import config
+from db import db
 
 logger = logging.getLogger(__name__)
 
-# Глобальная переменная для отслеживания состояния БД
-_db_available = False
-
 class DatabaseMiddleware(BaseMiddleware):
-    """Middleware для проверки доступности базы данных"""
+    """Middleware для проверки доступности базы данных (по состоянию предохранителя пула)"""
     
     async def __call__(
         self,
@@ -23,8 +21,8 @@ class DatabaseMiddleware(BaseMiddleware):
     ) -> Any:
         """Проверяет доступность БД перед выполнением handler"""
         
-        # Проверяем доступность базы данных
-        if not _db_available:
+        # Предохранитель разомкнут - БД не трогаем (после паузы здесь же выполняется пробный запрос)
+        if not await db.ensure_available():
             # Если это сообщение от пользователя, отправляем уведомление
             if hasattr(event, 'message') and event.message:
                 try:
@@ -39,10 +37,35 @@ class DatabaseMiddleware(BaseMiddleware):
             logger.warning("Попытка использования БД при её недоступности")
             return
         
-        # Если БД доступна, выполняем handler
+        # Если БД доступна, выполняем handler (каждый запрос сам учитывается предохранителем)
+        return await handler(event, data)
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Middleware, загружающий пользователя один раз на апдейт (data["db_user"])"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Пользователя не создаём: модераторы и админы не должны попадать в users
+        tg_user = data.get("event_from_user")
+        data["db_user"] = await db.get_user_by_tg_id(tg_user.id) if tg_user else None
         return await handler(event, data)
 
 
+async def ensure_user(db_user: Optional[Dict[str, Any]], tg_user) -> Dict[str, Any]:
+    """Возвращает пользователя из контекста апдейта; регистрирует его или обновляет имя при необходимости"""
+    name = tg_user.full_name or tg_user.username or "Unknown"
+    if db_user and db_user['name'] == name:
+        return db_user
+
+    await db.get_or_create_user(tg_user.id, name)
+    return await db.get_user_by_tg_id(tg_user.id)
+
+
 class AccessMiddleware(BaseMiddleware):
     """Middleware для ограничения доступа к боту только для сотрудников"""
 
@@ -85,10 +108,12 @@ class AccessMiddleware(BaseMiddleware):
         return
 
 def set_database_available(status: bool):
-    """Устанавливает статус доступности базы данных"""
-    global _db_available
-    _db_available = status
+    """Устанавливает статус доступности базы данных (замыкает или размыкает предохранитель)"""
+    if status:
+        db.breaker.record_success()
+    else:
+        db.breaker.trip()
 
 def is_database_available() -> bool:
     """Проверяет доступность базы данных"""
-    return _db_available
+    return db.breaker.is_closed
@@ -0,0 +1,55 @@
+-- Базовые таблицы бота
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    tg_id BIGINT UNIQUE NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    profession VARCHAR(20) DEFAULT 'painter', -- 'painter' или 'sandblaster'
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица заказов (универсальная для всех профессий)
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    order_number VARCHAR(50) NOT NULL,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    set_type VARCHAR(20) NOT NULL, -- 'single', 'set', 'nakidka', 'suspensia'
+    size VARCHAR(10), -- 'R15', 'R16', 'R17' (NULL для насадок и суспортов)
+    alumochrome BOOLEAN DEFAULT FALSE,
+    suspensia_type VARCHAR(20), -- 'paint' или 'logo' (только для суспортов)
+    quantity INTEGER DEFAULT 1, -- количество суспортов
+    spraying_deep INTEGER DEFAULT 0, -- количество глубоких напылений
+    spraying_shallow INTEGER DEFAULT 0, -- количество неглубоких напылений
+    price INTEGER NOT NULL,
+    status VARCHAR(20) DEFAULT 'draft', -- 'draft', 'confirmed', 'rejected'
+    photo_file_id VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS earnings_adjustments (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    month_start DATE NOT NULL,
+    prep_delta INTEGER NOT NULL,
+    painting_delta INTEGER NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_earnings_adjustments_user_month ON earnings_adjustments(user_id, month_start);
+
+-- Таблица достижений
+CREATE TABLE IF NOT EXISTS user_achievements (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    achievement_id VARCHAR(50) NOT NULL,
+    earned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    announced BOOLEAN DEFAULT FALSE,
+    UNIQUE(user_id, achievement_id)
+);
+CREATE INDEX IF NOT EXISTS idx_achievements_user ON user_achievements(user_id);
+CREATE INDEX IF NOT EXISTS idx_achievements_announced ON user_achievements(announced);
+
+CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
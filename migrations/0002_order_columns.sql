@@ -0,0 +1,23 @@
+-- Профессии пользователей, поля пескоструйщика и супортов, напоминания, заказы 70/30
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profession VARCHAR(20) DEFAULT 'painter';
+UPDATE users SET profession = 'painter' WHERE profession IS NULL;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS suspensia_type VARCHAR(20);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS quantity INTEGER DEFAULT 1;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS spraying_deep INTEGER DEFAULT 0;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS spraying_shallow INTEGER DEFAULT 0;
+ALTER TABLE orders ALTER COLUMN size DROP NOT NULL;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS reminder_sent BOOLEAN DEFAULT FALSE;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS reminder_message_id BIGINT;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS painter_70_id INTEGER REFERENCES users(id);
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS painter_30_id INTEGER REFERENCES users(id);
+
+-- Профессия хранится только в users, уникальность номера - в пределах профессии
+ALTER TABLE orders DROP COLUMN IF EXISTS profession;
+ALTER TABLE orders DROP CONSTRAINT IF EXISTS orders_order_number_key;
+
+CREATE INDEX IF NOT EXISTS idx_orders_painter_70_id ON orders(painter_70_id) WHERE painter_70_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_orders_painter_30_id ON orders(painter_30_id) WHERE painter_30_id IS NOT NULL;
@@ -0,0 +1,14 @@
+-- Частичные индексы по подтверждённым заказам для запросов за период
+-- (created_at сравнивается напрямую с наивным UTC, без выражений над колонкой)
+
+CREATE INDEX IF NOT EXISTS idx_orders_confirmed_user_created
+ON orders(user_id, created_at) WHERE status = 'confirmed';
+
+CREATE INDEX IF NOT EXISTS idx_orders_confirmed_p70_created
+ON orders(painter_70_id, created_at) WHERE status = 'confirmed' AND painter_70_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_orders_confirmed_p30_created
+ON orders(painter_30_id, created_at) WHERE status = 'confirmed' AND painter_30_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_orders_confirmed_created
+ON orders(created_at) WHERE status = 'confirmed';
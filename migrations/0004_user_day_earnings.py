@@ -0,0 +1,67 @@
+"""
+Агрегат заработка по дням (ведётся инкрементально при изменении заказов)
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Пересчёт дневного заработка по ролям в том виде, в каком агрегат появился (день - местная дата).
+# SQL заморожен в миграции: дальнейшие изменения расчёта оформляются новыми миграциями.
+USER_DAY_EARNINGS_RECOMPUTE_SQL = """
+    SELECT user_id, day, role, SUM(amount) AS amount, COUNT(*)::INTEGER AS orders_count
+    FROM (
+        SELECT user_id,
+               (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Yekaterinburg')::DATE AS day,
+               'owner' AS role,
+               price::NUMERIC AS amount
+        FROM orders
+        WHERE status = 'confirmed'
+          AND user_id IS NOT NULL
+          AND (set_type NOT LIKE '70_30_%' OR painter_70_id IS NULL)
+
+        UNION ALL
+
+        SELECT painter_70_id,
+               (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Yekaterinburg')::DATE,
+               'share_70',
+               price * 0.7
+        FROM orders
+        WHERE status = 'confirmed'
+          AND set_type LIKE '70_30_%'
+          AND painter_70_id IS NOT NULL
+
+        UNION ALL
+
+        SELECT painter_30_id,
+               (created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Yekaterinburg')::DATE,
+               'share_30',
+               price * 0.3
+        FROM orders
+        WHERE status = 'confirmed'
+          AND set_type LIKE '70_30_%'
+          AND painter_30_id IS NOT NULL
+    ) AS shares
+    GROUP BY user_id, day, role
+"""
+
+
+async def upgrade(conn):
+    # Таблица могла быть создана до появления версионных миграций - тогда она уже заполнена
+    rollup_exists = await conn.fetchval("SELECT to_regclass('user_day_earnings') IS NOT NULL")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_day_earnings (
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            day DATE NOT NULL, -- локальный день (Уфа)
+            role VARCHAR(10) NOT NULL, -- 'owner', 'share_70', 'share_30'
+            amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, role)
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_user_day_earnings_day ON user_day_earnings(day)")
+    if not rollup_exists:
+        await conn.execute(f"""
+            INSERT INTO user_day_earnings (user_id, day, role, amount, orders_count)
+            {USER_DAY_EARNINGS_RECOMPUTE_SQL}
+        """)
+        logger.info("✅ Заполнен агрегат заработка user_day_earnings")
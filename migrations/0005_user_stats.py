@@ -0,0 +1,72 @@
+"""
+Накопительная статистика пользователей (ведётся инкрементально при изменении заказов)
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Пересчёт накопительной статистики в том виде, в каком появилась таблица user_stats.
+# SQL заморожен в миграции: дальнейшие изменения расчёта оформляются новыми миграциями.
+USER_STATS_RECOMPUTE_SQL = """
+    SELECT u.id AS user_id,
+           COALESCE(own.confirmed_orders, 0)::INTEGER AS confirmed_orders,
+           COALESCE(own.rejected_orders, 0)::INTEGER AS rejected_orders,
+           COALESCE(own.alumochrome_orders, 0)::INTEGER AS alumochrome_orders,
+           COALESCE(own.big_size_orders, 0)::INTEGER AS big_size_orders,
+           COALESCE(team.team_orders, 0)::INTEGER AS team_orders,
+           COALESCE(earn.lifetime_earnings, 0) AS lifetime_earnings
+    FROM users u
+    LEFT JOIN (
+        SELECT user_id,
+               COUNT(*) FILTER (WHERE status = 'confirmed') AS confirmed_orders,
+               COUNT(*) FILTER (WHERE status = 'rejected') AS rejected_orders,
+               COUNT(*) FILTER (WHERE status = 'confirmed' AND alumochrome = TRUE) AS alumochrome_orders,
+               COUNT(*) FILTER (WHERE status = 'confirmed' AND size IN ('R20', 'R21', 'R22', 'R23', 'R24')) AS big_size_orders
+        FROM orders
+        GROUP BY user_id
+    ) AS own ON own.user_id = u.id
+    LEFT JOIN (
+        SELECT painter_id, COUNT(DISTINCT id) AS team_orders
+        FROM (
+            SELECT id, painter_70_id AS painter_id FROM orders
+            WHERE status = 'confirmed' AND set_type LIKE '70_30_%' AND painter_70_id IS NOT NULL
+            UNION ALL
+            SELECT id, painter_30_id FROM orders
+            WHERE status = 'confirmed' AND set_type LIKE '70_30_%' AND painter_30_id IS NOT NULL
+        ) AS team_shares
+        GROUP BY painter_id
+    ) AS team ON team.painter_id = u.id
+    LEFT JOIN (
+        SELECT user_id, SUM(amount) AS lifetime_earnings
+        FROM (
+            SELECT user_id, price::NUMERIC AS amount FROM orders
+            WHERE status = 'confirmed' AND user_id IS NOT NULL
+              AND (set_type NOT LIKE '70_30_%' OR painter_70_id IS NULL)
+            UNION ALL
+            SELECT painter_70_id, price * 0.7 FROM orders
+            WHERE status = 'confirmed' AND set_type LIKE '70_30_%' AND painter_70_id IS NOT NULL
+            UNION ALL
+            SELECT painter_30_id, price * 0.3 FROM orders
+            WHERE status = 'confirmed' AND set_type LIKE '70_30_%' AND painter_30_id IS NOT NULL
+        ) AS shares
+        GROUP BY user_id
+    ) AS earn ON earn.user_id = u.id
+"""
+
+
+async def upgrade(conn):
+    stats_exists = await conn.fetchval("SELECT to_regclass('user_stats') IS NOT NULL")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            confirmed_orders INTEGER NOT NULL DEFAULT 0,
+            rejected_orders INTEGER NOT NULL DEFAULT 0,
+            alumochrome_orders INTEGER NOT NULL DEFAULT 0,
+            big_size_orders INTEGER NOT NULL DEFAULT 0, -- R20 и больше
+            team_orders INTEGER NOT NULL DEFAULT 0, -- участие в заказах 70/30
+            lifetime_earnings NUMERIC(14, 2) NOT NULL DEFAULT 0
+        )
+    """)
+    if not stats_exists:
+        await conn.execute(f"INSERT INTO user_stats {USER_STATS_RECOMPUTE_SQL}")
+        logger.info("✅ Заполнена статистика пользователей user_stats")
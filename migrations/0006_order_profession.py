@@ -0,0 +1,29 @@
+"""
+Уникальность номеров заказов в пределах профессии: профессия фиксируется
+в заказе при создании и защищена уникальным индексом
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def upgrade(conn):
+    await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS order_profession VARCHAR(20)")
+    await conn.execute("""
+        UPDATE orders o
+        SET order_profession = COALESCE(u.profession, 'painter')
+        FROM users u
+        WHERE o.user_id = u.id AND o.order_profession IS NULL
+    """)
+    await conn.execute("""
+        DO $$
+        BEGIN
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_profession_number
+            ON orders(order_profession, order_number);
+        EXCEPTION WHEN unique_violation THEN
+            RAISE WARNING 'duplicate order numbers, uq_orders_profession_number not created';
+        END
+        $$
+    """)
+    if not await conn.fetchval("SELECT to_regclass('uq_orders_profession_number') IS NOT NULL"):
+        logger.warning("⚠️ Найдены дубликаты номеров заказов - уникальный индекс не создан, удалите дубликаты и выполните CREATE UNIQUE INDEX вручную")
@@ -0,0 +1,115 @@
+"""
+Секционирование orders по месяцам created_at (границы - местный месяц, Уфа)
+
+Уникальный индекс по (order_profession, order_number) на секционированной таблице должен
+включать ключ секционирования, поэтому уникальность номеров переносится в реестр
+order_numbers, на который orders ссылается отложенным внешним ключом.
+"""
+import logging
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+ORDERS_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_painter_70_id ON orders(painter_70_id) WHERE painter_70_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_painter_30_id ON orders(painter_30_id) WHERE painter_30_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_confirmed_user_created ON orders(user_id, created_at) WHERE status = 'confirmed'",
+    "CREATE INDEX IF NOT EXISTS idx_orders_confirmed_p70_created ON orders(painter_70_id, created_at) WHERE status = 'confirmed' AND painter_70_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_confirmed_p30_created ON orders(painter_30_id, created_at) WHERE status = 'confirmed' AND painter_30_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_confirmed_created ON orders(created_at) WHERE status = 'confirmed'",
+    "CREATE INDEX IF NOT EXISTS idx_orders_profession_number ON orders(order_profession, order_number)",
+)
+
+# Границы секций в том виде, в каком появилось секционирование: местный календарный месяц (Уфа).
+# Расчёт заморожен в миграции: дальнейшие изменения оформляются новыми миграциями.
+LOCAL_TZ = ZoneInfo("Asia/Yekaterinburg")
+UTC = ZoneInfo("UTC")
+
+
+def _add_months(month_start: date, months: int) -> date:
+    """Первое число месяца, отстоящего на months от month_start"""
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def local_month_start(value: datetime) -> date:
+    """Первое число местного месяца для наивного UTC (как в orders.created_at)"""
+    return value.replace(tzinfo=UTC).astimezone(LOCAL_TZ).date().replace(day=1)
+
+
+def orders_partition_sql(month_start: date) -> str:
+    """DDL месячной секции orders: границы - начало местного месяца в наивном UTC"""
+    next_month = _add_months(month_start, 1)
+    start_utc = datetime(month_start.year, month_start.month, 1, tzinfo=LOCAL_TZ).astimezone(UTC)
+    end_utc = datetime(next_month.year, next_month.month, 1, tzinfo=LOCAL_TZ).astimezone(UTC)
+    return (
+        f"CREATE TABLE IF NOT EXISTS orders_{month_start:%Y_%m} PARTITION OF orders "
+        f"FOR VALUES FROM ('{start_utc:%Y-%m-%d %H:%M:%S}') TO ('{end_utc:%Y-%m-%d %H:%M:%S}')"
+    )
+
+
+async def upgrade(conn):
+    if await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = 'orders'::regclass"):
+        return
+
+    # Ключ секционирования не может быть NULL
+    await conn.execute("UPDATE orders SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL")
+
+    await conn.execute("ALTER TABLE orders RENAME TO orders_legacy")
+    await conn.execute("""
+        CREATE TABLE orders (LIKE orders_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at)
+    """)
+    await conn.execute("ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL")
+    # Последовательность id остаётся прежней, но теперь принадлежит новой таблице
+    id_sequence = await conn.fetchval("SELECT pg_get_serial_sequence('orders_legacy', 'id')")
+    await conn.execute(f"ALTER SEQUENCE {id_sequence} OWNED BY orders.id")
+
+    # Секции: от первого месяца с заказами до следующего за текущим; DEFAULT - страховка
+    bounds = await conn.fetchrow("SELECT MIN(created_at) AS first, MAX(created_at) AS last FROM orders_legacy")
+    now = datetime.utcnow()
+    month = local_month_start(bounds['first'] or now)
+    last_month = _add_months(max(local_month_start(bounds['last'] or now), local_month_start(now)), 1)
+    partitions = 0
+    while month <= last_month:
+        await conn.execute(orders_partition_sql(month))
+        month = _add_months(month, 1)
+        partitions += 1
+    await conn.execute("CREATE TABLE IF NOT EXISTS orders_default PARTITION OF orders DEFAULT")
+
+    await conn.execute("INSERT INTO orders SELECT * FROM orders_legacy")
+    await conn.execute("DROP TABLE orders_legacy")
+
+    # Реестр номеров заказов: уникальность в пределах профессии для всех секций сразу
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_numbers (
+            order_profession VARCHAR(20) NOT NULL,
+            order_number VARCHAR(50) NOT NULL,
+            PRIMARY KEY (order_profession, order_number)
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO order_numbers (order_profession, order_number)
+        SELECT DISTINCT order_profession, order_number FROM orders
+        WHERE order_profession IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+
+    await conn.execute("ALTER TABLE orders ADD PRIMARY KEY (id, created_at)")
+    await conn.execute("ALTER TABLE orders ADD FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE")
+    await conn.execute("ALTER TABLE orders ADD FOREIGN KEY (painter_70_id) REFERENCES users(id)")
+    await conn.execute("ALTER TABLE orders ADD FOREIGN KEY (painter_30_id) REFERENCES users(id)")
+    await conn.execute("""
+        ALTER TABLE orders ADD CONSTRAINT fk_orders_order_number
+        FOREIGN KEY (order_profession, order_number) REFERENCES order_numbers (order_profession, order_number)
+        DEFERRABLE INITIALLY DEFERRED
+    """)
+    for index_sql in ORDERS_INDEXES:
+        await conn.execute(index_sql)
+
+    await conn.execute("ANALYZE orders")
+    logger.info(f"✅ Таблица orders секционирована по месяцам, секций: {partitions}")
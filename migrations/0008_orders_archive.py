@@ -0,0 +1,48 @@
+"""
+Холодный архив закрытых месяцев: секции orders переносятся в orders_archive целиком,
+по каждому пользователю за месяц остаётся строка итогов в user_month_summary
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def upgrade(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS orders_archive (LIKE orders INCLUDING DEFAULTS)
+        PARTITION BY RANGE (created_at)
+    """)
+    # История заказов пользователя читается по убыванию даты
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_user_created ON orders_archive(user_id, created_at)")
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_archive_p70_created ON orders_archive(painter_70_id, created_at)
+        WHERE painter_70_id IS NOT NULL
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_archive_p30_created ON orders_archive(painter_30_id, created_at)
+        WHERE painter_30_id IS NOT NULL
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_id ON orders_archive(id)")
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_months (
+            month DATE PRIMARY KEY, -- первое число местного месяца
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_month_summary (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            month DATE NOT NULL,
+            orders_count INTEGER NOT NULL DEFAULT 0, -- все заказы месяца, включая участие в 70/30
+            confirmed_orders INTEGER NOT NULL DEFAULT 0,
+            rejected_orders INTEGER NOT NULL DEFAULT 0,
+            alumochrome_orders INTEGER NOT NULL DEFAULT 0,
+            big_size_orders INTEGER NOT NULL DEFAULT 0,
+            team_orders INTEGER NOT NULL DEFAULT 0,
+            earnings NUMERIC(14, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        )
+    """)
+    logger.info("✅ Созданы таблицы архива заказов")
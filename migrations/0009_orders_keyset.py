@@ -0,0 +1,52 @@
+"""
+Постраничный список заказов по ключу (created_at, id): индексы под каждую роль пользователя
+и счётчик всех заказов пользователя в user_stats вместо COUNT на каждой странице
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+KEYSET_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_created_id ON orders(user_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_p70_created_id ON orders(painter_70_id, created_at, id) WHERE painter_70_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_p30_created_id ON orders(painter_30_id, created_at, id) WHERE painter_30_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_user_created_id ON orders_archive(user_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_p70_created_id ON orders_archive(painter_70_id, created_at, id) WHERE painter_70_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_orders_archive_p30_created_id ON orders_archive(painter_30_id, created_at, id) WHERE painter_30_id IS NOT NULL",
+)
+
+# Индексы, которые полностью покрываются новыми (совпадает начало ключа)
+REDUNDANT_INDEXES = (
+    "idx_orders_user_id", "idx_orders_painter_70_id", "idx_orders_painter_30_id",
+    "idx_orders_archive_user_created", "idx_orders_archive_p70_created", "idx_orders_archive_p30_created",
+)
+
+# Все заказы пользователя (свои и участие в 70/30): живые заказы + итоги архивных месяцев.
+# SQL заморожен в миграции: дальнейшие изменения расчёта оформляются новыми миграциями.
+ORDERS_TOTAL_SQL = """
+    SELECT user_id, SUM(orders_total)::INTEGER AS orders_total
+    FROM (
+        SELECT member_id AS user_id, COUNT(DISTINCT id) AS orders_total
+        FROM orders,
+             LATERAL (VALUES (user_id), (painter_70_id), (painter_30_id)) AS m(member_id)
+        WHERE member_id IS NOT NULL
+        GROUP BY member_id
+        UNION ALL
+        SELECT user_id, SUM(orders_count) FROM user_month_summary
+        GROUP BY user_id
+    ) AS totals
+    GROUP BY user_id
+    HAVING SUM(orders_total) > 0
+"""
+
+
+async def upgrade(conn):
+    for index_sql in KEYSET_INDEXES:
+        await conn.execute(index_sql)
+    for index_name in REDUNDANT_INDEXES:
+        await conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+    await conn.execute("ALTER TABLE user_stats ADD COLUMN IF NOT EXISTS orders_total INTEGER NOT NULL DEFAULT 0")
+    await conn.execute(f"INSERT INTO user_stats (user_id, orders_total) {ORDERS_TOTAL_SQL} "
+                       "ON CONFLICT (user_id) DO UPDATE SET orders_total = EXCLUDED.orders_total")
+    logger.info("✅ Заполнен счётчик заказов пользователей user_stats.orders_total")
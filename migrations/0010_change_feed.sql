@@ -0,0 +1,44 @@
+-- Лента изменений для нескольких процессов бота: триггеры отправляют в канал db_changes
+-- короткое событие {"t": таблица, "op": "I"|"U"|"D", ...ключевые колонки строки}.
+-- Аргументы триггера: имя таблицы (для секций orders TG_TABLE_NAME - имя секции) и колонки события.
+-- Массовые операции отключают ленту в своей транзакции: SET LOCAL app.change_feed = 'off'.
+
+CREATE OR REPLACE FUNCTION notify_db_change() RETURNS trigger AS $$
+DECLARE
+    row_data JSONB;
+    payload JSONB;
+BEGIN
+    IF current_setting('app.change_feed', TRUE) = 'off' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        row_data := to_jsonb(OLD);
+    ELSE
+        row_data := to_jsonb(NEW);
+    END IF;
+
+    payload := jsonb_build_object('t', TG_ARGV[0], 'op', left(TG_OP, 1));
+    FOR i IN 1 .. TG_NARGS - 1 LOOP
+        payload := payload || jsonb_build_object(TG_ARGV[i], row_data -> TG_ARGV[i]);
+    END LOOP;
+
+    PERFORM pg_notify('db_changes', payload::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_change_feed ON users;
+CREATE TRIGGER users_change_feed
+AFTER INSERT OR UPDATE OR DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION notify_db_change('users', 'id', 'tg_id');
+
+DROP TRIGGER IF EXISTS orders_change_feed ON orders;
+CREATE TRIGGER orders_change_feed
+AFTER INSERT OR UPDATE OR DELETE ON orders
+FOR EACH ROW EXECUTE FUNCTION notify_db_change('orders', 'id', 'user_id', 'painter_70_id', 'painter_30_id', 'status');
+
+DROP TRIGGER IF EXISTS earnings_adjustments_change_feed ON earnings_adjustments;
+CREATE TRIGGER earnings_adjustments_change_feed
+AFTER INSERT OR UPDATE OR DELETE ON earnings_adjustments
+FOR EACH ROW EXECUTE FUNCTION notify_db_change('earnings_adjustments', 'id', 'user_id');
@@ -0,0 +1,7 @@
+-- Отчёты за произвольный диапазон дней читают агрегат user_day_earnings по дню для всех
+-- пользователей сразу: покрывающий индекс даёт index-only scan и для годового диапазона
+
+CREATE INDEX IF NOT EXISTS idx_user_day_earnings_day_cover
+ON user_day_earnings(day) INCLUDE (user_id, role, amount, orders_count);
+
+DROP INDEX IF EXISTS idx_user_day_earnings_day;
@@ -0,0 +1,26 @@
+-- Закрытие расчётного периода: итоги зарплаты за месяц замораживаются в payroll_snapshots.
+-- Чтения закрытых месяцев идут из снимков; изменения заказов закрытого месяца
+-- записываются корректировками (earnings_adjustments) в текущий открытый период.
+
+CREATE TABLE IF NOT EXISTS payroll_closed_months (
+    month DATE PRIMARY KEY, -- первое число расчётного месяца
+    users_count INTEGER NOT NULL DEFAULT 0,
+    closed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS payroll_snapshots (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    month DATE NOT NULL,
+    orders_count INTEGER NOT NULL DEFAULT 0,      -- подтверждённые заказы, включая доли 70/30
+    owner NUMERIC(14, 2) NOT NULL DEFAULT 0,      -- собственные заказы
+    share_70 NUMERIC(14, 2) NOT NULL DEFAULT 0,   -- доли 70% в заказах 70/30
+    share_30 NUMERIC(14, 2) NOT NULL DEFAULT 0,   -- доли 30% в заказах 70/30
+    prep_adjustment INTEGER NOT NULL DEFAULT 0,   -- корректировки месяца (подготовка)
+    painting_adjustment INTEGER NOT NULL DEFAULT 0, -- корректировки месяца (покраска)
+    total INTEGER NOT NULL DEFAULT 0,             -- итог к выплате с корректировками
+    prep INTEGER NOT NULL DEFAULT 0,              -- из итога: подготовка
+    painting INTEGER NOT NULL DEFAULT 0,          -- из итога: покраска
+    PRIMARY KEY (user_id, month)
+);
+
+CREATE INDEX IF NOT EXISTS idx_payroll_snapshots_month ON payroll_snapshots(month);
@@ -0,0 +1,7 @@
+-- Лента изменений для полученных ачивок: кэш ачивок сбрасывается, когда их выдаёт или удаляет
+-- другой процесс. Отметка об анонсе (announced) на набор ачивок не влияет и события не создаёт.
+
+DROP TRIGGER IF EXISTS user_achievements_change_feed ON user_achievements;
+CREATE TRIGGER user_achievements_change_feed
+AFTER INSERT OR DELETE OR UPDATE OF user_id, achievement_id ON user_achievements
+FOR EACH ROW EXECUTE FUNCTION notify_db_change('user_achievements', 'user_id');
@@ -0,0 +1,11 @@
+-- Календарь мастерской, по которому размечены данные базы: часовой пояс и час начала рабочих суток.
+-- От него зависят границы месячных секций orders, дни агрегата user_day_earnings, итоги архивных
+-- месяцев и снимки зарплаты. Строку записывает бот при первом запуске; если настройки
+-- BUSINESS_TIMEZONE / SHOP_DAY_CUTOVER_HOUR с ней расходятся, бот на базе с данными не запускается.
+
+CREATE TABLE IF NOT EXISTS shop_calendar (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id), -- единственная строка
+    timezone VARCHAR(64) NOT NULL,
+    cutover_hour INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,93 @@
+"""
+Версионные миграции схемы базы данных
+
+Файлы миграций лежат в этом каталоге и называются NNNN_описание.sql или NNNN_описание.py
+(Python-миграция объявляет async def upgrade(conn)). Применённые версии записываются в
+schema_migrations; каждая миграция выполняется в своей транзакции под advisory lock,
+поэтому несколько процессов бота не применят её дважды.
+"""
+import importlib.util
+import logging
+import os
+import re
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_(\w+)\.(sql|py)$")
+
+# Ключ advisory lock для применения миграций (общий для всех процессов бота)
+MIGRATIONS_LOCK_KEY = 7_241_001
+
+
+def load_migrations() -> List[Tuple[int, str, str]]:
+    """Список миграций (версия, имя, путь) по возрастанию версии"""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("Найдены миграции с одинаковыми номерами")
+    return migrations
+
+
+MIGRATIONS = load_migrations()
+LATEST_VERSION = MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+async def get_schema_version(conn) -> int:
+    """Текущая версия схемы (0, если миграции ещё не применялись)"""
+    if not await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+
+
+async def _apply(conn, version: int, name: str, path: str):
+    """Применяет одну миграцию и записывает её версию (в одной транзакции)"""
+    async with conn.transaction():
+        # Заполнение агрегатов на большой базе может идти дольше обычного statement_timeout
+        await conn.execute("SET LOCAL statement_timeout = 0")
+        if path.endswith(".sql"):
+            with open(path, encoding="utf-8") as f:
+                await conn.execute(f.read())
+        else:
+            spec = importlib.util.spec_from_file_location(f"migrations.m{version:04d}_{name}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            await module.upgrade(conn)
+        await conn.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+            version, name
+        )
+
+
+async def migrate(conn) -> int:
+    """Применяет недостающие миграции, возвращает число применённых"""
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Версию перечитываем под блокировкой: другой процесс мог успеть применить миграции
+        current = await get_schema_version(conn)
+        pending = [m for m in MIGRATIONS if m[0] > current]
+        if not pending:
+            return 0
+
+        logger.info(f"🔄 Выполнение миграций базы данных: версия {current} -> {LATEST_VERSION}")
+        for version, name, path in pending:
+            await _apply(conn, version, name, path)
+            logger.info(f"✅ Миграция {version:04d}_{name} применена")
+        logger.info("✅ Все миграции выполнены успешно")
+        return len(pending)
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
@@ -0,0 +1,150 @@
+"""
+Выгрузка заказов в CSV или XLSX для бухгалтерии
+
+Строки приходят из db.export_orders порциями серверного курсора и дописываются во временный
+файл в отдельном потоке: память не растёт с числом заказов, цикл событий не блокируется.
+XLSX пишется через XlsxWriter в режиме constant_memory; без него доступен только CSV.
+"""
+
+import asyncio
+import csv
+import logging
+import os
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, List, Optional
+
+import periods
+
+try:
+    import xlsxwriter
+    XLSX_AVAILABLE = True
+except ImportError:
+    XLSX_AVAILABLE = False
+    logging.warning("⚠️ XlsxWriter не установлен. Выгрузка заказов доступна только в CSV.")
+
+logger = logging.getLogger(__name__)
+
+# Колонки выгрузки: поле строки db.ORDERS_EXPORT_SQL и заголовок
+EXPORT_COLUMNS = [
+    ('id', 'ID'),
+    ('order_number', 'Номер заказа'),
+    ('created_at', 'Создан'),
+    ('user_name', 'Сотрудник'),
+    ('profession', 'Профессия'),
+    ('set_type', 'Тип'),
+    ('size', 'Размер'),
+    ('alumochrome', 'Алюмохром'),
+    ('quantity', 'Количество'),
+    ('price', 'Цена'),
+    ('status', 'Статус'),
+    ('painter_70_name', 'Маляр 70%'),
+    ('painter_30_name', 'Маляр 30%'),
+]
+
+PROFESSION_NAMES = {'painter': 'Маляр', 'sandblaster': 'Пескоструйщик'}
+STATUS_NAMES = {'draft': 'Черновик', 'confirmed': 'Подтвержден', 'rejected': 'Отклонен'}
+
+# Строк на листе XLSX (предел Excel, включая заголовок)
+XLSX_MAX_ROWS = 1_048_576
+
+
+def is_xlsx_available() -> bool:
+    """Проверяет, доступна ли выгрузка в XLSX"""
+    return XLSX_AVAILABLE
+
+
+def _cell(key: str, value: Any) -> Any:
+    """Значение ячейки: местное время, числа вместо Decimal, названия вместо кодов"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=periods.UTC)
+        return value.astimezone(periods.BUSINESS_TZ).strftime("%d.%m.%Y %H:%M")
+    if isinstance(value, bool):
+        return "да" if value else "нет"
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if key == 'profession':
+        return PROFESSION_NAMES.get(value, value)
+    if key == 'status':
+        return STATUS_NAMES.get(value, value)
+    return value
+
+
+class OrdersExportWriter:
+    """Пишет порции строк заказов во временный файл CSV ('csv') или XLSX ('xlsx')"""
+
+    def __init__(self, file_format: str):
+        if file_format == 'xlsx' and not XLSX_AVAILABLE:
+            raise ValueError("Выгрузка в XLSX недоступна: не установлен XlsxWriter")
+        if file_format not in ('csv', 'xlsx'):
+            raise ValueError(f"Неизвестный формат выгрузки: {file_format}")
+        self.format = file_format
+        self.path: Optional[str] = None
+        self.rows = 0
+        self._file = None
+        self._csv = None
+        self._workbook = None
+        self._sheet = None
+        self._sheet_row = 0
+
+    async def begin(self):
+        """Начинает файл заново (заголовок без строк)"""
+        await asyncio.to_thread(self._begin)
+
+    async def write_rows(self, rows: List[Any]):
+        """Дописывает порцию строк"""
+        await asyncio.to_thread(self._write_rows, rows)
+
+    async def finish(self) -> str:
+        """Закрывает файл и возвращает путь к нему"""
+        await asyncio.to_thread(self._close)
+        return self.path
+
+    def cleanup(self):
+        """Удаляет временный файл"""
+        self._close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def _begin(self):
+        self.cleanup()
+        fd, self.path = tempfile.mkstemp(prefix="orders_", suffix=f".{self.format}")
+        self.rows = 0
+        if self.format == 'csv':
+            # utf-8-sig и ';' - чтобы Excel с русской локалью открыл файл без мастера импорта
+            self._file = os.fdopen(fd, "w", encoding="utf-8-sig", newline="")
+            self._csv = csv.writer(self._file, delimiter=";")
+            self._csv.writerow([header for _, header in EXPORT_COLUMNS])
+        else:
+            os.close(fd)
+            self._workbook = xlsxwriter.Workbook(self.path, {'constant_memory': True})
+            self._add_sheet()
+
+    def _add_sheet(self):
+        self._sheet = self._workbook.add_worksheet()
+        self._sheet.write_row(0, 0, [header for _, header in EXPORT_COLUMNS])
+        self._sheet_row = 1
+
+    def _write_rows(self, rows: List[Any]):
+        for row in rows:
+            values = [_cell(key, row[key]) for key, _ in EXPORT_COLUMNS]
+            if self._csv:
+                self._csv.writerow(values)
+            else:
+                if self._sheet_row >= XLSX_MAX_ROWS:
+                    self._add_sheet()
+                self._sheet.write_row(self._sheet_row, 0, values)
+                self._sheet_row += 1
+        self.rows += len(rows)
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+        if self._workbook:
+            self._workbook.close()
+        self._file = self._csv = self._workbook = self._sheet = None
@@ -0,0 +1,118 @@
+"""
+Календарь мастерской: границы дня, недели, месяца, произвольного диапазона и расчётного периода
+
+Все периоды считаются в часовом поясе мастерской (config.BUSINESS_TIMEZONE). Рабочие сутки
+начинаются в config.SHOP_DAY_CUTOVER_HOUR: при значении 6 заказ в 02:00 ночи относится
+к предыдущему дню (и месяцу), как и вся ночная смена. Календарь, по которому размечены данные,
+записан в базе (shop_calendar): на базе с заказами бот с другими настройками не запускается.
+
+Окно периода - полуинтервал [start, end) дней мастерской и те же границы в наивном UTC
+(в таком виде хранится orders.created_at). Окна не меняются, поэтому кэшируются.
+"""
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional
+from zoneinfo import ZoneInfo
+from config import config
+
+UTC = ZoneInfo("UTC")
+BUSINESS_TZ = ZoneInfo(config.BUSINESS_TIMEZONE)
+CUTOVER_HOUR = config.SHOP_DAY_CUTOVER_HOUR
+
+
+class Period(NamedTuple):
+    """Период [start, end) в днях мастерской и его границы в наивном UTC"""
+    start: date
+    end: date
+    start_utc: datetime
+    end_utc: datetime
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days
+
+
+def add_months(month_start: date, months: int) -> date:
+    """Первое число месяца, отстоящего на months от month_start"""
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def now() -> datetime:
+    """Текущее время в часовом поясе мастерской"""
+    return datetime.now(BUSINESS_TZ)
+
+
+def shop_day(moment: Optional[datetime] = None) -> date:
+    """День мастерской для момента времени (наивное время считается UTC, по умолчанию - сейчас)"""
+    if moment is None:
+        local = now()
+    else:
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=UTC)
+        local = moment.astimezone(BUSINESS_TZ)
+    return (local - timedelta(hours=CUTOVER_HOUR)).date()
+
+
+def month_start(moment: Optional[datetime] = None) -> date:
+    """Первое число месяца мастерской для момента времени (по умолчанию - текущего)"""
+    return shop_day(moment).replace(day=1)
+
+
+@lru_cache(maxsize=4096)
+def day_start_utc(day: date) -> datetime:
+    """Начало дня мастерской в наивном UTC"""
+    local = datetime(day.year, day.month, day.day, CUTOVER_HOUR, tzinfo=BUSINESS_TZ)
+    return local.astimezone(UTC).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=1024)
+def range_window(start: date, end: date) -> Period:
+    """Произвольный период из дней мастерской [start, end)"""
+    return Period(start, end, day_start_utc(start), day_start_utc(end))
+
+
+def day_window(day: Optional[date] = None) -> Period:
+    """Сутки мастерской (по умолчанию - сегодняшние)"""
+    day = day or shop_day()
+    return range_window(day, day + timedelta(days=1))
+
+
+def week_window(day: Optional[date] = None) -> Period:
+    """Неделя с понедельника, в которую попадает день (по умолчанию - текущая)"""
+    day = day or shop_day()
+    start = day - timedelta(days=day.weekday())
+    return range_window(start, start + timedelta(days=7))
+
+
+def month_window(day: Optional[date] = None) -> Period:
+    """Месяц, в который попадает день (по умолчанию - текущий)"""
+    start = (day or shop_day()).replace(day=1)
+    return range_window(start, add_months(start, 1))
+
+
+def payroll_window(day: Optional[date] = None) -> Period:
+    """Расчётный период (месяц, к которому привязаны корректировки заработка), содержащий день"""
+    return month_window(day)
+
+
+def next_local_time(hour: int, minute: int = 0) -> datetime:
+    """Ближайшее наступление времени hour:minute по часам мастерской (строго в будущем)"""
+    current = now()
+    target = current.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= current:
+        target += timedelta(days=1)
+    return target
+
+
+def shop_time_sql(column: str) -> str:
+    """SQL-выражение: местное время столбца в наивном UTC, сдвинутое на начало рабочих суток"""
+    shifted = f"({column} AT TIME ZONE 'UTC' AT TIME ZONE '{BUSINESS_TZ.key}')"
+    if CUTOVER_HOUR:
+        shifted = f"({shifted} - INTERVAL '{CUTOVER_HOUR} hours')"
+    return shifted
+
+
+def shop_day_sql(column: str) -> str:
+    """SQL-выражение: день мастерской для столбца в наивном UTC"""
+    return f"{shop_time_sql(column)}::DATE"